@@ -2,9 +2,11 @@
 import os
 import time
 import logging
+import json
 import requests
+import aiohttp
 from urllib.parse import urljoin
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import asyncio
 from decouple import config
 import hashlib
@@ -12,6 +14,8 @@ import hmac
 import base64
 from email.utils import formatdate
 
+from resilience import Upstream, CircuitOpenError
+
 logger = logging.getLogger("amocrm_sync")
 
 AMO_BASE_URL = config("AMO_BASE_URL", "")  # e.g. "https://yourcompany.amocrm.ru"
@@ -39,6 +43,16 @@ else:
 AMO_CHAT_SCOPE_ID = config("AMO_CHAT_SCOPE_ID", "")  # must be provided to create chats
 AMO_CHAT_SECRET = config("AMO_CHAT_SECRET", "")      # secret for X-Signature if available
 
+# пул соединений общего асинхронного клиента
+AMO_POOL_SIZE = int(config("AMO_POOL_SIZE", "10"))
+AMO_HTTP_TIMEOUT = float(config("AMO_HTTP_TIMEOUT", "10"))
+# создание контактов/задач копится AMO_BATCH_WINDOW секунд и уходит одним запросом (API принимает до 50 штук)
+AMO_BATCH_WINDOW = float(config("AMO_BATCH_WINDOW", "0.3"))
+AMO_BATCH_SIZE = min(50, int(config("AMO_BATCH_SIZE", "50")))
+
+# предохранитель amoCRM; создание сущностей ждёт полный таймаут, поиск — адаптивный
+amocrm_upstream = Upstream("amocrm", max_timeout=AMO_HTTP_TIMEOUT)
+
 def _extract_id_from_response(j: Any, prefer_key: str | None = None) -> Optional[int]:
     try:
         if isinstance(j, list) and j:
@@ -86,6 +100,169 @@ def _full_url(path: str) -> str:
     base = (AMO_BASE_URL or "").rstrip('/')
     return urljoin(base + "/", path.lstrip("/"))
 
+def _handle_response(r: Any, expect_json: bool = True) -> Dict[str, Any]:
+    status = r.status_code
+    text = r.text or ""
+    parsed = _safe_json(r) if expect_json else None
+
+    if status in (401, 403):
+        error_detail = ""
+        if parsed and isinstance(parsed, dict):
+            error_detail = parsed.get("detail") or parsed.get("title") or ""
+        logger.error("AMO auth error %s: %s. Detail: %s. Проверьте AMO_ACCESS_TOKEN в .env файле - токен мог истечь или быть неверным.", 
+                    status, text[:1000], error_detail)
+        return {"ok": False, "status": status, "json": parsed, "text": text, "error": "auth", "detail": error_detail}
+    if status >= 400:
+        logger.error("AMO API returned %s: %s", status, text[:1000])
+        return {"ok": False, "status": status, "json": parsed, "text": text, "error": f"http_{status}"}
+    return {"ok": True, "status": status, "json": parsed, "text": text}
+
+def _contact_from_search(res: Dict[str, Any]) -> Optional[dict]:
+    if not res["ok"]:
+        if res.get("error") == "auth":
+            logger.error("Auth error while searching contact by phone. Status=%s", res["status"])
+        return None
+
+    data = res["json"]
+    if not data:
+        logger.debug("Empty/non-JSON response while searching contact by phone: %s", res["text"][:1000])
+        return None
+
+    items = None
+    if isinstance(data, dict):
+        emb = data.get("_embedded") or {}
+        items = emb.get("items") or emb.get("contacts") or emb.get("leads")
+    if items is None and isinstance(data, list):
+        items = data
+
+    if not items:
+        return None
+
+    if isinstance(items, list) and items:
+        return items[0] if isinstance(items[0], dict) else None
+
+    return None
+
+def _contact_payload(name: str, phones: list, responsible_user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    contact_obj: Dict[str, Any] = {"name": name}
+    if responsible_user_id:
+        contact_obj["responsible_user_id"] = responsible_user_id
+    if PHONE_FIELD_ID:
+        contact_obj["custom_fields_values"] = [
+            {"field_id": PHONE_FIELD_ID, "values": [{"value": p} for p in phones]}
+        ]
+    else:
+        contact_obj["custom_fields_values"] = []
+    return [contact_obj]
+
+def _task_payload(text: str, entity_id: int, timestamp: int, entity_type: str = 'contacts') -> List[Dict[str, Any]]:
+    payload = [
+        {
+            "text": text,
+            "complete_till": int(timestamp),
+            "entity_id": int(entity_id),
+            "entity_type": entity_type,
+        }
+    ]
+    if RESPONSIBLE_USER_ID:
+        payload[0]["responsible_user_id"] = RESPONSIBLE_USER_ID
+        logger.info(f"Creating task with responsible_user_id={RESPONSIBLE_USER_ID} for entity_id={entity_id}")
+    else:
+        logger.warning(f"RESPONSIBLE_USER_ID is not set (value: {RESPONSIBLE_USER_ID}), task will be created without responsible user")
+    return payload
+
+def _created_contact_id(res: Dict[str, Any]) -> Optional[int]:
+    if not res["ok"]:
+        logger.error("Create contact failed: status=%s body=%s", res["status"], res["text"][:1000])
+        return None
+
+    j = res["json"]
+    if not j:
+        logger.error("Create contact: empty JSON response")
+        return None
+
+    cid = _extract_id_from_response(j)
+    if cid:
+        return cid
+
+    logger.error("Unexpected create_contact response structure: %s", j)
+    return None
+
+def _created_task_id(res: Dict[str, Any]) -> Optional[int]:
+    if not res["ok"]:
+        logger.error("Create task failed: status=%s body=%s", res["status"], res["text"][:1000])
+        return None
+
+    j = res["json"]
+    if not j:
+        logger.error("Create task: empty JSON response")
+        return None
+
+    tid = _extract_id_from_response(j)
+    if tid:
+        logger.info(f"Task created successfully with id={tid}")
+        return tid
+
+    logger.error("Unexpected create_task response structure: %s", j)
+    return None
+
+def _chat_request(scope_id: str, contact_id: int, phone: Optional[str] = None,
+                  initial_message: Optional[str] = None) -> Tuple[str, Dict[str, Any], bytes, Dict[str, str]]:
+    """
+    URL, тело, байты тела и заголовки (Date, Content-MD5, X-Signature) для /v2/origin/custom/{scope_id}/chats.
+    """
+    path = f"v2/origin/custom/{scope_id}/chats"
+    url = _full_url(path)
+    # build body; keep typical structure
+    body: Dict[str, Any] = {
+        "origin": {
+            "type": "contacts",
+            "id": int(contact_id)
+        }
+    }
+    # meta with phone and optional initial text
+    meta = {}
+    if phone:
+        meta["phone"] = phone
+    if initial_message:
+        meta["initial_message"] = initial_message
+    if meta:
+        body["meta"] = meta
+
+    # prepare headers
+    body_bytes = bytes(json.dumps(body), "utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "Date": formatdate(timeval=None, usegmt=True)
+    }
+
+    # compute Content-MD5
+    try:
+        md5_digest = hashlib.md5(body_bytes).digest()
+        content_md5 = base64.b64encode(md5_digest).decode()
+        headers["Content-MD5"] = content_md5
+    except Exception:
+        headers["Content-MD5"] = ""
+
+    # if we have chat secret, compute X-Signature
+    if AMO_CHAT_SECRET:
+        try:
+            method = "POST"
+            sign_string = "\n".join([method.upper(), headers.get("Date", ""), headers.get("Content-Type", ""), headers.get("Content-MD5", ""), f"/{path.lstrip('/')}"])
+            mac = hmac.new(AMO_CHAT_SECRET.encode("utf-8"), sign_string.encode("utf-8"), hashlib.sha1)
+            signature = mac.hexdigest()
+            headers["X-Signature"] = signature
+        except Exception:
+            logger.exception("Failed to compute X-Signature")
+    return url, body, body_bytes, headers
+
+def _chat_result(res: Dict[str, Any]) -> Dict[str, Any]:
+    if not res["ok"]:
+        logger.error("Create chat failed: status=%s body=%s", res["status"], res["text"][:1000])
+        # return debug info
+        return {"ok": False, "status": res["status"], "text": res["text"]}
+    return res.get("json") or {}
+
 class AmoCRMSession:
     def __init__(self, base_url: str, access_token: str):
         if not base_url:
@@ -94,132 +271,37 @@ class AmoCRMSession:
         self.session = _build_session(access_token or "")
 
     def _handle_response(self, r: requests.Response, expect_json: bool = True) -> Dict[str, Any]:
-        status = r.status_code
-        text = r.text or ""
-        parsed = _safe_json(r) if expect_json else None
-
-        if status in (401, 403):
-            error_detail = ""
-            if parsed and isinstance(parsed, dict):
-                error_detail = parsed.get("detail") or parsed.get("title") or ""
-            logger.error("AMO auth error %s: %s. Detail: %s. Проверьте AMO_ACCESS_TOKEN в .env файле - токен мог истечь или быть неверным.", 
-                        status, text[:1000], error_detail)
-            return {"ok": False, "status": status, "json": parsed, "text": text, "error": "auth", "detail": error_detail}
-        if status >= 400:
-            logger.error("AMO API returned %s: %s", status, text[:1000])
-            return {"ok": False, "status": status, "json": parsed, "text": text, "error": f"http_{status}"}
-        return {"ok": True, "status": status, "json": parsed, "text": text}
+        return _handle_response(r, expect_json=expect_json)
 
     def get_contact_by_phone(self, phone: str) -> Optional[dict]:
         url = _full_url("api/v4/contacts")
         params = {"query": phone}
         try:
-            r = self.session.get(url, params=params, timeout=10)
-        except requests.RequestException:
+            r = amocrm_upstream.request(self.session.get, url, params=params, timeout=10)
+        except (requests.RequestException, CircuitOpenError):
             logger.exception("Network error while searching contact by phone")
             return None
-
-        res = self._handle_response(r, expect_json=True)
-        if not res["ok"]:
-            if res.get("error") == "auth":
-                logger.error("Auth error while searching contact by phone. Status=%s", res["status"])
-            return None
-
-        data = res["json"]
-        if not data:
-            logger.debug("Empty/non-JSON response while searching contact by phone: %s", r.text[:1000])
-            return None
-
-        items = None
-        if isinstance(data, dict):
-            emb = data.get("_embedded") or {}
-            items = emb.get("items") or emb.get("contacts") or emb.get("leads")
-        if items is None and isinstance(data, list):
-            items = data
-
-        if not items:
-            return None
-
-        if isinstance(items, list) and items:
-            return items[0] if isinstance(items[0], dict) else None
-
-        return None
+        return _contact_from_search(self._handle_response(r, expect_json=True))
 
     def create_contact(self, name: str, phones: list, responsible_user_id: Optional[int] = None) -> Optional[int]:
         url = _full_url("api/v4/contacts")
-        contact_obj = {"name": name}
-        if responsible_user_id:
-            contact_obj["responsible_user_id"] = responsible_user_id
-        if PHONE_FIELD_ID:
-            contact_obj["custom_fields_values"] = [
-                {"field_id": PHONE_FIELD_ID, "values": [{"value": p} for p in phones]}
-            ]
-        else:
-            contact_obj["custom_fields_values"] = []
-
-        payload = [contact_obj]
+        payload = _contact_payload(name, phones, responsible_user_id)
         try:
-            r = self.session.post(url, json=payload, timeout=10)
-        except requests.RequestException:
+            r = amocrm_upstream.request(self.session.post, url, json=payload, timeout=10, adaptive=False)
+        except (requests.RequestException, CircuitOpenError):
             logger.exception("Network error while creating contact")
             return None
-
-        res = self._handle_response(r, expect_json=True)
-        if not res["ok"]:
-            logger.error("Create contact failed: status=%s body=%s", res["status"], res["text"][:1000])
-            return None
-
-        j = res["json"]
-        if not j:
-            logger.error("Create contact: empty JSON response")
-            return None
-
-        cid = _extract_id_from_response(j)
-        if cid:
-            return cid
-
-        logger.error("Unexpected create_contact response structure: %s", j)
-        return None
+        return _created_contact_id(self._handle_response(r, expect_json=True))
 
     def create_task(self, text: str, entity_id: int, timestamp: int, entity_type: str = 'contacts') -> Optional[int]:
         url = _full_url("api/v4/tasks")
-        payload = [
-            {
-                "text": text,
-                "complete_till": int(timestamp),
-                "entity_id": int(entity_id),
-                "entity_type": entity_type,
-            }
-        ]
-        if RESPONSIBLE_USER_ID:
-            payload[0]["responsible_user_id"] = RESPONSIBLE_USER_ID
-            logger.info(f"Creating task with responsible_user_id={RESPONSIBLE_USER_ID} for entity_id={entity_id}")
-        else:
-            logger.warning(f"RESPONSIBLE_USER_ID is not set (value: {RESPONSIBLE_USER_ID}), task will be created without responsible user")
-
+        payload = _task_payload(text, entity_id, timestamp, entity_type)
         try:
-            r = self.session.post(url, json=payload, timeout=10)
-        except requests.RequestException:
+            r = amocrm_upstream.request(self.session.post, url, json=payload, timeout=10, adaptive=False)
+        except (requests.RequestException, CircuitOpenError):
             logger.exception("Network error while creating task")
             return None
-
-        res = self._handle_response(r, expect_json=True)
-        if not res["ok"]:
-            logger.error("Create task failed: status=%s body=%s", res["status"], res["text"][:1000])
-            return None
-
-        j = res["json"]
-        if not j:
-            logger.error("Create task: empty JSON response")
-            return None
-
-        tid = _extract_id_from_response(j)
-        if tid:
-            logger.info(f"Task created successfully with id={tid}")
-            return tid
-
-        logger.error("Unexpected create_task response structure: %s", j)
-        return None
+        return _created_task_id(self._handle_response(r, expect_json=True))
 
     def create_chat(self, scope_id: str, contact_id: int, phone: Optional[str] = None, initial_message: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
@@ -231,74 +313,252 @@ class AmoCRMSession:
             logger.error("create_chat: scope_id missing")
             return None
 
-        path = f"v2/origin/custom/{scope_id}/chats"
-        url = _full_url(path)
-        # build body; keep typical structure
-        body: Dict[str, Any] = {
-            "origin": {
-                "type": "contacts",
-                "id": int(contact_id)
-            }
-        }
-        # meta with phone and optional initial text
-        meta = {}
-        if phone:
-            meta["phone"] = phone
-        if initial_message:
-            meta["initial_message"] = initial_message
-        if meta:
-            body["meta"] = meta
-
-        # prepare headers
-        body_bytes = bytes(requests.utils.json.dumps(body), "utf-8")
-        headers = {
-            "Content-Type": "application/json",
-            "Date": formatdate(timeval=None, usegmt=True)
-        }
+        url, body, _, headers = _chat_request(scope_id, contact_id, phone, initial_message)
+        # Authorization header already present in session
+        try:
+            r = amocrm_upstream.request(self.session.post, url, json=body, headers=headers, timeout=10, adaptive=False)
+        except (requests.RequestException, CircuitOpenError):
+            logger.exception("Network error while creating chat")
+            return None
+        return _chat_result(self._handle_response(r, expect_json=True))
+
+
+class _AmoResponse:
+    """
+    Прочитанный ответ aiohttp с тем же интерфейсом, что у requests.Response (status_code, text, json()).
+    """
+
+    def __init__(self, status_code: int, text: str):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+def _ids_by_request_id(j: Any, entity: str) -> Dict[str, int]:
+    """
+    {request_id: id} из ответа на пакетное создание; без request_id — по порядку элементов.
+    """
+    items = []
+    if isinstance(j, dict):
+        emb = j.get("_embedded") or {}
+        items = emb.get(entity) or emb.get("items") or []
+    elif isinstance(j, list):
+        items = j
+    out: Dict[str, int] = {}
+    for pos, it in enumerate(items):
+        if not isinstance(it, dict) or not it.get("id"):
+            continue
+        try:
+            out[str(it.get("request_id", pos))] = int(it["id"])
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+class _AmoBatcher:
+    """
+    Копит создания одной сущности (contacts или tasks) от параллельных вызовов и отправляет их
+    одним POST: через window секунд после первого элемента или сразу при max_size элементах.
+    Каждому элементу проставляется request_id, по нему id из ответа возвращается своему вызову.
+    Если amoCRM отклонил пакет целиком (4xx), элементы отправляются по одному, чтобы ошибка
+    одного не ломала остальные.
+    """
+
+    def __init__(self, client: "AsyncAmoCRMClient", path: str, entity: str,
+                 window: float = AMO_BATCH_WINDOW, max_size: int = AMO_BATCH_SIZE):
+        self.client = client
+        self.path = path
+        self.entity = entity
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: set = set()
+
+    async def submit(self, item: Dict[str, Any]) -> Optional[int]:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_size:
+            self._spawn(self._send(self._take()))
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+        return await fut
+
+    def _take(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        return batch
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._timer = None
+        while self._pending:
+            await self._send(self._take())
 
-        # compute Content-MD5
+    async def drain(self) -> None:
+        """
+        Отправляет накопленное и дожидается всех запросов (перед закрытием сессии).
+        """
+        while self._pending:
+            await self._send(self._take())
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        if not batch:
+            return
         try:
-            md5_digest = hashlib.md5(body_bytes).digest()
-            content_md5 = base64.b64encode(md5_digest).decode()
-            headers["Content-MD5"] = content_md5
+            ids = await self._create(batch)
         except Exception:
-            headers["Content-MD5"] = ""
-
-        # if we have chat secret, compute X-Signature
-        if AMO_CHAT_SECRET:
-            try:
-                method = "POST"
-                sign_string = "\n".join([method.upper(), headers.get("Date", ""), headers.get("Content-Type", ""), headers.get("Content-MD5", ""), f"/{path.lstrip('/')}"])
-                mac = hmac.new(AMO_CHAT_SECRET.encode("utf-8"), sign_string.encode("utf-8"), hashlib.sha1)
-                signature = mac.hexdigest()
-                headers["X-Signature"] = signature
-            except Exception:
-                logger.exception("Failed to compute X-Signature")
-        # Authorization header already present in session
+            logger.exception("Batch create of %s failed", self.entity)
+            ids = {}
+        for n, (_, fut) in enumerate(batch):
+            if not fut.done():
+                fut.set_result(ids.get(str(n)))
+
+    async def _create(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> Dict[str, int]:
+        payload = [dict(item, request_id=str(n)) for n, (item, _) in enumerate(batch)]
+        try:
+            r = await self.client._request("POST", _full_url(self.path), json=payload, adaptive=False)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
+            logger.exception("Network error while creating %s (%d in batch)", self.entity, len(batch))
+            return {}
+        res = _handle_response(r, expect_json=True)
+        if res["ok"]:
+            ids = _ids_by_request_id(res["json"], self.entity)
+            logger.info("amoCRM: created %d of %d %s in one request", len(ids), len(batch), self.entity)
+            if len(ids) < len(batch):
+                logger.error("Unexpected batch create %s response structure: %s", self.entity, res["json"])
+            return ids
+        if len(batch) > 1 and 400 <= res["status"] < 500 and res.get("error") != "auth":
+            logger.warning("amoCRM rejected batch of %d %s, sending one by one", len(batch), self.entity)
+            ids = {}
+            for n, entry in enumerate(batch):
+                one = await self._create([entry])
+                if "0" in one:
+                    ids[str(n)] = one["0"]
+            return ids
+        logger.error("Create %s failed: status=%s body=%s", self.entity, res["status"], res["text"][:1000])
+        return {}
+
+
+class AsyncAmoCRMClient:
+    """
+    Асинхронный клиент amoCRM поверх одной aiohttp-сессии с пулом соединений:
+    TCP+TLS переиспользуются между вызовами, потоки executor-а не заняты на время ожидания.
+    """
+
+    def __init__(self, base_url: str = AMO_BASE_URL, access_token: str = AMO_ACCESS_TOKEN,
+                 pool_size: int = AMO_POOL_SIZE, timeout: float = AMO_HTTP_TIMEOUT):
+        self.base_url = (base_url or "").rstrip('/')
+        self.access_token = access_token or ""
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._contacts = _AmoBatcher(self, "api/v4/contacts", "contacts")
+        self._tasks = _AmoBatcher(self, "api/v4/tasks", "tasks")
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers={
+                "Authorization": f"Bearer {self.access_token}" if self.access_token else "",
+                "Content-Type": "application/json",
+                "User-Agent": "kuper-bot/1.0"
+            })
+        return self._session
+
+    async def start(self) -> None:
+        if self.base_url:
+            await self._get_session()
+
+    async def close(self) -> None:
+        for batcher in (self._contacts, self._tasks):
+            await batcher.drain()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, url: str, adaptive: bool = True, **kwargs) -> _AmoResponse:
+        if not self.base_url:
+            raise ValueError("AMO_BASE_URL is not configured")
+        session = await self._get_session()
+        with amocrm_upstream.call(ceiling=self.timeout, adaptive=adaptive) as call:
+            async with session.request(method, url, timeout=aiohttp.ClientTimeout(total=call.timeout), **kwargs) as resp:
+                text = await resp.text()
+                call.check_status(resp.status)
+                return _AmoResponse(resp.status, text)
+
+    async def get_contact_by_phone(self, phone: str) -> Optional[dict]:
+        try:
+            r = await self._request("GET", _full_url("api/v4/contacts"), params={"query": phone})
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
+            logger.exception("Network error while searching contact by phone")
+            return None
+        return _contact_from_search(_handle_response(r, expect_json=True))
+
+    async def create_contact(self, name: str, phones: list, responsible_user_id: Optional[int] = None) -> Optional[int]:
+        """
+        Контакт создаётся в общем пакете с параллельными вызовами (см. _AmoBatcher).
+        """
+        return await self._contacts.submit(_contact_payload(name, phones, responsible_user_id)[0])
+
+    async def create_task(self, text: str, entity_id: int, timestamp: int, entity_type: str = 'contacts') -> Optional[int]:
+        task_id = await self._tasks.submit(_task_payload(text, entity_id, timestamp, entity_type)[0])
+        if task_id:
+            logger.info(f"Task created successfully with id={task_id}")
+        return task_id
+
+    async def create_chat(self, scope_id: str, contact_id: int, phone: Optional[str] = None,
+                          initial_message: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not scope_id:
+            logger.error("create_chat: scope_id missing")
+            return None
+        url, _, body_bytes, headers = _chat_request(scope_id, contact_id, phone, initial_message)
+        # отправляем ровно те байты, от которых посчитаны Content-MD5 и подпись
         try:
-            r = self.session.post(url, json=body, headers=headers, timeout=10)
-        except requests.RequestException:
+            r = await self._request("POST", url, data=body_bytes, headers=headers, adaptive=False)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
             logger.exception("Network error while creating chat")
             return None
+        return _chat_result(_handle_response(r, expect_json=True))
 
-        res = self._handle_response(r, expect_json=True)
-        if not res["ok"]:
-            logger.error("Create chat failed: status=%s body=%s", res["status"], res["text"][:1000])
-            # return debug info
-            return {"ok": False, "status": res["status"], "text": res["text"]}
-        return res.get("json") or {}
 
-# --- async wrappers (to not block event loop) ----------------
+_amocrm_client: Optional[AsyncAmoCRMClient] = None
+
+
+def get_amocrm_client() -> AsyncAmoCRMClient:
+    """
+    Общий асинхронный клиент amoCRM (одна aiohttp-сессия на процесс).
+    """
+    global _amocrm_client
+    if _amocrm_client is None:
+        _amocrm_client = AsyncAmoCRMClient()
+    return _amocrm_client
+
+
+async def close_amocrm_client() -> None:
+    global _amocrm_client
+    if _amocrm_client is not None:
+        await _amocrm_client.close()
+        _amocrm_client = None
+
+# --- async API (не блокирует event loop) ----------------
 async def find_contact_by_phone_async(phone: str) -> Optional[dict]:
     if not AMO_BASE_URL:
         logger.error("AMO_BASE_URL not configured")
         return None
-
-    def sync():
-        s = AmoCRMSession(AMO_BASE_URL, AMO_ACCESS_TOKEN)
-        return s.get_contact_by_phone(phone)
     try:
-        return await asyncio.to_thread(sync)
+        return await get_amocrm_client().get_contact_by_phone(phone)
     except Exception:
         logger.exception("find_contact_by_phone_async failed")
         return None
@@ -307,11 +567,8 @@ async def create_contact_async(name: str, phones: list, responsible_user_id: Opt
     if not AMO_BASE_URL:
         logger.error("AMO_BASE_URL not configured")
         return None
-    def sync():
-        s = AmoCRMSession(AMO_BASE_URL, AMO_ACCESS_TOKEN)
-        return s.create_contact(name=name, phones=phones, responsible_user_id=responsible_user_id)
     try:
-        return await asyncio.to_thread(sync)
+        return await get_amocrm_client().create_contact(name=name, phones=phones, responsible_user_id=responsible_user_id)
     except Exception:
         logger.exception("create_contact_async failed")
         return None
@@ -320,11 +577,8 @@ async def create_task_async(text: str, entity_id: int, timestamp: int, entity_ty
     if not AMO_BASE_URL:
         logger.error("AMO_BASE_URL not configured")
         return None
-    def sync():
-        s = AmoCRMSession(AMO_BASE_URL, AMO_ACCESS_TOKEN)
-        return s.create_task(text=text, entity_id=entity_id, timestamp=timestamp, entity_type=entity_type)
     try:
-        return await asyncio.to_thread(sync)
+        return await get_amocrm_client().create_task(text=text, entity_id=entity_id, timestamp=timestamp, entity_type=entity_type)
     except Exception:
         logger.exception("create_task_async failed")
         return None
@@ -336,11 +590,8 @@ async def create_chat_async(scope_id: str, contact_id: int, phone: Optional[str]
     if not AMO_BASE_URL:
         logger.error("AMO_BASE_URL not configured")
         return None
-    def sync():
-        s = AmoCRMSession(AMO_BASE_URL, AMO_ACCESS_TOKEN)
-        return s.create_chat(scope_id=scope_id, contact_id=contact_id, phone=phone, initial_message=initial_message)
     try:
-        return await asyncio.to_thread(sync)
+        return await get_amocrm_client().create_chat(scope_id=scope_id, contact_id=contact_id, phone=phone, initial_message=initial_message)
     except Exception:
         logger.exception("create_chat_async failed")
         return None
@@ -466,8 +717,8 @@ def get_all_leads_sync(session: AmoCRMSession, limit: int = 250):
         url = _full_url("api/v4/leads")
         params = {"page": page, "limit": limit}
         try:
-            r = session.session.get(url, params=params, timeout=10)
-        except requests.RequestException:
+            r = amocrm_upstream.request(session.session.get, url, params=params, timeout=10)
+        except (requests.RequestException, CircuitOpenError):
             logger.exception("Network error while fetching leads")
             break
         res = session._handle_response(r)
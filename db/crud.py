@@ -1,7 +1,17 @@
-from sqlalchemy import select
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, delete, update, or_, func, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import timedelta
 from decimal import Decimal
 from .db import get_session
-from .models import Users, InviteFriends, Statistics
+from .models import Users, InviteFriends, Statistics, UserLanguages, ReferFriendPromos, FirstOrderPromos, CompletedOrdersCoeffs, \
+    WithdrawalJobs
+
+# asyncpg ограничивает число параметров в одном запросе (32767)
+_UPSERT_CHUNK = 1000
 
 
 async def create_user(fio: str, phone: str, city: str = None, tg_id: int = None, consent_accepted: bool = False):
@@ -40,6 +50,17 @@ async def get_all_users():
         return list(result.scalars().all())
 
 
+async def iter_all_users(batch_size: int = 1000):
+    """
+    Потоково отдаёт всех пользователей (серверный курсор, batch_size строк за раз).
+    """
+    async with get_session() as session:
+        q = select(Users).order_by(Users.id).execution_options(yield_per=batch_size)
+        result = await session.stream_scalars(q)
+        async for user in result:
+            yield user
+
+
 async def update_user_consent(tg_id: int, consent: bool):
     async with get_session() as session:
         q = select(Users).where(Users.tg_id == tg_id)
@@ -89,3 +110,242 @@ async def get_statistics_by_phone(phone: str):
         q = select(Statistics).where(Statistics.phone == phone)
         result = await session.execute(q)
         return result.scalars().first()
+
+
+async def get_user_language(tg_id: int) -> Optional[str]:
+    async with get_session() as session:
+        return await session.scalar(select(UserLanguages.lang).where(UserLanguages.tg_id == tg_id))
+
+
+async def set_user_language(tg_id: int, lang: str) -> None:
+    async with get_session() as session:
+        stmt = pg_insert(UserLanguages).values(tg_id=tg_id, lang=lang)
+        stmt = stmt.on_conflict_do_update(index_elements=[UserLanguages.tg_id],
+                                          set_={"lang": lang, "updated_at": func.now()})
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def _sync_sheet_rows(model, rows: List[Dict[str, Any]], total_rows: int) -> None:
+    """
+    Upsert строк зеркала по sheet_row. Строки ниже конца листа удаляются.
+    """
+    async with get_session() as session:
+        for i in range(0, len(rows), _UPSERT_CHUNK):
+            chunk = rows[i:i + _UPSERT_CHUNK]
+            stmt = pg_insert(model).values(chunk)
+            set_ = {k: stmt.excluded[k] for k in chunk[0] if k != "sheet_row"}
+            set_["synced_at"] = func.now()
+            stmt = stmt.on_conflict_do_update(index_elements=[model.sheet_row], set_=set_)
+            await session.execute(stmt)
+        await session.execute(delete(model).where(model.sheet_row > total_rows))
+        await session.commit()
+
+
+async def sync_refer_friend_promos(rows: List[Dict[str, Any]], total_rows: int) -> None:
+    await _sync_sheet_rows(ReferFriendPromos, rows, total_rows)
+
+
+async def sync_first_order_promos(rows: List[Dict[str, Any]], total_rows: int) -> None:
+    await _sync_sheet_rows(FirstOrderPromos, rows, total_rows)
+
+
+async def sync_completed_orders_coeffs(coeffs: Dict[int, float]) -> None:
+    async with get_session() as session:
+        await session.execute(delete(CompletedOrdersCoeffs))
+        if coeffs:
+            session.add_all([CompletedOrdersCoeffs(threshold=th, coeff=Decimal(str(c))) for th, c in coeffs.items()])
+        await session.commit()
+
+
+async def get_refer_friend_promos(phone10: str, tg: Optional[str] = None) -> List[ReferFriendPromos]:
+    """
+    Строки «Приведи друга» для пользователя плюс первая строка с описанием акции.
+    """
+    async with get_session() as session:
+        conds = []
+        if phone10:
+            conds += [ReferFriendPromos.inviter_phone10 == phone10, ReferFriendPromos.invited_phone10 == phone10]
+        if tg:
+            conds.append(ReferFriendPromos.inviter_tg == tg)
+        rows: Dict[int, ReferFriendPromos] = {}
+        if conds:
+            result = await session.execute(select(ReferFriendPromos).where(or_(*conds)))
+            rows.update({r.sheet_row: r for r in result.scalars().all()})
+        q = (select(ReferFriendPromos)
+             .where(or_(ReferFriendPromos.title != "", ReferFriendPromos.description != "", ReferFriendPromos.reward != ""))
+             .order_by(ReferFriendPromos.sheet_row)
+             .limit(1))
+        generic = (await session.execute(q)).scalars().first()
+        if generic is not None:
+            rows.setdefault(generic.sheet_row, generic)
+        return [rows[k] for k in sorted(rows)]
+
+
+async def get_first_order_promos_by_phone(phone10: str) -> List[FirstOrderPromos]:
+    async with get_session() as session:
+        q = select(FirstOrderPromos).where(FirstOrderPromos.phone10 == phone10).order_by(FirstOrderPromos.sheet_row)
+        result = await session.execute(q)
+        return list(result.scalars().all())
+
+
+async def get_completed_orders_coeffs() -> Dict[int, float]:
+    async with get_session() as session:
+        result = await session.execute(select(CompletedOrdersCoeffs))
+        return {r.threshold: float(r.coeff) for r in result.scalars().all()}
+
+
+async def count_mirrored_promos() -> int:
+    async with get_session() as session:
+        refer = await session.scalar(select(func.count()).select_from(ReferFriendPromos))
+        first = await session.scalar(select(func.count()).select_from(FirstOrderPromos))
+        return int(refer or 0) + int(first or 0)
+
+
+async def create_withdrawal_job(idempotency_key: str, **fields) -> Tuple[WithdrawalJobs, bool]:
+    """
+    Создаёт заявку на вывод. При повторе с тем же ключом возвращает уже существующую и created=False.
+    """
+    async with get_session() as session:
+        stmt = (pg_insert(WithdrawalJobs)
+                .values(idempotency_key=idempotency_key, status="pending", **fields)
+                .on_conflict_do_nothing(index_elements=[WithdrawalJobs.idempotency_key])
+                .returning(WithdrawalJobs.id))
+        created = (await session.execute(stmt)).scalar() is not None
+        await session.commit()
+        q = select(WithdrawalJobs).where(WithdrawalJobs.idempotency_key == idempotency_key)
+        return (await session.execute(q)).scalars().one(), created
+
+
+async def get_withdrawal_job(job_id: int) -> Optional[WithdrawalJobs]:
+    async with get_session() as session:
+        return await session.get(WithdrawalJobs, job_id)
+
+
+async def transition_withdrawal_job(job_id: int, from_status: str, to_status: str, **fields) -> bool:
+    """
+    Переводит заявку из from_status в to_status. False — заявка уже в другом статусе
+    (её обработал кто-то другой), так что двойное подтверждение ничего не делает.
+    """
+    async with get_session() as session:
+        q = (update(WithdrawalJobs)
+             .where(WithdrawalJobs.id == job_id, WithdrawalJobs.status == from_status)
+             .values(status=to_status, updated_at=func.now(), **fields))
+        result = await session.execute(q)
+        await session.commit()
+        return result.rowcount > 0
+
+
+def _driver_not_busy():
+    """
+    Условие «у водителя этой заявки нет другой выплаты в processing».
+    """
+    busy = aliased(WithdrawalJobs)
+    return ~exists().where(busy.user_phone == WithdrawalJobs.user_phone, busy.status == "processing")
+
+
+async def _claim(session, q) -> Optional[WithdrawalJobs]:
+    # две заявки одного водителя, взятые одновременно, упираются в ux_WithdrawalJobs_processing_phone:
+    # проигравший просто ничего не получает и возьмёт заявку позже
+    try:
+        job = (await session.execute(q)).scalars().first()
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return None
+    return job
+
+
+async def claim_withdrawal_job(owner: str) -> Optional[WithdrawalJobs]:
+    """
+    Забирает самую старую одобренную заявку в работу (approved -> processing) от имени экземпляра owner.
+    SKIP LOCKED: несколько воркеров (и процессов) не получат одну и ту же заявку. Заявки водителя,
+    у которого уже идёт выплата, ждут её окончания — вторая выплата должна увидеть новый баланс.
+    """
+    async with get_session() as session:
+        next_id = (select(WithdrawalJobs.id)
+                   .where(WithdrawalJobs.status == "approved", _driver_not_busy())
+                   .order_by(WithdrawalJobs.id)
+                   .limit(1)
+                   .with_for_update(skip_locked=True)
+                   .scalar_subquery())
+        q = (update(WithdrawalJobs)
+             .where(WithdrawalJobs.id == next_id, WithdrawalJobs.status == "approved")
+             .values(status="processing", owner=owner, heartbeat_at=func.now(), updated_at=func.now())
+             .returning(WithdrawalJobs)
+             .execution_options(synchronize_session=False))
+        return await _claim(session, q)
+
+
+async def touch_withdrawal_jobs(owner: str) -> int:
+    """
+    Продлевает аренду всех заявок в processing, которые выполняет экземпляр owner.
+    """
+    async with get_session() as session:
+        q = (update(WithdrawalJobs)
+             .where(WithdrawalJobs.status == "processing", WithdrawalJobs.owner == owner)
+             .values(heartbeat_at=func.now()))
+        result = await session.execute(q)
+        await session.commit()
+        return result.rowcount
+
+
+async def fail_expired_withdrawal_jobs(lease_seconds: float, reason: str = "interrupted") -> List[WithdrawalJobs]:
+    """
+    Заявки в processing, чей экземпляр не продлевал аренду дольше lease_seconds (упал или завис),
+    переводятся в failed, а не повторяются: транзакция в Jump могла уже создаться, повтор означал бы двойную выплату.
+    Заявки, которые живые экземпляры ещё выполняют, не трогаются.
+    """
+    deadline = func.now() - timedelta(seconds=lease_seconds)
+    async with get_session() as session:
+        q = (update(WithdrawalJobs)
+             .where(WithdrawalJobs.status == "processing",
+                    func.coalesce(WithdrawalJobs.heartbeat_at, WithdrawalJobs.updated_at) < deadline)
+             .values(status="failed", reason=reason, updated_at=func.now())
+             .returning(WithdrawalJobs)
+             .execution_options(synchronize_session=False))
+        jobs = list((await session.execute(q)).scalars().all())
+        await session.commit()
+        return jobs
+
+
+async def get_pending_withdrawal_jobs(limit: int = 200) -> List[WithdrawalJobs]:
+    async with get_session() as session:
+        q = (select(WithdrawalJobs)
+             .where(WithdrawalJobs.status == "pending")
+             .order_by(WithdrawalJobs.id)
+             .limit(limit))
+        return list((await session.execute(q)).scalars().all())
+
+
+async def approve_pending_withdrawal_jobs(job_ids: Optional[List[int]], manager_id: int) -> List[WithdrawalJobs]:
+    """
+    Пакетное одобрение: переводит заявки из pending в approved одним UPDATE.
+    job_ids=None — все ожидающие. Заявки, которые уже обработаны, не попадают в результат.
+    """
+    async with get_session() as session:
+        conds = [WithdrawalJobs.status == "pending"]
+        if job_ids is not None:
+            conds.append(WithdrawalJobs.id.in_(job_ids))
+        q = (update(WithdrawalJobs)
+             .where(*conds)
+             .values(status="approved", manager_id=manager_id, updated_at=func.now())
+             .returning(WithdrawalJobs)
+             .execution_options(synchronize_session=False))
+        jobs = list((await session.execute(q)).scalars().all())
+        await session.commit()
+        return sorted(jobs, key=lambda j: j.id)
+
+
+async def claim_approved_withdrawal_job(job_id: int, owner: str) -> Optional[WithdrawalJobs]:
+    """
+    Берёт в работу конкретную одобренную заявку (approved -> processing). None — её уже взял воркер
+    или у этого водителя уже идёт другая выплата (тогда заявка остаётся approved и её возьмёт воркер).
+    """
+    async with get_session() as session:
+        q = (update(WithdrawalJobs)
+             .where(WithdrawalJobs.id == job_id, WithdrawalJobs.status == "approved", _driver_not_busy())
+             .values(status="processing", owner=owner, heartbeat_at=func.now(), updated_at=func.now())
+             .returning(WithdrawalJobs)
+             .execution_options(synchronize_session=False))
+        return await _claim(session, q)
@@ -0,0 +1,87 @@
+"""
+Миграция: таблицы-зеркала листов акций Google Sheets.
+Выполнить: python -m db.migrations.add_sheet_mirror_tables
+"""
+import asyncio
+from sqlalchemy import text
+from db.db import init_engine, dispose_engine
+
+
+TABLES = {
+    "ReferFriendPromos": """
+        CREATE TABLE "ReferFriendPromos" (
+            id SERIAL PRIMARY KEY,
+            sheet_row INTEGER NOT NULL UNIQUE,
+            inviter_phone VARCHAR(40),
+            inviter_phone10 VARCHAR(10),
+            inviter_name VARCHAR(255),
+            inviter_tg VARCHAR(64),
+            invited_phone VARCHAR(40),
+            invited_phone10 VARCHAR(10),
+            invited_name VARCHAR(255),
+            invited_tg VARCHAR(64),
+            status VARCHAR(100),
+            payout VARCHAR(100),
+            friend_order VARCHAR(100),
+            title VARCHAR(255),
+            description VARCHAR(2048),
+            reward VARCHAR(255),
+            synced_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """,
+    "FirstOrderPromos": """
+        CREATE TABLE "FirstOrderPromos" (
+            id SERIAL PRIMARY KEY,
+            sheet_row INTEGER NOT NULL UNIQUE,
+            phone VARCHAR(40),
+            phone10 VARCHAR(10),
+            title VARCHAR(255),
+            description VARCHAR(2048),
+            reward VARCHAR(255),
+            status VARCHAR(100),
+            synced_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """,
+    "CompletedOrdersCoeffs": """
+        CREATE TABLE "CompletedOrdersCoeffs" (
+            threshold INTEGER PRIMARY KEY,
+            coeff NUMERIC(12, 4) NOT NULL,
+            synced_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """,
+}
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS "ix_ReferFriendPromos_inviter_phone10" ON "ReferFriendPromos"(inviter_phone10)',
+    'CREATE INDEX IF NOT EXISTS "ix_ReferFriendPromos_invited_phone10" ON "ReferFriendPromos"(invited_phone10)',
+    'CREATE INDEX IF NOT EXISTS "ix_ReferFriendPromos_inviter_tg" ON "ReferFriendPromos"(inviter_tg)',
+    'CREATE INDEX IF NOT EXISTS "ix_FirstOrderPromos_phone10" ON "FirstOrderPromos"(phone10)',
+]
+
+
+async def add_sheet_mirror_tables():
+    """Создает таблицы зеркала Google Sheets и индексы по телефону."""
+    engine = init_engine()
+    try:
+        async with engine.begin() as conn:
+            for name, create_query in TABLES.items():
+                check_query = text("""
+                    SELECT table_name 
+                    FROM information_schema.tables 
+                    WHERE table_name=:name
+                """)
+                result = await conn.execute(check_query, {"name": name})
+                if result.fetchone() is None:
+                    await conn.execute(text(create_query))
+                    print(f"✓ Таблица {name} успешно создана")
+                else:
+                    print(f"✓ Таблица {name} уже существует")
+
+            for index_query in INDEXES:
+                await conn.execute(text(index_query))
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(add_sheet_mirror_tables())
@@ -0,0 +1,41 @@
+"""
+Миграция для добавления таблицы UserLanguages (выбранный пользователем язык).
+Выполнить: python -m db.migrations.add_user_languages_table
+"""
+import asyncio
+from sqlalchemy import text
+from db.db import init_engine, dispose_engine
+
+
+async def add_user_languages_table():
+    """Создает таблицу UserLanguages: tg_id -> код языка."""
+    engine = init_engine()
+    try:
+        async with engine.begin() as conn:
+            # Проверяем, существует ли таблица
+            check_query = text("""
+                SELECT table_name 
+                FROM information_schema.tables 
+                WHERE table_name='UserLanguages'
+            """)
+            result = await conn.execute(check_query)
+            exists = result.fetchone() is not None
+
+            if not exists:
+                create_table_query = text("""
+                    CREATE TABLE "UserLanguages" (
+                        tg_id BIGINT PRIMARY KEY,
+                        lang VARCHAR(8) NOT NULL,
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                    )
+                """)
+                await conn.execute(create_table_query)
+                print("✓ Таблица UserLanguages успешно создана")
+            else:
+                print("✓ Таблица UserLanguages уже существует")
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(add_user_languages_table())
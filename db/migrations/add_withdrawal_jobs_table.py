@@ -0,0 +1,67 @@
+"""
+Миграция для добавления таблицы WithdrawalJobs (очередь заявок на вывод).
+Выполнить: python -m db.migrations.add_withdrawal_jobs_table
+"""
+import asyncio
+from sqlalchemy import text
+from db.db import init_engine, dispose_engine
+
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS "ix_WithdrawalJobs_status" ON "WithdrawalJobs"(status)',
+    'CREATE INDEX IF NOT EXISTS "ix_WithdrawalJobs_user_id" ON "WithdrawalJobs"(user_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "ux_WithdrawalJobs_processing_phone" ON "WithdrawalJobs"(user_phone) '
+    "WHERE status = 'processing'",
+]
+
+
+async def add_withdrawal_jobs_table():
+    """Создает таблицу WithdrawalJobs и индексы по статусу и пользователю."""
+    engine = init_engine()
+    try:
+        async with engine.begin() as conn:
+            # Проверяем, существует ли таблица
+            check_query = text("""
+                SELECT table_name 
+                FROM information_schema.tables 
+                WHERE table_name='WithdrawalJobs'
+            """)
+            result = await conn.execute(check_query)
+            exists = result.fetchone() is not None
+
+            if not exists:
+                create_table_query = text("""
+                    CREATE TABLE "WithdrawalJobs" (
+                        id SERIAL PRIMARY KEY,
+                        idempotency_key VARCHAR(64) NOT NULL UNIQUE,
+                        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                        user_id BIGINT NOT NULL,
+                        user_phone VARCHAR(40),
+                        amount NUMERIC(12, 2) NOT NULL,
+                        method VARCHAR(16) NOT NULL,
+                        card_last4 VARCHAR(4),
+                        sbp_phone VARCHAR(40),
+                        sbp_bank VARCHAR(255),
+                        manager_id BIGINT,
+                        reason VARCHAR(255),
+                        amount_sent NUMERIC(12, 2),
+                        result TEXT,
+                        owner VARCHAR(64),
+                        heartbeat_at TIMESTAMP WITH TIME ZONE,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                    )
+                """)
+                await conn.execute(create_table_query)
+                print("✓ Таблица WithdrawalJobs успешно создана")
+            else:
+                print("✓ Таблица WithdrawalJobs уже существует")
+
+            for index_query in INDEXES:
+                await conn.execute(text(index_query))
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    asyncio.run(add_withdrawal_jobs_table())
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, String, text, Numeric, DateTime, ForeignKey, Boolean, UniqueConstraint, \
-    BigInteger
+    BigInteger, Text, Index
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -36,4 +36,82 @@ class Statistics(Base):
     phone = Column(String(40), nullable=False, index=True)
     tg_id = Column(BigInteger, nullable=False, index=True)
     link_param = Column(String(100), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=text("now()"))
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=text("now()"))
+
+
+class UserLanguages(Base):
+    # отдельная таблица: язык выбирают до регистрации, когда строки в Users ещё нет
+    __tablename__ = "UserLanguages"
+    tg_id = Column(BigInteger, primary_key=True)
+    lang = Column(String(8), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=text("now()"))
+
+
+# Зеркала листов Google Sheets (заполняет sheets/promotion_mirror.py, только чтение из таблицы).
+class ReferFriendPromos(Base):
+    __tablename__ = "ReferFriendPromos"
+    id = Column(Integer, primary_key=True, index=True)
+    sheet_row = Column(Integer, nullable=False, unique=True)
+    inviter_phone = Column(String(40), nullable=True)
+    inviter_phone10 = Column(String(10), nullable=True, index=True)
+    inviter_name = Column(String(255), nullable=True)
+    inviter_tg = Column(String(64), nullable=True, index=True)
+    invited_phone = Column(String(40), nullable=True)
+    invited_phone10 = Column(String(10), nullable=True, index=True)
+    invited_name = Column(String(255), nullable=True)
+    invited_tg = Column(String(64), nullable=True)
+    status = Column(String(100), nullable=True)
+    payout = Column(String(100), nullable=True)
+    friend_order = Column(String(100), nullable=True)
+    title = Column(String(255), nullable=True)
+    description = Column(String(2048), nullable=True)
+    reward = Column(String(255), nullable=True)
+    synced_at = Column(DateTime(timezone=True), server_default=text("now()"))
+
+class FirstOrderPromos(Base):
+    __tablename__ = "FirstOrderPromos"
+    id = Column(Integer, primary_key=True, index=True)
+    sheet_row = Column(Integer, nullable=False, unique=True)
+    phone = Column(String(40), nullable=True)
+    phone10 = Column(String(10), nullable=True, index=True)
+    title = Column(String(255), nullable=True)
+    description = Column(String(2048), nullable=True)
+    reward = Column(String(255), nullable=True)
+    status = Column(String(100), nullable=True)
+    synced_at = Column(DateTime(timezone=True), server_default=text("now()"))
+
+class CompletedOrdersCoeffs(Base):
+    __tablename__ = "CompletedOrdersCoeffs"
+    threshold = Column(Integer, primary_key=True)
+    coeff = Column(Numeric(12, 4), nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=text("now()"))
+
+
+# Заявки на вывод. Статусы: pending -> approved -> processing -> done | failed; pending -> rejected.
+# idempotency_key — из исходного сообщения пользователя, повторная доставка апдейта не создаёт вторую заявку.
+class WithdrawalJobs(Base):
+    __tablename__ = "WithdrawalJobs"
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(64), nullable=False, unique=True)
+    status = Column(String(16), nullable=False, default="pending", index=True)
+    user_id = Column(BigInteger, nullable=False, index=True)
+    user_phone = Column(String(40), nullable=True)
+    amount = Column(Numeric(12, 2), nullable=False)
+    method = Column(String(16), nullable=False)
+    card_last4 = Column(String(4), nullable=True)
+    sbp_phone = Column(String(40), nullable=True)
+    sbp_bank = Column(String(255), nullable=True)
+    manager_id = Column(BigInteger, nullable=True)
+    reason = Column(String(255), nullable=True)
+    amount_sent = Column(Numeric(12, 2), nullable=True)
+    result = Column(Text, nullable=True)
+    # экземпляр бота, выполняющий заявку, и когда он последний раз подтвердил, что жив
+    owner = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=text("now()"))
+    updated_at = Column(DateTime(timezone=True), server_default=text("now()"))
+    __table_args__ = (
+        # у водителя не больше одной выплаты в работе: обе читали бы один и тот же баланс
+        Index("ux_WithdrawalJobs_processing_phone", "user_phone", unique=True,
+              postgresql_where=text("status = 'processing'")),
+    )
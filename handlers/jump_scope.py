@@ -0,0 +1,20 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from jump.jump_cache import jump_request_scope
+
+
+class JumpLookupScopeMiddleware(BaseMiddleware):
+    """
+    Outer-middleware: весь апдейт — одна операция для кэша Jump,
+    водитель и профиль запрашиваются не больше одного раза за апдейт.
+    """
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        with jump_request_scope():
+            return await handler(event, data)
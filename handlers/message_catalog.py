@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import threading
+import time
+from string import Formatter
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from decouple import config
+
+logger = logging.getLogger("message_catalog")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+MESSAGES_FILE = config("MESSAGES_FILE", default="config.json")
+# как часто (сек) проверять mtime файла; сам файл перечитывается только если он изменился
+MESSAGES_CHECK_INTERVAL = float(config("MESSAGES_CHECK_INTERVAL", default="2"))
+
+DEFAULT_LANG = "ru"
+
+# (текст, имена плейсхолдеров или None, если шаблон не разбирается format-ом)
+Template = Tuple[str, Optional[FrozenSet[str]]]
+
+
+def _placeholders(text: str) -> Optional[FrozenSet[str]]:
+    try:
+        return frozenset(name.split(".")[0].split("[")[0]
+                         for _, name, _, _ in Formatter().parse(text) if name is not None)
+    except ValueError:
+        return None
+
+
+class MessageCatalog:
+    """
+    Скомпилированный каталог сообщений из config.json: {key: {lang: (text, placeholders)}}.
+    Файл разбирается один раз и перечитывается только при изменении mtime (или reload()).
+    Плейсхолдеры проверяются при загрузке: расхождения между языками попадают в warnings.
+    """
+
+    def __init__(self, path: str = MESSAGES_FILE, check_interval: float = MESSAGES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.version = 0
+        self.warnings: List[str] = []
+        self._raw: Dict[str, Any] = {}
+        self._messages: Dict[str, Dict[str, Template]] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _compile(self, raw: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Template]], List[str]]:
+        messages: Dict[str, Dict[str, Template]] = {}
+        warnings: List[str] = []
+        for key, val in raw.items():
+            texts = val if isinstance(val, dict) else {DEFAULT_LANG: val}
+            compiled: Dict[str, Template] = {}
+            for lang, text in texts.items():
+                text = str(text or "")
+                fields = _placeholders(text)
+                if fields is None:
+                    warnings.append(f"{key}[{lang}]: broken format template")
+                compiled[lang] = (text, fields)
+            base = compiled.get(DEFAULT_LANG) or next(iter(compiled.values()), None)
+            if base is not None and base[1] is not None:
+                for lang, (_, fields) in compiled.items():
+                    if fields is not None and fields != base[1]:
+                        warnings.append(f"{key}[{lang}]: placeholders {sorted(fields)} != {sorted(base[1])}")
+            messages[key] = compiled
+        return messages, warnings
+
+    def reload(self) -> int:
+        """
+        Перечитывает файл. При ошибке разбора остаётся предыдущая версия каталога.
+        Возвращает число ключей.
+        """
+        with self._lock:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            messages, warnings = self._compile(raw)
+            self._raw, self._messages, self.warnings = raw, messages, warnings
+            self._mtime = mtime
+            self._checked_at = time.monotonic()
+            self.version += 1
+        for w in warnings:
+            logger.warning("Message catalog: %s", w)
+        logger.info("Message catalog loaded: %d keys, version %d", len(messages), self.version)
+        return len(messages)
+
+    def _ensure_fresh(self) -> None:
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            if self._mtime is None or os.path.getmtime(self.path) != self._mtime:
+                self.reload()
+        except Exception:
+            if self._mtime is None:
+                raise
+            logger.exception("Failed to reload message catalog, keeping version %d", self.version)
+
+    def current_version(self) -> int:
+        """
+        Версия каталога (растёт при каждой перезагрузке) — ключ для кэшей производных объектов.
+        """
+        self._ensure_fresh()
+        return self.version
+
+    def raw(self) -> Dict[str, Any]:
+        self._ensure_fresh()
+        return self._raw
+
+    def has(self, key: str) -> bool:
+        self._ensure_fresh()
+        return key in self._messages
+
+    def get(self, key: str, lang: str = DEFAULT_LANG, **kwargs) -> str:
+        self._ensure_fresh()
+        texts = self._messages.get(key)
+        if not texts:
+            return ""
+        for candidate in (lang, DEFAULT_LANG):
+            template = texts.get(candidate)
+            if template and template[0]:
+                break
+        else:
+            template = next(iter(texts.values()))
+        text, fields = template
+        # шаблон без фигурных скобок format не меняет, битый — всё равно вернётся как есть
+        if kwargs and fields is not None and ("{" in text or "}" in text):
+            try:
+                return text.format(**kwargs)
+            except Exception:
+                return text
+        return text
+
+
+catalog = MessageCatalog()
@@ -1,7 +1,8 @@
-import json
 from decouple import config
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 import os
+import functools
+import inspect
 import logging
 import asyncio
 from typing import Optional, Dict, Any, List
@@ -10,33 +11,93 @@ from google.oauth2.service_account import Credentials
 import re
 from datetime import datetime, timedelta
 
+from sheets.sheets_integration import AsyncSheetsClient, SheetsAPIError, sheet_range
+from sheets.sheet_cache import SheetValuesCache
+from sheets.quota import QuotaHTTPClient
+from sheets.city_index import CityIndex
+from handlers.message_catalog import catalog
+
 logger = logging.getLogger("services")
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
 SPREADSHEET_ID = config("GOOGLE_SPREADSHEET_ID", default=None)
 GOOGLE_SA_FILE = config("GOOGLE_SA_FILE", default="../botsheets-475807-688c1a47e1da.json")
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# drive.metadata.readonly нужен только для дешёвой проверки modifiedTime в кэше листов
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.metadata.readonly"]
+SHEET_CACHE_PROBE_INTERVAL = float(config("SHEET_CACHE_PROBE_INTERVAL", default="30"))
+SHEET_CACHE_FALLBACK_TTL = float(config("SHEET_CACHE_FALLBACK_TTL", default="60"))
+SHEET_CACHE_MAX_AGE = float(config("SHEET_CACHE_MAX_AGE", default="3600"))
+
+INVITE_FRIEND_SHEET_TITLE = "Акция приведи друга"
+FIRST_ORDER_SHEET_TITLE = "Акция Первый заказ"
+COMPLETED_ORDERS_SHEET_TITLE = "Акция За выполненые заказы"
+PROMOTION_SHEET_TITLES = (INVITE_FRIEND_SHEET_TITLE, FIRST_ORDER_SHEET_TITLE, COMPLETED_ORDERS_SHEET_TITLE)
+# колонки (1-based), в которые бот пишет статусы акций
+FIRST_ORDER_STATUS_COL = 4
+INVITE_FRIEND_PAYOUT_COL = 6
+INVITE_FRIEND_STATUS_COL = 7
+INVITE_FRIEND_ORDER_COL = 8
 
 def load_json():
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+    """
+    Сырой config.json (из скомпилированного каталога, без повторного чтения файла).
+    """
+    return catalog.raw()
 
 def get_msg(key: str, lang: str = "ru", **kwargs) -> str:
-    cfg = load_json()
-    val = cfg.get(key)
-    if isinstance(val, dict):
-        text = val.get(lang) or val.get("ru") or next(iter(val.values()))
-    else:
-        text = str(val or "")
-    if kwargs:
-        try:
-            return text.format(**kwargs)
-        except Exception:
-            return text
-    return text
+    return catalog.get(key, lang, **kwargs)
+
+def has_msg(key: str) -> bool:
+    return catalog.has(key)
+
+def reload_messages() -> int:
+    return catalog.reload()
+
+# Готовые клавиатуры по (функция, аргументы); сбрасываются при перезагрузке каталога сообщений.
+# Объекты общие для всех вызовов — менять их после получения нельзя.
+_KEYBOARD_CACHE_MAX = 512
+_keyboard_cache: Dict[tuple, Any] = {}
+_label_cache: Dict[tuple, tuple] = {}
+_keyboard_cache_version = -1
+
+def _check_keyboard_cache_version() -> None:
+    global _keyboard_cache_version
+    version = catalog.current_version()
+    if version != _keyboard_cache_version or len(_keyboard_cache) > _KEYBOARD_CACHE_MAX:
+        _keyboard_cache.clear()
+        _label_cache.clear()
+        _keyboard_cache_version = version
+
+def _cached_keyboard(builder):
+    signature = inspect.signature(builder)
+
+    @functools.wraps(builder)
+    def wrapper(*args, **kwargs):
+        _check_keyboard_cache_version()
+        # ("ru", limited=True) и ("ru", True) — одна и та же клавиатура
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (builder.__name__,) + tuple(bound.arguments.values())
+        kb = _keyboard_cache.get(key)
+        if kb is None:
+            kb = _keyboard_cache[key] = builder(*args, **kwargs)
+        return kb
+    return wrapper
+
+def _labels(lang: str, *keys: str) -> tuple:
+    """
+    Подписи кнопок для клавиатур с динамическим callback_data (кэшируются на язык).
+    """
+    _check_keyboard_cache_version()
+    ck = (lang,) + keys
+    labels = _label_cache.get(ck)
+    if labels is None:
+        labels = _label_cache[ck] = tuple(get_msg(k, lang) for k in keys)
+    return labels
 
 
+@_cached_keyboard
 def build_main_menu(lang: str = "ru", limited: bool = False, is_admin: bool = False) -> InlineKeyboardMarkup:
     """
     Если limited=True — показываем только Wi‑Fi и промо.
@@ -49,6 +110,8 @@ def build_main_menu(lang: str = "ru", limited: bool = False, is_admin: bool = Fa
         if is_admin:
             buttons.append([InlineKeyboardButton(text=get_msg("btn_export_metabase", lang),
                                                  callback_data="export_metabase")])
+            buttons.append([InlineKeyboardButton(text=get_msg("btn_export_metabase_file", lang),
+                                                 callback_data="export_metabase_file")])
             buttons.append([InlineKeyboardButton(text=get_msg("btn_broadcast", lang),
                                                  callback_data="broadcast")])
         return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -63,11 +126,14 @@ def build_main_menu(lang: str = "ru", limited: bool = False, is_admin: bool = Fa
     if is_admin:
         buttons.append([InlineKeyboardButton(text=get_msg("btn_export_metabase", lang),
                                              callback_data="export_metabase")])
+        buttons.append([InlineKeyboardButton(text=get_msg("btn_export_metabase_file", lang),
+                                             callback_data="export_metabase_file")])
         buttons.append([InlineKeyboardButton(text=get_msg("btn_broadcast", lang),
                                              callback_data="broadcast")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@_cached_keyboard
 def build_invite_friend_menu(lang: str = "ru") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -100,6 +166,7 @@ def build_promo_details(promo: Dict, lang: str = "ru") -> InlineKeyboardMarkup:
     kb.add(InlineKeyboardButton(text=get_msg("btn_back_to_main", lang), callback_data="to_start"))
     return kb
 
+@_cached_keyboard
 def contact_kb(lang: str = "ru"):
     kb = ReplyKeyboardMarkup(
         keyboard=[
@@ -111,6 +178,7 @@ def contact_kb(lang: str = "ru"):
     return kb
 
 
+@_cached_keyboard
 def wifi_apps_kb(lang: str = "ru"):
     """Клавиатура с кнопкой 'Продолжить' для экрана с приложениями."""
     kb = InlineKeyboardMarkup(
@@ -120,6 +188,7 @@ def wifi_apps_kb(lang: str = "ru"):
     )
     return kb
 
+@_cached_keyboard
 def courier_type_kb(lang: str = "ru") -> InlineKeyboardMarkup:
     """Клавиатура с тремя кнопками типов курьера: Пеший, Вело, Авто."""
     kb = InlineKeyboardMarkup(
@@ -131,6 +200,7 @@ def courier_type_kb(lang: str = "ru") -> InlineKeyboardMarkup:
     )
     return kb
 
+@_cached_keyboard
 def location_request_kb(lang: str = "ru"):
     kb = ReplyKeyboardMarkup(
         keyboard=[
@@ -142,29 +212,33 @@ def location_request_kb(lang: str = "ru"):
     return kb
 
 def manager_withdraw_kb(pid: str, lang: str = "ru") -> InlineKeyboardMarkup:
+    confirm, reject = _labels(lang, "btn_confirm", "btn_reject")
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text=get_msg("btn_confirm", lang), callback_data=f"withdraw_confirm_{pid}"),
-            InlineKeyboardButton(text=get_msg("btn_reject", lang), callback_data=f"withdraw_reject_{pid}")
+            InlineKeyboardButton(text=confirm, callback_data=f"withdraw_confirm_{pid}"),
+            InlineKeyboardButton(text=reject, callback_data=f"withdraw_reject_{pid}")
         ]
     ])
     return kb
 
 def user_after_confirm_kb(pid: str, lang: str = "ru") -> InlineKeyboardMarkup:
+    confirmed, not_received = _labels(lang, "btn_user_confirm_withdraw", "btn_user_withdraw_not_received")
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text=get_msg("btn_user_confirm_withdraw", lang), callback_data=f"withdraw_user_confirmed_{pid}"),
-            InlineKeyboardButton(text=get_msg("btn_user_withdraw_not_received", lang), callback_data=f"withdraw_user_not_received_{pid}")
+            InlineKeyboardButton(text=confirmed, callback_data=f"withdraw_user_confirmed_{pid}"),
+            InlineKeyboardButton(text=not_received, callback_data=f"withdraw_user_not_received_{pid}")
         ]
     ])
     return kb
 
+@_cached_keyboard
 def user_rejected_kb(lang: str = "ru") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=get_msg("btn_back_to_main", lang), callback_data="to_start")]
     ])
 
 
+@_cached_keyboard
 def broadcast_confirm_kb(lang: str = "ru") -> InlineKeyboardMarkup:
     """Клавиатура для подтверждения рассылки"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -176,7 +250,8 @@ def broadcast_confirm_kb(lang: str = "ru") -> InlineKeyboardMarkup:
 
 def promo_done_kb(promo_id: str, threshold: int = 0, sheet_row: int = 0, lang: str = "ru") -> InlineKeyboardMarkup:
     cb = f"promo_done|{promo_id}|{threshold}|{sheet_row}"
-    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=get_msg("btn_promo_done", lang), callback_data=cb)]])
+    (done,) = _labels(lang, "btn_promo_done")
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=done, callback_data=cb)]])
 
 def _normalize_phone(phone: Optional[str]) -> str:
     if not phone:
@@ -195,6 +270,35 @@ def _load_credentials() -> Credentials:
         return creds
     raise RuntimeError("Google service account not configured. Set GOOGLE_SA_FILE.")  # noqa: WPS500
 
+_sheets_client: Optional[AsyncSheetsClient] = None
+
+def get_sheets_client() -> AsyncSheetsClient:
+    """
+    Общий асинхронный клиент Sheets (одна aiohttp-сессия на процесс).
+    """
+    global _sheets_client
+    if _sheets_client is None:
+        _sheets_client = AsyncSheetsClient(credentials_factory=_load_credentials)
+    return _sheets_client
+
+async def close_sheets_client():
+    global _sheets_client
+    if _sheets_client is not None:
+        await _sheets_client.close()
+        _sheets_client = None
+
+_gspread_client: Optional[gspread.Client] = None
+
+def _get_gspread_client() -> gspread.Client:
+    """
+    Один авторизованный клиент gspread на процесс: токен обновляется один раз,
+    а не на каждое открытие листа. Все запросы идут через планировщик квот Sheets.
+    """
+    global _gspread_client
+    if _gspread_client is None:
+        _gspread_client = gspread.authorize(_load_credentials(), http_client=QuotaHTTPClient)
+    return _gspread_client
+
 def _get_worksheet(
         title: str,
         spreadsheet_id: Optional[str] = None,
@@ -202,8 +306,7 @@ def _get_worksheet(
         rows: str = "1000",
         cols: str = "20",
 ):
-    creds = _load_credentials()
-    client = gspread.authorize(creds)
+    client = _get_gspread_client()
     sheet = client.open_by_key(spreadsheet_id or SPREADSHEET_ID)
     try:
         return sheet.worksheet(title)
@@ -216,15 +319,75 @@ def _get_worksheet(
                 logger.exception("Failed to create worksheet '%s'", title)
         return None
 
+def _fetch_sheet_values(spreadsheet_id: str, titles: List[str]) -> Dict[str, List[List[str]]]:
+    client = _get_gspread_client()
+    res = client.http_client.values_batch_get(spreadsheet_id, [sheet_range(t) for t in titles])
+    out: Dict[str, List[List[str]]] = {}
+    for title, value_range in zip(titles, res.get("valueRanges") or []):
+        out[title] = gspread.utils.fill_gaps(value_range.get("values") or [])
+    return out
+
+def _probe_spreadsheet_modified(spreadsheet_id: str) -> Optional[str]:
+    meta = _get_gspread_client().http_client.get_file_drive_metadata(spreadsheet_id)
+    return meta.get("modifiedTime")
+
+_sheet_cache = SheetValuesCache(
+    fetch_many=_fetch_sheet_values,
+    probe_modified=_probe_spreadsheet_modified,
+    probe_interval=SHEET_CACHE_PROBE_INTERVAL,
+    fallback_ttl=SHEET_CACHE_FALLBACK_TTL,
+    max_age=SHEET_CACHE_MAX_AGE,
+)
+
 def _get_worksheet_values_by_title(title: str, spreadsheet_id: Optional[str] = None) -> Optional[List[List[str]]]:
-    ws = _get_worksheet(title, spreadsheet_id=spreadsheet_id)
-    if not ws:
+    """
+    Значения листа из кэша; лист перекачивается только если таблица изменилась.
+    """
+    try:
+        return _sheet_cache.get(spreadsheet_id or SPREADSHEET_ID, title)
+    except Exception:
+        logger.exception("Error reading sheet '%s'", title)
         return None
-    return ws.get_all_values()
 
-def _read_first_order_rows_structured() -> List[Dict[str, Any]]:
-    title = "Акция Первый заказ"
-    vals = _get_worksheet_values_by_title(title)
+def invalidate_sheet_cache(spreadsheet_id: Optional[str] = None, title: Optional[str] = None) -> None:
+    _sheet_cache.invalidate(spreadsheet_id or SPREADSHEET_ID, title)
+
+def batch_get_sheet_values(titles, spreadsheet_id: Optional[str] = None) -> Dict[str, List[List[str]]]:
+    """
+    Читает несколько листов одним запросом values:batchGet (неизменившиеся листы берутся из кэша).
+    Возвращает {название листа: значения}, строки дополнены до прямоугольника, как в get_all_values.
+    """
+    return _sheet_cache.get_many(spreadsheet_id or SPREADSHEET_ID, titles)
+
+def prefetch_promotion_sheets() -> Dict[str, List[List[str]]]:
+    """
+    Все листы акций за один round-trip. При ошибке возвращает {} —
+    тогда каждая функция читает свой лист сама.
+    """
+    try:
+        return batch_get_sheet_values(PROMOTION_SHEET_TITLES)
+    except Exception:
+        logger.exception("Failed to batch-get promotion sheets")
+        return {}
+
+def _row_index_from_append_response(res: Any) -> Optional[int]:
+    """
+    Возвращает номер добавленной строки из ответа values.append.
+    Берётся из updates.updatedRange (например "'Лист1'!A57:K57" -> 57),
+    чтобы не перечитывать весь лист ради одного числа.
+    """
+    if not isinstance(res, dict):
+        return None
+    updated_range = (res.get("updates") or {}).get("updatedRange") or ""
+    m = re.search(r"![A-Z]*(\d+)", updated_range)
+    if not m:
+        logger.warning("Unexpected append response, no updatedRange: %s", res)
+        return None
+    return int(m.group(1))
+
+def _read_first_order_rows_structured(vals: Optional[List[List[str]]] = None) -> List[Dict[str, Any]]:
+    if vals is None:
+        vals = _get_worksheet_values_by_title(FIRST_ORDER_SHEET_TITLE)
     out: List[Dict[str, Any]] = []
     if not vals or len(vals) < 2:
         return out
@@ -288,16 +451,17 @@ def update_first_order_status_by_row(sheet_title: str, row_number: int, status_v
     if not ws:
         return False
     try:
-        col = 4
+        col = FIRST_ORDER_STATUS_COL
         ws.update_cell(row_number, col, status_value)
+        _sheet_cache.apply_cells(SPREADSHEET_ID, sheet_title, row_number, {col: status_value})
         return True
     except Exception:
         logger.exception("Failed to update sheet %s row %s col D", sheet_title, row_number)
         return False
 
-def get_table3_coeffs() -> Dict[int, float]:
-    title = "Акция За выполненые заказы"
-    vals = _get_worksheet_values_by_title(title)
+def get_table3_coeffs(vals: Optional[List[List[str]]] = None) -> Dict[int, float]:
+    if vals is None:
+        vals = _get_worksheet_values_by_title(COMPLETED_ORDERS_SHEET_TITLE)
     if not vals or len(vals) < 2:
         return {}
     headers = vals[0]
@@ -358,7 +522,7 @@ def build_completed_promo_text(title: str, desc: str, thresholds: List[int], coe
         parts.append(f"- {th} / {date_str} / {payout_str}")
     return "\n".join(parts)
 
-def get_refer_a_friend_promo(user_identifier: Optional[str] = None) -> Optional[str]:
+def _read_refer_friend_rows_structured(vals: Optional[List[List[str]]] = None) -> List[Dict[str, Any]]:
     def find_header_index(norm_headers, *candidates):
         for cand in candidates:
             cand_n = _normalize_text(cand)
@@ -367,28 +531,29 @@ def get_refer_a_friend_promo(user_identifier: Optional[str] = None) -> Optional[
                     return idx
         return None
 
-    vals = _get_worksheet_values_by_title("Акция приведи друга")
+    if vals is None:
+        vals = _get_worksheet_values_by_title(INVITE_FRIEND_SHEET_TITLE)
+    out: List[Dict[str, Any]] = []
     if not vals or len(vals) < 2:
-        return None
+        return out
 
     headers = vals[0]
     norm_headers = [_normalize_text(h) for h in headers]
 
-    idx_inviter_phone = find_header_index(norm_headers, "номер телефона пригласившего", "телефон пригласившего", "inviter phone", "номер телефона", "телефон")
-    idx_inviter_name = find_header_index(norm_headers, "фио пригласившего", "фио", "имя пригласившего", "имя")
-    idx_inviter_tg = find_header_index(norm_headers, "telegram id пригласившего", "tg id пригласившего", "telegram id", "tg id", "telegram")
-
-    idx_invited_phone = find_header_index(norm_headers, "номер телефона приглашенного", "телефон приглашенного", "invited phone", "телефон приглашенного")
-    idx_invited_name = find_header_index(norm_headers, "фио приглашенного", "фио приглашенного", "имя приглашенного", "имя приглашенного")
-    idx_invited_tg = find_header_index(norm_headers, "telegram id приглашенного", "tg id приглашенного", "telegram id invited", "tg id invited")
-
-    idx_status = find_header_index(norm_headers, "статус", "status")
-    idx_payout = find_header_index(norm_headers, "выплата", "платёж", "payout")
-    idx_friend_order = find_header_index(norm_headers, "заказ друга", "заказ", "first order", "order")
-
-    idx_title = find_header_index(norm_headers, "название", "title", "name")
-    idx_desc = find_header_index(norm_headers, "описание", "description", "desc")
-    idx_reward = find_header_index(norm_headers, "награда", "бонус", "reward")
+    columns = {
+        "inviter_phone": find_header_index(norm_headers, "номер телефона пригласившего", "телефон пригласившего", "inviter phone", "номер телефона", "телефон"),
+        "inviter_name": find_header_index(norm_headers, "фио пригласившего", "фио", "имя пригласившего", "имя"),
+        "inviter_tg": find_header_index(norm_headers, "telegram id пригласившего", "tg id пригласившего", "telegram id", "tg id", "telegram"),
+        "invited_phone": find_header_index(norm_headers, "номер телефона приглашенного", "телефон приглашенного", "invited phone", "телефон приглашенного"),
+        "invited_name": find_header_index(norm_headers, "фио приглашенного", "фио приглашенного", "имя приглашенного", "имя приглашенного"),
+        "invited_tg": find_header_index(norm_headers, "telegram id приглашенного", "tg id приглашенного", "telegram id invited", "tg id invited"),
+        "status": find_header_index(norm_headers, "статус", "status"),
+        "payout": find_header_index(norm_headers, "выплата", "платёж", "payout"),
+        "friend_order": find_header_index(norm_headers, "заказ друга", "заказ", "first order", "order"),
+        "title": find_header_index(norm_headers, "название", "title", "name"),
+        "desc": find_header_index(norm_headers, "описание", "description", "desc"),
+        "reward": find_header_index(norm_headers, "награда", "бонус", "reward"),
+    }
 
     def cell_safe(row, idx):
         try:
@@ -396,15 +561,23 @@ def get_refer_a_friend_promo(user_identifier: Optional[str] = None) -> Optional[
         except Exception:
             return ""
 
+    for ridx, row in enumerate(vals[1:], start=2):
+        item: Dict[str, Any] = {"sheet_row": ridx}
+        for key, idx in columns.items():
+            item[key] = cell_safe(row, idx)
+        out.append(item)
+    return out
+
+def _format_refer_friend_promo(rows: List[Dict[str, Any]], user_identifier: Optional[str] = None) -> Optional[str]:
     if user_identifier is not None and str(user_identifier).strip() != "":
         uid = str(user_identifier).strip()
         uid_norm_digits = re.sub(r"\D+", "", uid)
         uid_low = uid.lower()
         matched_rows = []
-        for ridx, row in enumerate(vals[1:], start=2):
-            inviter_phone = cell_safe(row, idx_inviter_phone)
-            inviter_tg = cell_safe(row, idx_inviter_tg)
-            invited_phone = cell_safe(row, idx_invited_phone)
+        for r in rows:
+            inviter_phone = r.get("inviter_phone") or ""
+            inviter_tg = r.get("inviter_tg") or ""
+            invited_phone = r.get("invited_phone") or ""
 
             found = False
             if uid_norm_digits and (re.sub(r"\D+", "", inviter_phone).endswith(uid_norm_digits[-10:]) or re.sub(r"\D+", "", invited_phone).endswith(uid_norm_digits[-10:])):
@@ -415,42 +588,28 @@ def get_refer_a_friend_promo(user_identifier: Optional[str] = None) -> Optional[
                 found = True
 
             if found:
-                matched_rows.append((ridx, row))
+                matched_rows.append(r)
 
         if not matched_rows:
             return None
 
         parts = []
-        for ridx, row in matched_rows:
-            inviter_phone = cell_safe(row, idx_inviter_phone)
-            inviter_name = cell_safe(row, idx_inviter_name)
-            inviter_tg = cell_safe(row, idx_inviter_tg)
-            invited_phone = cell_safe(row, idx_invited_phone)
-            invited_name = cell_safe(row, idx_invited_name)
-            invited_tg = cell_safe(row, idx_invited_tg)
-            status = cell_safe(row, idx_status)
-            payout = cell_safe(row, idx_payout)
-            friend_order = cell_safe(row, idx_friend_order)
-            title = cell_safe(row, idx_title)
-            desc = cell_safe(row, idx_desc)
-            reward = cell_safe(row, idx_reward)
-
-            line = f"Запись (строка {ridx}):\n"
-            line += f"- Пригласивший: {inviter_name or '—'} (тел: {inviter_phone or '—'}; tg: {inviter_tg or '—'})\n"
-            line += f"- Приглашённый: {invited_name or '—'} (тел: {invited_phone or '—'}; tg: {invited_tg or '—'})\n"
-            line += f"- Статус: {status or '—'}\n"
-            line += f"- Выплата: {payout or '0'}\n"
-            line += f"- Заказ друга: {friend_order or 'Нет'}\n"
+        for r in matched_rows:
+            title, desc, reward = r.get("title"), r.get("desc"), r.get("reward")
+            line = f"Запись (строка {r['sheet_row']}):\n"
+            line += f"- Пригласивший: {r.get('inviter_name') or '—'} (тел: {r.get('inviter_phone') or '—'}; tg: {r.get('inviter_tg') or '—'})\n"
+            line += f"- Приглашённый: {r.get('invited_name') or '—'} (тел: {r.get('invited_phone') or '—'}; tg: {r.get('invited_tg') or '—'})\n"
+            line += f"- Статус: {r.get('status') or '—'}\n"
+            line += f"- Выплата: {r.get('payout') or '0'}\n"
+            line += f"- Заказ друга: {r.get('friend_order') or 'Нет'}\n"
             if title or desc or reward:
                 line += f"- Акция: {title or '—'}\n  Описание: {desc or '—'}\n  Награда: {reward or '—'}\n"
             parts.append(line)
 
         return "\n\n".join(parts)
 
-    for row in vals[1:]:
-        title = cell_safe(row, idx_title)
-        desc = cell_safe(row, idx_desc)
-        reward = cell_safe(row, idx_reward)
+    for r in rows:
+        title, desc, reward = r.get("title"), r.get("desc"), r.get("reward")
         if title or desc or reward:
             out = []
             if title:
@@ -462,9 +621,12 @@ def get_refer_a_friend_promo(user_identifier: Optional[str] = None) -> Optional[
             return "\n".join(out)
     return None
 
+def get_refer_a_friend_promo(user_identifier: Optional[str] = None,
+                             vals: Optional[List[List[str]]] = None) -> Optional[str]:
+    return _format_refer_friend_promo(_read_refer_friend_rows_structured(vals), user_identifier)
+
 def get_first_order_promos() -> List[str]:
-    title = "Акция Первый заказ"
-    vals = _get_worksheet_values_by_title(title)
+    vals = _get_worksheet_values_by_title(FIRST_ORDER_SHEET_TITLE)
     if not vals or len(vals) < 2:
         return []
     headers = vals[0]
@@ -493,29 +655,17 @@ def get_first_order_promos() -> List[str]:
         result.append(text)
     return result
 
-def add_invite_friend_row(inviter_tg_id: int,
-                          friend_name: str,
-                          friend_phone: str,
-                          friend_tg_id: Optional[int] = None,
-                          inviter_name: Optional[str] = None,
-                          inviter_phone: Optional[str] = None,
-                          friend_city: Optional[str] = None,
-                          friend_role: Optional[str] = None) -> Optional[int]:
-    """
-    Append invite row. Backwards compatible parameters.
-    Writes columns in expected order. # short comment
-    """
-    ws = _get_worksheet("Акция приведи друга")
-    if not ws:
-        return None
-
+def _invite_friend_row_values(inviter_tg_id: int,
+                              friend_name: str,
+                              friend_phone: str,
+                              inviter_name: Optional[str] = None,
+                              inviter_phone: Optional[str] = None) -> List[str]:
     # If inviter_name/phone not provided, leave empty (caller should provide)
     inviter_phone_val = inviter_phone or ""
     inviter_name_val = inviter_name or ""
     inviter_tg_val = str(inviter_tg_id) if inviter_tg_id else ""
     friend_phone_val = friend_phone or ""
     friend_name_val = friend_name or ""
-    friend_tg_val = str(friend_tg_id) if friend_tg_id else ""
 
     # default status and payout placeholders
     status = "pending"
@@ -526,24 +676,66 @@ def add_invite_friend_row(inviter_tg_id: int,
     desc = ""
     reward = ""
 
+    # row order matches sheet header observed earlier
+    return [
+        inviter_phone_val,    # Номер телефона пригласившего
+        inviter_name_val,     # ФИО пригласившего
+        inviter_tg_val,       # Telegram ID пригласившего
+        friend_phone_val,     # Номер телефона приглашенного
+        friend_name_val,      # ФИО приглашенного
+        status,               # Статус
+        payout,               # Выплата
+        friend_order,         # Заказ друга
+        title,                # Название
+        desc,                 # Описание
+        reward                # Награда
+    ]
+
+def add_invite_friend_row(inviter_tg_id: int,
+                          friend_name: str,
+                          friend_phone: str,
+                          friend_tg_id: Optional[int] = None,
+                          inviter_name: Optional[str] = None,
+                          inviter_phone: Optional[str] = None,
+                          friend_city: Optional[str] = None,
+                          friend_role: Optional[str] = None) -> Optional[int]:
+    """
+    Append invite row. Backwards compatible parameters.
+    Writes columns in expected order. # short comment
+    """
+    ws = _get_worksheet(INVITE_FRIEND_SHEET_TITLE)
+    if not ws:
+        return None
+
     try:
-        # row order matches sheet header observed earlier
-        row = [
-            inviter_phone_val,    # Номер телефона пригласившего
-            inviter_name_val,     # ФИО пригласившего
-            inviter_tg_val,       # Telegram ID пригласившего
-            friend_phone_val,     # Номер телефона приглашенного
-            friend_name_val,      # ФИО приглашенного
-            status,               # Статус
-            payout,               # Выплата
-            friend_order,         # Заказ друга
-            title,                # Название
-            desc,                 # Описание
-            reward                # Награда
-        ]
-        ws.append_row(row, value_input_option="USER_ENTERED")
-        vals = ws.get_all_values()
-        return len(vals)
+        row = _invite_friend_row_values(inviter_tg_id, friend_name, friend_phone,
+                                        inviter_name=inviter_name, inviter_phone=inviter_phone)
+        res = ws.append_row(row, value_input_option="USER_ENTERED")
+        row_index = _row_index_from_append_response(res)
+        _sheet_cache.apply_row(SPREADSHEET_ID, INVITE_FRIEND_SHEET_TITLE, row_index, row)
+        return row_index
+    except Exception:
+        logger.exception("Failed to add invite friend row")
+        return None
+
+async def add_invite_friend_row_async(inviter_tg_id: int,
+                                      friend_name: str,
+                                      friend_phone: str,
+                                      friend_tg_id: Optional[int] = None,
+                                      inviter_name: Optional[str] = None,
+                                      inviter_phone: Optional[str] = None,
+                                      friend_city: Optional[str] = None,
+                                      friend_role: Optional[str] = None) -> Optional[int]:
+    """
+    То же, что add_invite_friend_row, но через асинхронный клиент Sheets (не блокирует event loop).
+    """
+    row = _invite_friend_row_values(inviter_tg_id, friend_name, friend_phone,
+                                    inviter_name=inviter_name, inviter_phone=inviter_phone)
+    try:
+        res = await get_sheets_client().values_append(SPREADSHEET_ID, sheet_range(INVITE_FRIEND_SHEET_TITLE), [row])
+        row_index = _row_index_from_append_response(res)
+        _sheet_cache.apply_row(SPREADSHEET_ID, INVITE_FRIEND_SHEET_TITLE, row_index, row)
+        return row_index
     except Exception:
         logger.exception("Failed to add invite friend row")
         return None
@@ -555,8 +747,7 @@ def add_person_to_external_sheet(spreadsheet_id: str, sheet_name: str, fio: str,
     """
     try:
         logger.info(f"add_person_to_external_sheet: spreadsheet_id={spreadsheet_id}, sheet_name={sheet_name}, fio={fio}, phone={phone}")
-        creds = _load_credentials()  # reuse credentials
-        client = gspread.authorize(creds)
+        client = _get_gspread_client()
         sheet = client.open_by_key(spreadsheet_id)
         logger.info(f"Opened spreadsheet: {spreadsheet_id}")
         try:
@@ -574,21 +765,42 @@ def add_person_to_external_sheet(spreadsheet_id: str, sheet_name: str, fio: str,
 
         row = [fio or "", phone or "", city or "", role or ""]
         logger.info(f"Appending row to sheet: {row}")
-        ws.append_row(row, value_input_option="USER_ENTERED")
-        vals = ws.get_all_values()
-        row_count = len(vals)
-        logger.info(f"Successfully added row. Total rows in sheet: {row_count}")
-        return row_count  # new total rows -> index of appended row
+        res = ws.append_row(row, value_input_option="USER_ENTERED")
+        row_index = _row_index_from_append_response(res)
+        _sheet_cache.apply_row(spreadsheet_id, sheet_name, row_index, row)
+        logger.info(f"Successfully added row. Row index in sheet: {row_index}")
+        return row_index
     except Exception as e:
         logger.exception(f"Failed to add person to external sheet: spreadsheet_id={spreadsheet_id}, sheet_name={sheet_name}, error={e}")
         return None
 
-def find_invite_row_by_phone(phone: str) -> Optional[int]:
-    ws = _get_worksheet("Акция приведи друга")
-    if not ws:
+async def add_person_to_external_sheet_async(spreadsheet_id: str, sheet_name: str, fio: str, phone: str, city: str, role: str) -> Optional[int]:
+    """
+    Асинхронная версия add_person_to_external_sheet.
+    Если листа нет — создаёт его через batchUpdate и повторяет append.
+    """
+    client = get_sheets_client()
+    row = [fio or "", phone or "", city or "", role or ""]
+    try:
+        try:
+            res = await client.values_append(spreadsheet_id, sheet_range(sheet_name), [row])
+        except SheetsAPIError as e:
+            if e.status != 400 or "Unable to parse range" not in e.text:
+                raise
+            logger.warning(f"Worksheet '{sheet_name}' not found, attempting to create")
+            await client.add_sheet(spreadsheet_id, sheet_name)
+            res = await client.values_append(spreadsheet_id, sheet_range(sheet_name), [row])
+        row_index = _row_index_from_append_response(res)
+        _sheet_cache.apply_row(spreadsheet_id, sheet_name, row_index, row)
+        logger.info(f"Successfully added row. Row index in sheet: {row_index}")
+        return row_index
+    except Exception as e:
+        logger.exception(f"Failed to add person to external sheet: spreadsheet_id={spreadsheet_id}, sheet_name={sheet_name}, error={e}")
         return None
+
+def find_invite_row_by_phone(phone: str) -> Optional[int]:
     try:
-        vals = ws.get_all_values()
+        vals = _get_worksheet_values_by_title(INVITE_FRIEND_SHEET_TITLE)
         if not vals or len(vals) < 2:
             return None
         for idx, row in enumerate(vals[1:], start=2):
@@ -600,13 +812,16 @@ def find_invite_row_by_phone(phone: str) -> Optional[int]:
     return None
 
 def mark_invite_friend_payment(sheet_row: int, payout: float, status: str, first_order_done: bool) -> bool:
-    ws = _get_worksheet("Акция приведи друга")
+    ws = _get_worksheet(INVITE_FRIEND_SHEET_TITLE)
     if not ws:
         return False
     try:
-        ws.update_cell(sheet_row, 6, payout)
-        ws.update_cell(sheet_row, 7, status)
-        ws.update_cell(sheet_row, 8, "Да" if first_order_done else "Нет")
+        ws.update_cell(sheet_row, INVITE_FRIEND_PAYOUT_COL, payout)
+        ws.update_cell(sheet_row, INVITE_FRIEND_STATUS_COL, status)
+        ws.update_cell(sheet_row, INVITE_FRIEND_ORDER_COL, "Да" if first_order_done else "Нет")
+        _sheet_cache.apply_cells(SPREADSHEET_ID, INVITE_FRIEND_SHEET_TITLE, sheet_row,
+                                 {INVITE_FRIEND_PAYOUT_COL: payout, INVITE_FRIEND_STATUS_COL: status,
+                                  INVITE_FRIEND_ORDER_COL: "Да" if first_order_done else "Нет"})
         return True
     except Exception:
         logger.exception("Failed to mark invite friend payment on row %s", sheet_row)
@@ -618,14 +833,7 @@ def find_row_by_phone_in_sheet(title: str, phone: str, spreadsheet_id: Optional[
     Ищет строку по телефону в указанном листе (по первому столбцу, содержащему 'тел' или 'phone').
     Возвращает dict {header: value} или None.
     """
-    ws = _get_worksheet(title, spreadsheet_id=spreadsheet_id)
-    if not ws:
-        return None
-    try:
-        vals = ws.get_all_values()
-    except Exception:
-        logger.exception("Error reading sheet '%s'", title)
-        return None
+    vals = _get_worksheet_values_by_title(title, spreadsheet_id=spreadsheet_id)
     if not vals or len(vals) < 2:
         return None
 
@@ -656,9 +864,37 @@ UNIFORM_ADDRESSES_SPREADSHEET_ID = "1m6WSlCKC9iR0gmNYSOLQWksZndZEgBnEoPlPlPaG0ck
 UNIFORM_ADDRESSES_SHEET_NAME = "Лист1"
 
 
+def read_uniform_addresses() -> Optional[List[List[str]]]:
+    """
+    Лист адресов получения формы (столбец A — город, B — адрес) или None при ошибке.
+    """
+    return _get_worksheet_values_by_title(UNIFORM_ADDRESSES_SHEET_NAME, spreadsheet_id=UNIFORM_ADDRESSES_SPREADSHEET_ID)
+
+
+# индекс строится заново только когда кэш листа отдал новый снимок
+_city_index: Optional[CityIndex] = None
+_city_index_source: Optional[List[List[str]]] = None
+
+
+def get_city_index(vals: Optional[List[List[str]]] = None) -> Optional[CityIndex]:
+    """
+    Индекс городов по листу адресов формы. vals — уже прочитанный лист (например, фоновой синхронизацией).
+    """
+    global _city_index, _city_index_source
+    if vals is None:
+        vals = read_uniform_addresses()
+        if vals is None:
+            return _city_index
+    if vals is not _city_index_source:
+        _city_index = CityIndex.from_sheet(vals)
+        _city_index_source = vals
+    return _city_index
+
+
 def get_uniform_address_by_city(city: str) -> Optional[str]:
     """
     Ищет адрес получения формы по названию города в таблице Google Sheets.
+    Сравнение нечёткое: ё/е, «г.», дефисы, транслит и опечатки (см. sheets/city_index.py).
     
     Args:
         city: Название города, введенное пользователем
@@ -669,35 +905,8 @@ def get_uniform_address_by_city(city: str) -> Optional[str]:
     if not city:
         return None
     
-    ws = _get_worksheet(UNIFORM_ADDRESSES_SHEET_NAME, spreadsheet_id=UNIFORM_ADDRESSES_SPREADSHEET_ID)
-    if not ws:
+    index = get_city_index()
+    if index is None:
         logger.warning("Не удалось получить доступ к листу '%s' в таблице адресов формы", UNIFORM_ADDRESSES_SHEET_NAME)
         return None
-    
-    try:
-        vals = ws.get_all_values()
-    except Exception:
-        logger.exception("Ошибка при чтении листа '%s'", UNIFORM_ADDRESSES_SHEET_NAME)
-        return None
-    
-    if not vals or len(vals) < 1:
-        return None
-    
-    # Нормализуем введенный город для сравнения (без учета регистра и лишних пробелов)
-    city_normalized = _normalize_text(city)
-    
-    # Ищем в данных (столбец A - индекс 0, столбец B - индекс 1)
-    for row in vals:
-        if len(row) < 2:
-            continue
-        city_in_sheet = (row[0] or "").strip()
-        address = (row[1] or "").strip()
-        
-        # Нормализуем город из таблицы для сравнения
-        city_in_sheet_normalized = _normalize_text(city_in_sheet)
-        
-        # Сравниваем нормализованные значения
-        if city_normalized == city_in_sheet_normalized:
-            return address if address else None
-    
-    return None
+    return index.lookup(city)
@@ -1,11 +1,15 @@
 import asyncio
+import csv
 import datetime
+import gzip
 import os
 import re
+import tempfile
+import threading
+from decimal import Decimal
 from typing import Any, Dict, List, Optional
 
-import gspread
-from gspread.utils import rowcol_to_a1
+from gspread.utils import rowcol_to_a1, ValueRenderOption
 import aiohttp
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command, CommandObject
@@ -15,28 +19,44 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.formatting import PhoneNumber
 
 from create_bot import bot
-from db.crud import create_user, get_user_by_tg_id, get_all_users, update_user_consent, create_statistics_entry, get_statistics_by_phone
-from jump.jump_integrations import get_balance_by_phone, perform_withdrawal
+from db.crud import create_user, get_user_by_tg_id, get_all_users, update_user_consent, create_statistics_entry, get_statistics_by_phone, \
+    iter_all_users, create_withdrawal_job, get_withdrawal_job, transition_withdrawal_job, get_pending_withdrawal_jobs, \
+    approve_pending_withdrawal_jobs
+from jump.jump_async import get_jump_client
+from handlers.jump_scope import JumpLookupScopeMiddleware
 from metabase.metabase_integration import get_completed_orders_by_phone, courier_exists, get_promotions, get_date_lead, \
-    compute_referral_commissions_for_inviter, courier_data, fetch_all_metabase_rows
+    compute_referral_commissions_for_inviter, courier_data, fetch_all_metabase_rows, iter_metabase_rows
 from wifi_map.wifi_services import find_wifi_near_location, get_available_wifi_points
 from users_store import add_or_update_user, is_in_metabase
 from .user_states import RegState, InviteFriendStates, PromoStates, WithdrawStates, WifiStates, BroadcastStates
+from .message_catalog import catalog as message_catalog
+from .user_langs import user_lang_store, UserLanguageMiddleware
+from .withdrawals import request_withdrawal_processing, run_withdrawal_batch, format_pending_withdrawals, \
+    format_withdrawal_batch_summary
 from .services import (
-    load_json, contact_kb, location_request_kb, wifi_apps_kb, courier_type_kb,
-    build_main_menu, build_invite_friend_menu, add_person_to_external_sheet, get_msg, manager_withdraw_kb,
-    find_row_by_phone_in_sheet, _load_credentials, SPREADSHEET_ID, get_uniform_address_by_city, broadcast_confirm_kb
+    has_msg, reload_messages, contact_kb, location_request_kb, wifi_apps_kb, courier_type_kb,
+    build_main_menu, build_invite_friend_menu, add_person_to_external_sheet_async, add_invite_friend_row_async,
+    get_msg, manager_withdraw_kb,
+    find_row_by_phone_in_sheet, _get_gspread_client, SPREADSHEET_ID, broadcast_confirm_kb,
+    invalidate_sheet_cache, get_sheets_client
 )
 from amocrm.amocrm_integration import find_or_create_contact_and_create_task_async
+from sheets.quota import sheets_priority, PRIORITY_BACKGROUND
+from resilience import Upstream, CircuitOpenError
+from sheets.sheets_integration import sheet_range
+from sheets.promotion_mirror import find_uniform_address, load_promotion_sources_from_db
 from decouple import config
 from loguru import logger
 
 urouter = Router()
+urouter.message.outer_middleware(UserLanguageMiddleware())
+urouter.callback_query.outer_middleware(UserLanguageMiddleware())
+urouter.message.outer_middleware(JumpLookupScopeMiddleware())
+urouter.callback_query.outer_middleware(JumpLookupScopeMiddleware())
 
 # pending storage
 pending_actions = {}
 _local_counter = 0
-user_langs = {}
 CONTACT_SCREENSHOT_PATH = "contact_request.png"
 ADMIN_IDS_RAW = config("ADMIN_IDS", default="")
 def _parse_admin_ids(raw: str) -> set[int]:
@@ -50,6 +70,13 @@ def _parse_admin_ids(raw: str) -> set[int]:
 ADMIN_IDS = _parse_admin_ids(ADMIN_IDS_RAW)
 CANDIDATES_SPREADSHEET_ID = config("CANDIDATES_SPREADSHEET_ID", default=SPREADSHEET_ID)
 CANDIDATES_SHEET_NAME = "ВСЕ КАНДИДАТЫ В METABASE"
+# diff — переписываются только изменившиеся строки; full — старый режим clear + полная запись;
+# stream — строки потоком пишутся поверх старых чанками по CANDIDATES_EXPORT_CHUNK_ROWS
+CANDIDATES_EXPORT_MODE = config("CANDIDATES_EXPORT_MODE", default="diff")
+CANDIDATES_EXPORT_BATCH_ROWS = int(config("CANDIDATES_EXPORT_BATCH_ROWS", default="2000"))
+CANDIDATES_EXPORT_CHUNK_ROWS = int(config("CANDIDATES_EXPORT_CHUNK_ROWS", default="1000"))
+CANDIDATES_EXPORT_CONCURRENCY = int(config("CANDIDATES_EXPORT_CONCURRENCY", default="4"))
+CANDIDATES_FILE_COMPRESSLEVEL = int(config("CANDIDATES_FILE_COMPRESSLEVEL", default="6"))
 
 
 def _next_local():
@@ -60,7 +87,7 @@ def _next_local():
 
 def _get_lang_for_user(tg_id: int) -> str:
     try:
-        return user_langs.get(int(tg_id), "ru")
+        return user_lang_store.get(int(tg_id))
     except Exception:
         return "ru"
 
@@ -200,6 +227,10 @@ async def _deny_if_limited(entity, lang: str, user) -> bool:
     return False
 
 
+# эндпоинт регистрации кандидата: запрос создаёт кандидата, поэтому таймаут фиксированный, без адаптации
+registration_upstream = Upstream("registration", max_timeout=10)
+
+
 async def _send_registration_post(phone: str, full_name: Optional[str] = None, city: Optional[str] = None, position: Optional[str] = None) -> Dict[str, Any]:
     """
     Отправляет POST запрос на эндпоинт при регистрации пользователя.
@@ -225,36 +256,41 @@ async def _send_registration_post(phone: str, full_name: Optional[str] = None, c
     
     async with aiohttp.ClientSession() as session:
         try:
-            async with session.post(endpoint, data=data, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response_text = await response.text()
-                result["response_text"] = response_text
+            with registration_upstream.call(adaptive=False) as call:
+                async with session.post(endpoint, data=data, timeout=aiohttp.ClientTimeout(total=call.timeout)) as response:
+                    response_text = await response.text()
+                    call.check_status(response.status)
+                    result["response_text"] = response_text
                 
-                if response.status == 200:
-                    logger.info(f"POST запрос успешно отправлен на {endpoint} для телефона {phone}. Ответ: {response_text[:200]}")
-                    result["success"] = True
+                    if response.status == 200:
+                        logger.info(f"POST запрос успешно отправлен на {endpoint} для телефона {phone}. Ответ: {response_text[:200]}")
+                        result["success"] = True
                     
-                    # Проверяем, зарегистрирован ли номер уже
-                    # Ищем в ответе индикаторы того, что номер уже зарегистрирован
-                    response_lower = response_text.lower()
-                    # Проверяем различные варианты сообщений о том, что номер уже зарегистрирован
-                    already_registered_indicators = [
-                        "уже зарегистрирован",
-                        "already registered",
-                        "уже существует",
-                        "already exists",
-                        "номер уже",
-                        "phone already",
-                        "уже есть",
-                        "duplicate"
-                    ]
+                        # Проверяем, зарегистрирован ли номер уже
+                        # Ищем в ответе индикаторы того, что номер уже зарегистрирован
+                        response_lower = response_text.lower()
+                        # Проверяем различные варианты сообщений о том, что номер уже зарегистрирован
+                        already_registered_indicators = [
+                            "уже зарегистрирован",
+                            "already registered",
+                            "уже существует",
+                            "already exists",
+                            "номер уже",
+                            "phone already",
+                            "уже есть",
+                            "duplicate"
+                        ]
                     
-                    for indicator in already_registered_indicators:
-                        if indicator in response_lower:
-                            result["already_registered"] = True
-                            logger.info(f"Номер {phone} уже зарегистрирован согласно ответу POST запроса")
-                            break
-                else:
-                    logger.warning(f"POST запрос на {endpoint} вернул статус {response.status} для телефона {phone}. Ответ: {response_text[:200]}")
+                        for indicator in already_registered_indicators:
+                            if indicator in response_lower:
+                                result["already_registered"] = True
+                                logger.info(f"Номер {phone} уже зарегистрирован согласно ответу POST запроса")
+                                break
+                    else:
+                        logger.warning(f"POST запрос на {endpoint} вернул статус {response.status} для телефона {phone}. Ответ: {response_text[:200]}")
+        except CircuitOpenError as e:
+            logger.warning(f"POST запрос на {endpoint} для телефона {phone} не отправлен: {e}")
+            result["response_text"] = str(e)
         except Exception as e:
             logger.exception(f"Ошибка при отправке POST запроса на {endpoint} для телефона {phone}: {e}")
             result["response_text"] = str(e)
@@ -362,7 +398,7 @@ async def cb_set_language(call: CallbackQuery, state: FSMContext):
     await call.answer()
     lang = call.data.split("_", 1)[1]  # 'ru', 'uz', 'tg', 'ky'
     user_id = call.from_user.id
-    user_langs[user_id] = lang
+    await user_lang_store.set(user_id, lang)
     
     # Проверяем наличие link_param в state
     state_data = await state.get_data()
@@ -400,7 +436,7 @@ async def cb_set_language(call: CallbackQuery, state: FSMContext):
     # User has consent, continue with normal flow
     if user:
         limited = await _is_limited_access(user.phone, getattr(user, "fio", None), user_id)
-        balance = 0 if limited else (get_balance_by_phone(user.phone) if user else 0)
+        balance = 0 if limited else (await get_jump_client().get_balance_by_phone(user.phone) if user else 0)
         date = get_date_lead(user.phone) if user and getattr(user, "phone", None) else None
         add_or_update_user(name=getattr(user, "fio", None), phone=user.phone, tg_id=user_id, in_metabase=not limited)
         main_text = get_msg("main_menu_text", lang, bal=balance, date=date or "0", invited=compute_referral_commissions_for_inviter(user.phone))
@@ -433,7 +469,7 @@ async def cb_consent_accept(call: CallbackQuery, state: FSMContext):
     user = await get_user_by_tg_id(user_id)
     if user:
         limited = await _is_limited_access(user.phone, getattr(user, "fio", None), user_id)
-        balance = 0 if limited else (get_balance_by_phone(user.phone) if user else 0)
+        balance = 0 if limited else (await get_jump_client().get_balance_by_phone(user.phone) if user else 0)
         date = get_date_lead(user.phone) if user and getattr(user, "phone", None) else None
         add_or_update_user(name=getattr(user, "fio", None), phone=user.phone, tg_id=user_id, in_metabase=not limited)
         main_text = get_msg("main_menu_text", lang, bal=balance, date=date or "0", invited=compute_referral_commissions_for_inviter(user.phone))
@@ -503,13 +539,13 @@ async def reg_contact(message: Message, state: FSMContext):
             await message.answer(FIRST_REGISTRATION_MESSAGE)
             await message.answer(FIRST_REGISTRATION_MESSAGE_CONTACTS)
             if city:
-                address = await asyncio.to_thread(get_uniform_address_by_city, city)
+                address = await find_uniform_address(city)
                 if address:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_EXISTS.format(uniform_address=address))
                 else:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_NOT_EXISTS)
         
-        balance = get_balance_by_phone(phone) if phone else 0
+        balance = await get_jump_client().get_balance_by_phone(phone) if phone else 0
         main_text = get_msg("main_menu_text", lang, bal=balance, date=get_date_lead(phone) or "0", invited=compute_referral_commissions_for_inviter(phone))
         await message.answer(main_text, reply_markup=build_main_menu(lang, limited=False, is_admin=_is_admin(message.from_user.id)))
         await state.clear()
@@ -553,13 +589,13 @@ async def reg_contact(message: Message, state: FSMContext):
                 await message.answer(FIRST_REGISTRATION_MESSAGE_CONTACTS)
                 city_from_data = data.get("Город")
                 if city_from_data:
-                    address = await asyncio.to_thread(get_uniform_address_by_city, city_from_data)
+                    address = await find_uniform_address(city_from_data)
                     if address:
                         await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_EXISTS.format(uniform_address=address))
                     else:
                         await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_NOT_EXISTS)
             
-            balance = get_balance_by_phone(phone) if phone else 0
+            balance = await get_jump_client().get_balance_by_phone(phone) if phone else 0
             main_text = get_msg("main_menu_text", lang, bal=balance, date=get_date_lead(phone) or "0", invited=compute_referral_commissions_for_inviter(phone))
             await message.answer(main_text, reply_markup=build_main_menu(lang, limited=False, is_admin=_is_admin(message.from_user.id)))
         else:
@@ -581,7 +617,7 @@ async def menu(message: Message, state: FSMContext):
     await state.clear()
     user = await get_user_by_tg_id(message.from_user.id)
     limited = await _is_limited_access(user.phone, getattr(user, "fio", None), message.from_user.id) if user else False
-    balance = 0 if limited else (get_balance_by_phone(user.phone) if user else 0)
+    balance = 0 if limited else (await get_jump_client().get_balance_by_phone(user.phone) if user else 0)
     if user:
         if limited:
             await message.answer(get_msg("limited_access_message", lang))
@@ -589,6 +625,24 @@ async def menu(message: Message, state: FSMContext):
         await message.answer(main_text, reply_markup=build_main_menu(lang, limited=limited, is_admin=_is_admin(message.from_user.id)))
 
 
+@urouter.message(Command("reload_messages"))
+async def cmd_reload_messages(message: Message):
+    lang = _get_lang_for_user(message.from_user.id)
+    if not _is_admin(message.from_user.id):
+        return
+    try:
+        count = reload_messages()
+    except Exception as e:
+        logger.exception("Failed to reload messages")
+        await message.answer(get_msg("messages_reload_error", lang, reason=str(e)))
+        return
+    warnings = message_catalog.warnings
+    text = get_msg("messages_reloaded", lang, count=count, warnings=len(warnings))
+    if warnings:
+        text += "\n" + "\n".join(warnings[:20])
+    await message.answer(text)
+
+
 @urouter.message(RegState.City)
 async def reg_city(message: Message, state: FSMContext):
     lang = _get_lang_for_user(message.from_user.id)
@@ -612,7 +666,7 @@ async def cb_courier_type(call: CallbackQuery, state: FSMContext):
     
     selected_type = call.data
     if selected_type not in courier_type_map:
-        await call.message.answer(get_msg("invalid_courier_type", lang) if "invalid_courier_type" in load_json() else "Неверный тип курьера. Пожалуйста, выберите один из предложенных вариантов.")
+        await call.message.answer(get_msg("invalid_courier_type", lang) if has_msg("invalid_courier_type") else "Неверный тип курьера. Пожалуйста, выберите один из предложенных вариантов.")
         return
     
     courier_type = courier_type_map[selected_type]
@@ -677,13 +731,13 @@ async def reg_courier_type_continue(message: Message, state: FSMContext, lang: s
             await message.answer(FIRST_REGISTRATION_MESSAGE)
             await message.answer(FIRST_REGISTRATION_MESSAGE_CONTACTS)
             if city_from_sheet:
-                address = await asyncio.to_thread(get_uniform_address_by_city, city_from_sheet)
+                address = await find_uniform_address(city_from_sheet)
                 if address:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_EXISTS.format(uniform_address=address))
                 else:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_NOT_EXISTS)
         
-        balance = get_balance_by_phone(phone) if phone else 0
+        balance = await get_jump_client().get_balance_by_phone(phone) if phone else 0
         main_text = get_msg("main_menu_text", lang, bal=balance, date=get_date_lead(phone) or "0", invited=compute_referral_commissions_for_inviter(phone))
         await message.answer(main_text, reply_markup=build_main_menu(lang, limited=False, is_admin=_is_admin(message.from_user.id)))
         await state.clear()
@@ -746,13 +800,13 @@ async def reg_courier_type_continue(message: Message, state: FSMContext, lang: s
             await message.answer(FIRST_REGISTRATION_MESSAGE)
             await message.answer(FIRST_REGISTRATION_MESSAGE_CONTACTS)
             if user_city:
-                address = await asyncio.to_thread(get_uniform_address_by_city, user_city)
+                address = await find_uniform_address(user_city)
                 if address:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_EXISTS.format(uniform_address=address))
                 else:
                     await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_NOT_EXISTS)
         
-        balance = get_balance_by_phone(phone)
+        balance = await get_jump_client().get_balance_by_phone(phone)
         main_text = get_msg("main_menu_text", lang, bal=balance, date=get_date_lead(phone) or "0", invited=compute_referral_commissions_for_inviter(phone))
         await message.answer(main_text,
                              reply_markup=build_main_menu(lang, limited=False, is_admin=_is_admin(tg_id)))
@@ -811,8 +865,7 @@ async def reg_courier_type_continue(message: Message, state: FSMContext, lang: s
             spreadsheet_id = EXTERNAL_SPREADSHEET_ID or SPREADSHEET_ID
             logger.info(f"[reg_courier_type] Using spreadsheet_id: {spreadsheet_id}")
             if spreadsheet_id:
-                ext_row = await asyncio.to_thread(
-                    add_person_to_external_sheet,
+                ext_row = await add_person_to_external_sheet_async(
                     spreadsheet_id=spreadsheet_id,
                     sheet_name="Лист1",
                     fio=name,
@@ -839,7 +892,7 @@ async def reg_courier_type_continue(message: Message, state: FSMContext, lang: s
                 await message.answer(FIRST_REGISTRATION_MESSAGE)
                 await message.answer(FIRST_REGISTRATION_MESSAGE_CONTACTS)
                 if city:
-                    address = await asyncio.to_thread(get_uniform_address_by_city, city)
+                    address = await find_uniform_address(city)
                     if address:
                         await message.answer(FIRST_REGISTRATION_MESSAGE_UNIFORM_EXISTS.format(uniform_address=address))
                     else:
@@ -950,7 +1003,7 @@ async def cb_friend_role(call: CallbackQuery, state: FSMContext):
     
     selected_type = call.data
     if selected_type not in courier_type_map:
-        await call.message.answer(get_msg("invalid_courier_type", lang) if "invalid_courier_type" in load_json() else "Неверный тип курьера. Пожалуйста, выберите один из предложенных вариантов.")
+        await call.message.answer(get_msg("invalid_courier_type", lang) if has_msg("invalid_courier_type") else "Неверный тип курьера. Пожалуйста, выберите один из предложенных вариантов.")
         return
     
     friend_role = courier_type_map[selected_type]
@@ -981,21 +1034,20 @@ async def invite_friend_birthday(message: Message, state: FSMContext):
 
     await message.answer(get_msg("manager_invite_friend_text", lang))
     try:
-        from .services import add_invite_friend_row
-        sheet_row = add_invite_friend_row(inviter_tg_id=inviter,
-                                          friend_name=name,
-                                          friend_phone=phone,
-                                          friend_tg_id=None,
-                                          inviter_name=user.fio,
-                                          inviter_phone=user.phone,
-                                          friend_city=city,
-                                          friend_role=role)
+        sheet_row = await add_invite_friend_row_async(inviter_tg_id=inviter,
+                                                      friend_name=name,
+                                                      friend_phone=phone,
+                                                      friend_tg_id=None,
+                                                      inviter_name=user.fio,
+                                                      inviter_phone=user.phone,
+                                                      friend_city=city,
+                                                      friend_role=role)
     except Exception:
         logger.exception("Ошибка записи в Google Sheets")
         sheet_row = None
 
     try:
-        ext_row = add_person_to_external_sheet(
+        ext_row = await add_person_to_external_sheet_async(
             spreadsheet_id=EXTERNAL_SPREADSHEET_ID,
             sheet_name=EXTERNAL_SHEET_NAME,
             fio=name,
@@ -1121,6 +1173,24 @@ def _normalize_sheet_value(val: Any) -> str:
     return str(val)
 
 
+CANDIDATE_EXTRA_FIELDS = ["source", "local_id", "tg_id", "ФИО партнера", "ФИО", "Телефон", "phone", "Город", "city", "created_at"]
+
+
+def _local_user_candidate(u: Any) -> Dict[str, Any]:
+    return {
+        "source": "local_db",
+        "local_id": getattr(u, "id", None),
+        "tg_id": getattr(u, "tg_id", None),
+        "ФИО партнера": getattr(u, "fio", None),
+        "ФИО": getattr(u, "fio", None),
+        "Телефон": getattr(u, "phone", None),
+        "phone": getattr(u, "phone", None),
+        "Город": getattr(u, "city", None),
+        "city": getattr(u, "city", None),
+        "created_at": getattr(u, "created_at", None),
+    }
+
+
 def _prepare_candidates_dataset(metabase_rows: List[Dict[str, Any]], local_users: List[Any]) -> (List[str], List[List[str]]):
     headers: List[str] = []
 
@@ -1136,8 +1206,7 @@ def _prepare_candidates_dataset(metabase_rows: List[Dict[str, Any]], local_users
             for k in row.keys():
                 add_header(k)
 
-    extra_fields = ["source", "local_id", "tg_id", "ФИО партнера", "ФИО", "Телефон", "phone", "Город", "city", "created_at"]
-    for f in extra_fields:
+    for f in CANDIDATE_EXTRA_FIELDS:
         add_header(f)
 
     records: List[Dict[str, Any]] = []
@@ -1150,19 +1219,7 @@ def _prepare_candidates_dataset(metabase_rows: List[Dict[str, Any]], local_users
         records.append(rec)
 
     for u in local_users or []:
-        rec = {
-            "source": "local_db",
-            "local_id": getattr(u, "id", None),
-            "tg_id": getattr(u, "tg_id", None),
-            "ФИО партнера": getattr(u, "fio", None),
-            "ФИО": getattr(u, "fio", None),
-            "Телефон": getattr(u, "phone", None),
-            "phone": getattr(u, "phone", None),
-            "Город": getattr(u, "city", None),
-            "city": getattr(u, "city", None),
-            "created_at": getattr(u, "created_at", None),
-        }
-        records.append({k: _normalize_sheet_value(v) for k, v in rec.items()})
+        records.append({k: _normalize_sheet_value(v) for k, v in _local_user_candidate(u).items()})
 
     table: List[List[str]] = []
     for rec in records:
@@ -1173,15 +1230,18 @@ def _prepare_candidates_dataset(metabase_rows: List[Dict[str, Any]], local_users
     return headers, table
 
 
-def _write_candidates_sheet(headers: List[str], table: List[List[str]]):
-    creds = _load_credentials()
-    client = gspread.authorize(creds)
+def _open_candidates_worksheet(headers: List[str], table: List[List[str]]):
+    client = _get_gspread_client()
     sheet = client.open_by_key(CANDIDATES_SPREADSHEET_ID or SPREADSHEET_ID)
     try:
-        ws = sheet.worksheet(CANDIDATES_SHEET_NAME)
+        return sheet.worksheet(CANDIDATES_SHEET_NAME)
     except Exception:
-        ws = sheet.add_worksheet(title=CANDIDATES_SHEET_NAME, rows=str(max(len(table) + 10, 1000)),
-                                 cols=str(max(len(headers) + 5, 20)))
+        return sheet.add_worksheet(title=CANDIDATES_SHEET_NAME, rows=str(max(len(table) + 10, 1000)),
+                                   cols=str(max(len(headers) + 5, 20)))
+
+
+def _write_candidates_sheet_full(headers: List[str], table: List[List[str]]):
+    ws = _open_candidates_worksheet(headers, table)
     ws.clear()
     payload = [headers] + table
     if not payload:
@@ -1189,13 +1249,360 @@ def _write_candidates_sheet(headers: List[str], table: List[List[str]]):
     # auto-range from A1 to bottom-right
     end_cell = rowcol_to_a1(len(payload), len(headers)) if headers else "A1"
     ws.update(f"A1:{end_cell}", payload, value_input_option="USER_ENTERED")
+    invalidate_sheet_cache(CANDIDATES_SPREADSHEET_ID or SPREADSHEET_ID, CANDIDATES_SHEET_NAME)
 
 
-async def _export_metabase_dataset() -> int:
+_SHEETS_EPOCH = datetime.date(1899, 12, 30)
+
+
+def _sheet_cell_matches(current: Any, new: str) -> bool:
+    """
+    Сравнивает ячейку, прочитанную с FORMULA-рендерингом, с тем, что мы бы записали.
+    USER_ENTERED превращает числа и даты в числа, поэтому сравниваем и по значению.
+    """
+    if current is None:
+        current = ""
+    if str(current) == new:
+        return True
+    if isinstance(current, bool):
+        return str(current).upper() == new.strip().upper()
+    if isinstance(current, (int, float)):
+        try:
+            return float(new.replace(",", ".").replace(" ", "")) == float(current)
+        except ValueError:
+            pass
+        try:
+            return len(new) == 10 and (datetime.date.fromisoformat(new) - _SHEETS_EPOCH).days == current
+        except ValueError:
+            return False
+    return False
+
+
+def _candidate_row_keys(headers: List[str], rows: List[List[Any]]) -> List[tuple]:
+    """
+    Ключ строки: (source, последние 10 цифр телефона, номер повтора) —
+    повторы одного телефона различаются по порядку появления.
+    """
+    src_idx = headers.index("source") if "source" in headers else None
+    phone_idxs = [headers.index(h) for h in ("Телефон", "phone") if h in headers]
+    seen: Dict[tuple, int] = {}
+    keys = []
+    for row in rows:
+        source = str(row[src_idx]) if src_idx is not None and src_idx < len(row) else ""
+        phone = ""
+        for i in phone_idxs:
+            if i < len(row):
+                phone = re.sub(r"\D+", "", str(row[i]))[-10:]
+                if phone:
+                    break
+        base = (source, phone)
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        keys.append((source, phone, n))
+    return keys
+
+
+def _diff_candidate_rows(current: List[List[Any]], headers: List[str],
+                         table: List[List[str]], width: int) -> (Dict[int, List[str]], Dict[str, int]):
+    """
+    Возвращает {номер строки: значения} для записи и счётчики изменений.
+    Новые строки занимают места удалённых/пустых строк, остальные дописываются в конец;
+    неиспользованные места удалённых строк очищаются.
+    """
+    def pad(row):
+        return list(row) + [""] * (width - len(row))
+
+    writes: Dict[int, List[str]] = {}
+    if not current or [str(c) for c in current[0]][:len(headers)] != headers \
+            or any(str(c).strip() for c in current[0][len(headers):]):
+        # заголовки поменялись — переписываем все строки поверх старых (без clear)
+        writes[1] = pad(headers)
+        for i, row in enumerate(table, start=2):
+            writes[i] = pad(row)
+        for i in range(len(table) + 2, len(current) + 1):
+            writes[i] = [""] * width
+        return writes, {"changed": len(table), "added": 0, "removed": max(0, len(current) - 1 - len(table))}
+
+    occupied = []
+    free = []
+    for i, row in enumerate(current[1:], start=2):
+        if any(str(c).strip() for c in row):
+            occupied.append((i, row))
+        else:
+            free.append(i)
+    slots = dict(zip(_candidate_row_keys(headers, [row for _, row in occupied]), occupied))
+
+    added = []
+    changed = 0
+    for key, row in zip(_candidate_row_keys(headers, table), table):
+        hit = slots.pop(key, None)
+        if hit is None:
+            added.append(row)
+            continue
+        row_number, cur = hit
+        cur = list(cur) + [""] * (width - len(cur))
+        new = pad(row)
+        if not all(_sheet_cell_matches(a, b) for a, b in zip(cur, new)):
+            writes[row_number] = new
+            changed += 1
+
+    removed = len(slots)
+    free = sorted(free + [row_number for row_number, _ in slots.values()])
+    next_row = max(len(current), 1) + 1
+    for n, row in enumerate(added):
+        if n < len(free):
+            writes[free[n]] = pad(row)
+        else:
+            writes[next_row] = pad(row)
+            next_row += 1
+    for row_number in free[len(added):]:
+        writes[row_number] = [""] * width
+    return writes, {"changed": changed, "added": len(added), "removed": removed}
+
+
+def _candidate_write_ranges(writes: Dict[int, List[str]], width: int) -> List[Dict[str, Any]]:
+    """
+    Склеивает подряд идущие строки в диапазоны для batch_update.
+    """
+    ranges = []
+    run: List[int] = []
+    for row_number in sorted(writes):
+        if run and (row_number != run[-1] + 1 or len(run) >= CANDIDATES_EXPORT_BATCH_ROWS):
+            ranges.append(run)
+            run = []
+        run.append(row_number)
+    if run:
+        ranges.append(run)
+    return [{"range": f"A{r[0]}:{rowcol_to_a1(r[-1], width)}", "values": [writes[i] for i in r]} for r in ranges]
+
+
+def _write_candidates_sheet_diff(headers: List[str], table: List[List[str]]) -> Dict[str, int]:
+    ws = _open_candidates_worksheet(headers, table)
+    current = ws.get_all_values(value_render_option=ValueRenderOption.formula)
+    width = max([len(headers)] + [len(r) for r in current[:1]] + [1])
+    writes, stats = _diff_candidate_rows(current, headers, table, width)
+    if not writes:
+        return stats
+
+    last_row = max(writes)
+    if last_row > ws.row_count:
+        ws.add_rows(last_row - ws.row_count)
+    if width > ws.col_count:
+        ws.add_cols(width - ws.col_count)
+
+    batch: List[Dict[str, Any]] = []
+    batch_rows = 0
+    for item in _candidate_write_ranges(writes, width):
+        batch.append(item)
+        batch_rows += len(item["values"])
+        if batch_rows >= CANDIDATES_EXPORT_BATCH_ROWS:
+            ws.batch_update(batch, value_input_option="USER_ENTERED")
+            batch, batch_rows = [], 0
+    if batch:
+        ws.batch_update(batch, value_input_option="USER_ENTERED")
+    invalidate_sheet_cache(CANDIDATES_SPREADSHEET_ID or SPREADSHEET_ID, CANDIDATES_SHEET_NAME)
+    return stats
+
+
+def _write_candidates_sheet(headers: List[str], table: List[List[str]]):
+    if CANDIDATES_EXPORT_MODE == "full":
+        _write_candidates_sheet_full(headers, table)
+        return
+    stats = _write_candidates_sheet_diff(headers, table)
+    logger.info(f"Candidates export diff: {stats}")
+
+
+async def _aiter_in_thread(make_iter, batch_size: int = 500, max_batches: int = 4):
+    """
+    Превращает синхронный итератор (например, потоковое чтение HTTP-ответа) в async-генератор.
+    Итератор крутится в отдельном потоке и передаёт элементы пачками; очередь ограничена
+    max_batches пачками — это backpressure, поток не убегает вперёд записи.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(max_batches)
+    stop = threading.Event()
+
+    def put(batch, error=None):
+        asyncio.run_coroutine_threadsafe(queue.put((batch, error)), loop).result()
+
+    def produce():
+        batch = []
+        try:
+            for item in make_iter():
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    put(batch)
+                    batch = []
+                    if stop.is_set():
+                        return
+            if batch:
+                put(batch)
+            put(None)
+        except Exception as e:
+            if not stop.is_set():
+                put(None, e)
+
+    producer = asyncio.create_task(asyncio.to_thread(produce))
+    try:
+        while True:
+            batch, error = await queue.get()
+            if error is not None:
+                raise error
+            if batch is None:
+                break
+            for item in batch:
+                yield item
+    finally:
+        stop.set()
+        while not queue.empty():
+            queue.get_nowait()
+        await producer
+
+
+async def _iter_candidate_records():
+    async for row in _aiter_in_thread(iter_metabase_rows):
+        if isinstance(row, dict):
+            row.setdefault("source", "metabase")
+            yield row
+    async for u in iter_all_users():
+        yield _local_user_candidate(u)
+
+
+def _candidate_headers(first: Optional[Dict[str, Any]]) -> List[str]:
+    """
+    Колонки потоковой выгрузки: поля первой строки Metabase + служебные поля.
+    """
+    headers: List[str] = []
+    for h in list(first or {}) + CANDIDATE_EXTRA_FIELDS:
+        h = str(h).strip()
+        if h and h not in headers:
+            headers.append(h)
+    return headers
+
+
+async def _export_candidates_streaming() -> int:
+    """
+    Потоковая выгрузка: строки Metabase и БД нормализуются по одной и пишутся чанками
+    поверх старых данных (до CANDIDATES_EXPORT_CONCURRENCY чанков одновременно),
+    затем хвост и лишние колонки очищаются. В памяти не больше concurrency+1 чанков.
+    """
+    client = get_sheets_client()
+    spreadsheet_id = CANDIDATES_SPREADSHEET_ID or SPREADSHEET_ID
+    title = CANDIDATES_SHEET_NAME
+
+    records = _iter_candidate_records()
+    first = await anext(records, None)
+    headers = _candidate_headers(first)
+    width = len(headers)
+
+    props = await client.get_sheet_properties(spreadsheet_id, title)
+    if props is None:
+        await client.add_sheet(spreadsheet_id, title, cols=max(width + 5, 20))
+        props = await client.get_sheet_properties(spreadsheet_id, title)
+    sheet_id = props["sheetId"]
+    grid = {"rows": props["gridProperties"]["rowCount"], "cols": props["gridProperties"]["columnCount"]}
+    old_cols = grid["cols"]
+    if width > grid["cols"]:
+        await client.append_dimension(spreadsheet_id, sheet_id, width - grid["cols"], dimension="COLUMNS")
+        grid["cols"] = width
+
+    grid_lock = asyncio.Lock()
+    sem = asyncio.Semaphore(CANDIDATES_EXPORT_CONCURRENCY)
+    tasks: List[asyncio.Task] = []
+
+    async def write_chunk(start_row: int, rows: List[List[str]]):
+        try:
+            end_row = start_row + len(rows) - 1
+            async with grid_lock:
+                if end_row > grid["rows"]:
+                    extra = max(end_row - grid["rows"], CANDIDATES_EXPORT_CHUNK_ROWS)
+                    await client.append_dimension(spreadsheet_id, sheet_id, extra)
+                    grid["rows"] += extra
+            cells = f"A{start_row}:{rowcol_to_a1(end_row, width)}"
+            await client.values_batch_update(spreadsheet_id, [{"range": sheet_range(title, cells), "values": rows}])
+        finally:
+            sem.release()
+
+    async def submit(start_row: int, rows: List[List[str]]):
+        await sem.acquire()
+        for t in [t for t in tasks if t.done()]:
+            tasks.remove(t)
+            t.result()  # пробрасываем ошибку записи сразу, не дожидаясь конца выгрузки
+        tasks.append(asyncio.create_task(write_chunk(start_row, rows)))
+
+    total = 0
+    next_row = 1
+    chunk: List[List[str]] = [headers]
+    try:
+        rec = first
+        while rec is not None:
+            chunk.append([_normalize_sheet_value(rec.get(h)) for h in headers])
+            total += 1
+            if len(chunk) >= CANDIDATES_EXPORT_CHUNK_ROWS:
+                await submit(next_row, chunk)
+                next_row += len(chunk)
+                chunk = []
+            rec = await anext(records, None)
+        if chunk:
+            await submit(next_row, chunk)
+            next_row += len(chunk)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    finally:
+        await records.aclose()
+
+    # всё, что осталось от прошлой выгрузки ниже и правее новых данных
+    stale = []
+    if next_row <= grid["rows"]:
+        stale.append(sheet_range(title, f"A{next_row}:{rowcol_to_a1(grid['rows'], grid['cols'])}"))
+    if width < old_cols:
+        stale.append(sheet_range(title, f"{rowcol_to_a1(1, width + 1)}:{rowcol_to_a1(next_row - 1, old_cols)}"))
+    if stale:
+        await client.values_batch_clear(spreadsheet_id, stale)
+    invalidate_sheet_cache(spreadsheet_id, title)
+    return total
+
+
+def _write_candidates_file(path: str, headers: List[str], table: List[List[str]]) -> None:
+    # utf-8-sig: после распаковки Excel сразу понимает кириллицу
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="", compresslevel=CANDIDATES_FILE_COMPRESSLEVEL) as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for start in range(0, len(table), CANDIDATES_EXPORT_CHUNK_ROWS):
+            writer.writerows(table[start:start + CANDIDATES_EXPORT_CHUNK_ROWS])
+
+
+async def _export_candidates_file() -> (str, int):
+    """
+    Пишет те же строки, что и выгрузка в таблицу (_prepare_candidates_dataset), в gzip-CSV во временный файл,
+    минуя Google Sheets. Возвращает (путь к файлу, число строк); удалить файл должен вызывающий.
+    """
     metabase_rows = await asyncio.to_thread(fetch_all_metabase_rows)
     local_users = await get_all_users()
     headers, table = _prepare_candidates_dataset(metabase_rows, local_users)
-    await asyncio.to_thread(_write_candidates_sheet, headers, table)
+    fd, path = tempfile.mkstemp(prefix="candidates_", suffix=".csv.gz")
+    os.close(fd)
+    try:
+        # сжатие — CPU, не держим им event loop
+        await asyncio.to_thread(_write_candidates_file, path, headers, table)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, len(table)
+
+
+async def _export_metabase_dataset() -> int:
+    # выгрузка фоновая: не должна съедать квоту Sheets, нужную пользовательским запросам
+    with sheets_priority(PRIORITY_BACKGROUND):
+        if CANDIDATES_EXPORT_MODE == "stream":
+            return await _export_candidates_streaming()
+        metabase_rows = await asyncio.to_thread(fetch_all_metabase_rows)
+        local_users = await get_all_users()
+        headers, table = _prepare_candidates_dataset(metabase_rows, local_users)
+        await asyncio.to_thread(_write_candidates_sheet, headers, table)
     return len(table)
 
 
@@ -1215,6 +1622,28 @@ async def cb_export_metabase(call: CallbackQuery):
         await call.message.answer(get_msg("metabase_export_error", lang, reason=str(e)))
 
 
+@urouter.callback_query(F.data == "export_metabase_file")
+async def cb_export_metabase_file(call: CallbackQuery):
+    lang = _get_lang_for_user(call.from_user.id)
+    if not _is_admin(call.from_user.id):
+        await call.answer(get_msg("metabase_export_denied", lang), show_alert=True)
+        return
+    await call.answer()
+    await call.message.answer(get_msg("metabase_file_export_started", lang))
+    path = None
+    try:
+        path, total = await _export_candidates_file()
+        filename = f"candidates_{datetime.date.today().isoformat()}.csv.gz"
+        await bot.send_document(call.message.chat.id, FSInputFile(path, filename=filename),
+                                caption=get_msg("metabase_file_export_done", lang, count=total))
+    except Exception as e:
+        logger.exception("Failed to export metabase dataset to file")
+        await call.message.answer(get_msg("metabase_export_error", lang, reason=str(e)))
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
 @urouter.callback_query(F.data == "promotions")
 async def cb_promotions(call: CallbackQuery, state: FSMContext):
     lang = _get_lang_for_user(call.from_user.id)
@@ -1226,7 +1655,8 @@ async def cb_promotions(call: CallbackQuery, state: FSMContext):
         return
 
     try:
-        promos = await asyncio.to_thread(get_promotions, phone)
+        sources = await load_promotion_sources_from_db(phone)
+        promos = await asyncio.to_thread(get_promotions, phone, sources=sources)
     except Exception:
         logger.exception("Error getting promotions")
         await call.message.answer(get_msg("promotions_error", lang))
@@ -1416,7 +1846,7 @@ async def withdraw_enter_amount(message: Message, state: FSMContext):
         return
 
     # get balance to check minimum remain 50
-    balance = get_balance_by_phone(user.phone)
+    balance = await get_jump_client().get_balance_by_phone(user.phone)
     try:
         bal = float(balance)
     except Exception:
@@ -1453,6 +1883,36 @@ async def cb_withdraw_method_sbp(call: CallbackQuery, state: FSMContext):
     await call.message.answer(get_msg("ask_sbp_phone", lang))
 
 
+async def _save_withdrawal_job(message: Message, lang: str, user, amount, **fields):
+    """
+    Создаёт заявку в WithdrawalJobs. Ключ идемпотентности — исходное сообщение,
+    так что повторная доставка апдейта не создаёт вторую заявку и не шлёт менеджеру дубль.
+    None — заявка не сохранена или уже была отправлена (пользователю уже ответили).
+    """
+    try:
+        job, created = await create_withdrawal_job(
+            f"tg:{message.chat.id}:{message.message_id}",
+            user_id=message.from_user.id,
+            user_phone=user.phone if user else None,
+            amount=Decimal(str(amount)),
+            **fields)
+    except Exception:
+        logger.exception("Failed to save withdrawal request of {}", message.from_user.id)
+        await message.answer(get_msg("withdraw_request_save_error", lang))
+        return None
+    if not created:
+        await message.answer(get_msg("withdraw_request_sent_to_manager", lang))
+        return None
+    return job
+
+
+def _withdrawal_job_id(data: str, prefix: str) -> Optional[int]:
+    try:
+        return int(data.split(prefix, 1)[1])
+    except Exception:
+        return None
+
+
 @urouter.message(WithdrawStates.card_number)
 async def withdraw_card_number_enter(message: Message, state: FSMContext):
     lang = _get_lang_for_user(message.from_user.id)
@@ -1465,19 +1925,12 @@ async def withdraw_card_number_enter(message: Message, state: FSMContext):
     await state.update_data(withdraw_method="card", card_number=digits)
     data = await state.get_data()
     amount = data.get("withdraw_amount")
-    # создаём локальную заявку менеджеру
-    pid = _next_local()
+    # сохраняем заявку менеджеру в WithdrawalJobs
     user = await get_user_by_tg_id(message.from_user.id)
-    pending_actions[pid] = {
-        "type": "withdraw",
-        "user_id": message.from_user.id,
-        "user_phone": user.phone if user else None,
-        "amount": amount,
-        "method": "card",
-        "card_number": digits,
-        "status": "pending",
-        "created_at": datetime.datetime.utcnow().isoformat()
-    }
+    job = await _save_withdrawal_job(message, lang, user, amount, method="card", card_last4=digits[-4:])
+    if job is None:
+        return
+    pid = job.id
     manager_text = (
         f"Заявка вывода #{pid}\n"
         f"Пользователь: {(user.fio if user and getattr(user, "fio", None) else str(message.from_user.id))} (TG: {message.from_user.id})\n"
@@ -1517,20 +1970,12 @@ async def withdraw_sbp_bank_enter(message: Message, state: FSMContext):
     data = await state.get_data()
     amount = data.get("withdraw_amount")
     sbp_phone = data.get("sbp_phone")
-    # создаём локальную заявку менеджеру
-    pid = _next_local()
+    # сохраняем заявку менеджеру в WithdrawalJobs
     user = await get_user_by_tg_id(message.from_user.id)
-    pending_actions[pid] = {
-        "type": "withdraw",
-        "user_id": message.from_user.id,
-        "user_phone": user.phone if user else None,
-        "amount": amount,
-        "method": "sbp",
-        "sbp_phone": sbp_phone,
-        "sbp_bank": bank,
-        "status": "pending",
-        "created_at": datetime.datetime.utcnow().isoformat()
-    }
+    job = await _save_withdrawal_job(message, lang, user, amount, method="sbp", sbp_phone=sbp_phone, sbp_bank=bank)
+    if job is None:
+        return
+    pid = job.id
     # уведомляем менеджера (русский язык для менеджера)
 
     manager_text = (
@@ -1549,111 +1994,134 @@ async def withdraw_sbp_bank_enter(message: Message, state: FSMContext):
     await state.set_state(WithdrawStates.awaiting_manager)
 
 
+def _can_manage_withdrawals(tg_id: int) -> bool:
+    return str(tg_id) == str(MANAGER_CHAT_ID) or _is_admin(tg_id)
+
+
 # Менеджер подтверждает / отклоняет (кнопки приходят на MANAGER_CHAT_ID)
 @urouter.callback_query(F.data.startswith("withdraw_confirm_"))
 async def cb_manager_confirm_withdraw(call: CallbackQuery):
     await call.answer()
-    # разрешаем подтверждать только менеджеру (жёсткая проверка)
+    # подтверждать могут те же, кто одобряет пакетом: менеджер и админы
+    if not _can_manage_withdrawals(call.from_user.id):
+        await call.message.answer("Нет прав для подтверждения операции.")
+        return
+
+    pid = _withdrawal_job_id(call.data, "withdraw_confirm_")
+    # одобряем только заявку в статусе pending: повторное нажатие или второй менеджер ничего не сделают
     try:
-        if str(call.from_user.id) != str(MANAGER_CHAT_ID):
-            await call.message.answer("Нет прав для подтверждения операции.")
-            return
+        approved = pid is not None and await transition_withdrawal_job(pid, "pending", "approved", manager_id=call.from_user.id)
     except Exception:
-        pass
-
-    pid = call.data.split("withdraw_confirm_", 1)[1]
-    entry = pending_actions.get(pid)
-    if not entry or entry.get("type") != "withdraw":
+        logger.exception("Failed to approve withdrawal {}", pid)
+        approved = False
+    if not approved:
         await call.message.answer("Заявка не найдена или уже обработана.")
         return
 
-    # Помечаем как approved, запускаем API-вывод
-    entry["status"] = "approved"
-    entry["manager_id"] = call.from_user.id
-    # Подготавливаем параметры вызова perform_withdrawal
-    user_phone_for_api = entry.get("user_phone")
-    amount = entry.get("amount")
-    method = entry.get("method")
-    # уведомляем менеджера, что выполняем
+    # выплату выполняет воркер очереди (handlers/withdrawals.py), он же сообщит результат
+    request_withdrawal_processing()
     await call.message.answer(get_msg("manager_started_withdraw", "ru", pid=pid))
-    # выполняем вывод в отдельном потоке
-    try:
-        if method == "card":
-            card = entry.get("card_number")
-            res = await asyncio.to_thread(perform_withdrawal, phone=user_phone_for_api, amount=amount, card_number=card)
-        else:
-            # sbp
-            sbp_phone = entry.get("sbp_phone")
-            sbp_bank = entry.get("sbp_bank")
-            res = await asyncio.to_thread(perform_withdrawal, phone=user_phone_for_api, amount=amount, phone_hint=sbp_phone, bank_hint=sbp_bank)
-    except Exception as e:
-        logger.exception("Error performing withdrawal for pid %s", pid)
-        res = {"ok": False, "reason": "exception", "error": str(e)}
-
-    # уведомляем менеджера и пользователя о результате
-    entry["api_result"] = res
-    if res.get("ok"):
-        entry["status"] = "done"
-        # уведомляем пользователя
-        try:
-            user_id = entry.get("user_id")
-            user_lang = _get_lang_for_user(user_id)
-            await bot.send_message(user_id, get_msg("withdraw_success_user", user_lang, amount_sent=float(res.get("amount_sent", amount))))
-        except Exception:
-            logger.exception("Can't notify user about successful withdrawal")
-        await call.message.answer(get_msg("manager_withdraw_done", "ru", pid=pid))
-    else:
-        entry["status"] = "failed"
-        reason = res.get("reason") or res.get("error") or "unknown"
-        try:
-            user_id = entry.get("user_id")
-            user_lang = _get_lang_for_user(user_id)
-            await bot.send_message(user_id, get_msg("withdraw_failed_user", user_lang, reason=reason))
-        except Exception:
-            logger.exception("Can't notify user about failed withdrawal")
-        await call.message.answer(get_msg("manager_withdraw_failed", "ru", pid=pid, reason=reason))
-
-    # опционально: показываем менеджеру raw result
-    try:
-        await call.message.answer(f"API result: {str(res)[:1500]}")
-    except Exception:
-        pass
 
 
 @urouter.callback_query(F.data.startswith("withdraw_reject_"))
 async def cb_manager_reject_withdraw(call: CallbackQuery):
     await call.answer()
+    if not _can_manage_withdrawals(call.from_user.id):
+        await call.message.answer("Нет прав для отклонения операции.")
+        return
+
+    pid = _withdrawal_job_id(call.data, "withdraw_reject_")
     try:
-        if str(call.from_user.id) != str(MANAGER_CHAT_ID):
-            await call.message.answer("Нет прав для отклонения операции.")
-            return
+        rejected = pid is not None and await transition_withdrawal_job(pid, "pending", "rejected", manager_id=call.from_user.id)
+        job = await get_withdrawal_job(pid) if rejected else None
     except Exception:
-        pass
-
-    pid = call.data.split("withdraw_reject_", 1)[1]
-    entry = pending_actions.get(pid)
-    if not entry or entry.get("type") != "withdraw":
+        logger.exception("Failed to reject withdrawal {}", pid)
+        rejected, job = False, None
+    if not rejected or job is None:
         await call.message.answer("Заявка не найдена или уже обработана.")
         return
 
-    entry["status"] = "rejected"
-    entry["manager_id"] = call.from_user.id
     # уведомляем пользователя
     try:
-        user_id = entry.get("user_id")
+        user_id = job.user_id
+        await user_lang_store.load(user_id)
         user_lang = _get_lang_for_user(user_id)
         await bot.send_message(user_id, get_msg("withdraw_rejected_user", user_lang))
     except Exception:
         logger.exception("Can't notify user about rejected withdrawal")
     await call.message.answer(get_msg("manager_withdraw_rejected", "ru", pid=pid))
 
+
+@urouter.message(Command("withdrawals"))
+async def cmd_pending_withdrawals(message: Message):
+    if not _can_manage_withdrawals(message.from_user.id):
+        return
+    try:
+        jobs = await get_pending_withdrawal_jobs()
+    except Exception:
+        logger.exception("Failed to load pending withdrawals")
+        await message.answer("Не удалось получить список заявок.")
+        return
+    if not jobs:
+        await message.answer("Нет заявок, ожидающих подтверждения.")
+        return
+    for chunk in _split_text_chunks(format_pending_withdrawals(jobs)):
+        await message.answer(chunk)
+
+
+@urouter.message(Command("approve_withdrawals"))
+async def cmd_approve_withdrawals(message: Message, command: CommandObject):
+    """
+    /approve_withdrawals all | <id> <id> ... — одобряет пачку заявок, выполняет их параллельно
+    с ограничением скорости и присылает один общий итог вместо сообщений по каждой заявке.
+    """
+    if not _can_manage_withdrawals(message.from_user.id):
+        return
+    args = (command.args or "").replace(",", " ").split()
+    if not args:
+        await message.answer("Укажите номера заявок или all: /approve_withdrawals 12 15 18")
+        return
+    job_ids: Optional[List[int]] = None
+    if [a.lower() for a in args] != ["all"]:
+        try:
+            job_ids = sorted({int(a.lstrip("#")) for a in args})
+        except ValueError:
+            await message.answer("Номера заявок должны быть числами.")
+            return
+
+    # pending -> approved одним запросом: заявки, которые уже обработал другой менеджер, сюда не попадут
+    try:
+        jobs = await approve_pending_withdrawal_jobs(job_ids, manager_id=message.from_user.id)
+    except Exception:
+        logger.exception("Failed to approve withdrawals {}", job_ids or "all")
+        await message.answer("Не удалось одобрить заявки.")
+        return
+    skipped = sorted(set(job_ids) - {j.id for j in jobs}) if job_ids else []
+    if not jobs:
+        await message.answer("Заявки не найдены или уже обработаны.")
+        return
+
+    total = sum(float(j.amount) for j in jobs)
+    await message.answer(f"Одобрено заявок: {len(jobs)} на {total:.2f} ₽. Выполняю, итог пришлю одним сообщением.")
+    results = await run_withdrawal_batch(jobs)
+    processed = {j.id for j, _ in results}
+    queued = [j.id for j in jobs if j.id not in processed]
+    for chunk in _split_text_chunks(format_withdrawal_batch_summary(results, skipped=skipped, queued=queued)):
+        try:
+            await bot.send_message(int(MANAGER_CHAT_ID), chunk)
+        except Exception:
+            logger.exception("Can't send withdrawal batch summary")
+        if str(message.chat.id) != str(MANAGER_CHAT_ID):
+            await message.answer(chunk)
+
+
 @urouter.callback_query(F.data == "to_start")
 async def cb_to_start(call: CallbackQuery):
     lang = _get_lang_for_user(call.from_user.id)
     await call.answer()
     user = await get_user_by_tg_id(call.from_user.id)
     limited = await _is_limited_access(user.phone, getattr(user, "fio", None), call.from_user.id) if user else False
-    balance = 0 if limited else (get_balance_by_phone(user.phone) if user else 0)
+    balance = 0 if limited else (await get_jump_client().get_balance_by_phone(user.phone) if user else 0)
     if limited:
         await _safe_send_message(
             call.message.answer,
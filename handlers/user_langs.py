@@ -0,0 +1,81 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from cachetools import TTLCache
+from decouple import config
+
+from db.crud import get_user_language, set_user_language
+
+logger = logging.getLogger("user_langs")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+DEFAULT_LANG = "ru"
+USER_LANG_CACHE_SIZE = int(config("USER_LANG_CACHE_SIZE", default="100000"))
+# язык, выбранный через другой экземпляр бота, виден здесь не позже чем через USER_LANG_CACHE_TTL
+USER_LANG_CACHE_TTL = float(config("USER_LANG_CACHE_TTL", default="600"))
+# «язык не сохранён» помним недолго, чтобы новые пользователи не спрашивали БД на каждый апдейт
+USER_LANG_MISS_TTL = float(config("USER_LANG_MISS_TTL", default="30"))
+
+
+class UserLanguageStore:
+    """
+    Язык пользователя: TTL-кэш в памяти поверх таблицы UserLanguages (write-through).
+    get() — синхронный и не ходит в БД; загрузку при промахе делает UserLanguageMiddleware.
+    Отсутствие сохранённого языка кэшируется отдельно и только на miss_ttl.
+    """
+
+    def __init__(self, maxsize: int = USER_LANG_CACHE_SIZE, ttl: float = USER_LANG_CACHE_TTL,
+                 miss_ttl: float = USER_LANG_MISS_TTL):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._misses: TTLCache = TTLCache(maxsize=maxsize, ttl=miss_ttl)
+
+    def get(self, tg_id: int, default: str = DEFAULT_LANG) -> str:
+        return self._cache.get(tg_id) or default
+
+    async def load(self, tg_id: int) -> Optional[str]:
+        lang = self._cache.get(tg_id)
+        if lang is not None or tg_id in self._misses:
+            return lang
+        try:
+            lang = await get_user_language(tg_id)
+        except Exception:
+            # не кэшируем: при следующем апдейте попробуем ещё раз
+            logger.exception("Failed to load language for %s", tg_id)
+            return None
+        if lang:
+            self._cache[tg_id] = lang
+        else:
+            self._misses[tg_id] = True
+        return lang
+
+    async def set(self, tg_id: int, lang: str) -> None:
+        self._cache[tg_id] = lang
+        self._misses.pop(tg_id, None)
+        try:
+            await set_user_language(tg_id, lang)
+        except Exception:
+            logger.exception("Failed to save language %s for %s", lang, tg_id)
+
+
+user_lang_store = UserLanguageStore()
+
+
+class UserLanguageMiddleware(BaseMiddleware):
+    """
+    Outer-middleware: до хендлера подгружает язык пользователя в кэш, если его там нет.
+    """
+
+    def __init__(self, store: UserLanguageStore = user_lang_store):
+        self.store = store
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            await self.store.load(user.id)
+        return await handler(event, data)
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from typing import Any, Dict, List, Optional, Tuple
+
+from decouple import config
+
+from create_bot import bot
+from db import crud
+from db.models import WithdrawalJobs
+from jump.jump_async import get_jump_client
+from jump.jump_cache import jump_request_scope, phone_key
+from sheets.quota import TokenBucket
+from .services import get_msg
+from .user_langs import user_lang_store
+
+logger = logging.getLogger("withdrawals")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+MANAGER_CHAT_ID = config("MANAGER_CHAT_ID")
+WITHDRAW_WORKERS = int(config("WITHDRAW_WORKERS", default="2"))
+# как часто воркер сам проверяет очередь, если его не разбудили
+WITHDRAW_POLL_INTERVAL = float(config("WITHDRAW_POLL_INTERVAL", default="10"))
+WITHDRAW_RESULT_MAX_LEN = 20000
+# экземпляр бота, от имени которого берутся заявки; аренду продлеваем раз в WITHDRAW_HEARTBEAT_INTERVAL,
+# заявки без продления дольше WITHDRAW_LEASE_SECONDS считаются прерванными
+INSTANCE_ID = config("INSTANCE_ID", default=f"{socket.gethostname()}:{os.getpid()}")[:64]
+WITHDRAW_HEARTBEAT_INTERVAL = float(config("WITHDRAW_HEARTBEAT_INTERVAL", default="30"))
+WITHDRAW_LEASE_SECONDS = float(config("WITHDRAW_LEASE_SECONDS", default="180"))
+# в result не сохраняем профиль и реквизиты водителя из ответа Jump
+_RESULT_PRIVATE_KEYS = ("driver", "profile", "candidates")
+# пакетное одобрение: сколько выплат идёт одновременно и сколько можно начать в минуту
+WITHDRAW_BULK_CONCURRENCY = int(config("WITHDRAW_BULK_CONCURRENCY", default="5"))
+WITHDRAW_BULK_PER_MINUTE = int(config("WITHDRAW_BULK_PER_MINUTE", default="60"))
+
+_wakeup = asyncio.Event()
+
+
+def request_withdrawal_processing() -> None:
+    """
+    Будит воркеры сразу после одобрения заявки, не дожидаясь WITHDRAW_POLL_INTERVAL.
+    """
+    _wakeup.set()
+
+
+async def _user_lang(user_id: int) -> str:
+    await user_lang_store.load(user_id)
+    return user_lang_store.get(user_id)
+
+
+async def _notify_result(job: WithdrawalJobs, res: Dict[str, Any], notify_manager: bool = True) -> None:
+    pid = job.id
+    if res.get("ok"):
+        try:
+            amount_sent = float(res.get("amount_sent", job.amount))
+            await bot.send_message(job.user_id, get_msg("withdraw_success_user", await _user_lang(job.user_id), amount_sent=amount_sent))
+        except Exception:
+            logger.exception("Can't notify user about successful withdrawal #%s", pid)
+        manager_text = get_msg("manager_withdraw_done", "ru", pid=pid)
+    else:
+        reason = res.get("reason") or res.get("error") or "unknown"
+        try:
+            await bot.send_message(job.user_id, get_msg("withdraw_failed_user", await _user_lang(job.user_id), reason=reason))
+        except Exception:
+            logger.exception("Can't notify user about failed withdrawal #%s", pid)
+        manager_text = get_msg("manager_withdraw_failed", "ru", pid=pid, reason=reason)
+    if not notify_manager:
+        return
+    try:
+        await bot.send_message(int(MANAGER_CHAT_ID), manager_text)
+        await bot.send_message(int(MANAGER_CHAT_ID), f"API result: {str(res)[:1500]}")
+    except Exception:
+        logger.exception("Can't notify manager about withdrawal #%s", pid)
+
+
+async def process_withdrawal_job(job: WithdrawalJobs, notify_manager: bool = True) -> Dict[str, Any]:
+    """
+    Выполняет заявку в статусе processing и переводит её в done/failed.
+    notify_manager=False — менеджер получит общий итог пакета вместо сообщения по каждой заявке.
+    """
+    if job.method == "card":
+        kwargs = {"card_number": job.card_last4}
+    else:
+        kwargs = {"phone_hint": job.sbp_phone, "bank_hint": job.sbp_bank}
+    try:
+        res = await get_jump_client().perform_withdrawal(phone=job.user_phone, amount=float(job.amount), **kwargs)
+    except Exception as e:
+        logger.exception("Error performing withdrawal #%s", job.id)
+        res = {"ok": False, "reason": "exception", "error": str(e)}
+
+    status = "done" if res.get("ok") else "failed"
+    reason = None if res.get("ok") else str(res.get("reason") or res.get("error") or "unknown")[:255]
+    try:
+        saved = await crud.transition_withdrawal_job(
+            job.id, "processing", status,
+            reason=reason,
+            amount_sent=res.get("amount_sent") if res.get("ok") else None,
+            result=json.dumps({k: v for k, v in res.items() if k not in _RESULT_PRIVATE_KEYS},
+                              ensure_ascii=False, default=str)[:WITHDRAW_RESULT_MAX_LEN])
+        if not saved:
+            logger.error("Withdrawal #%s is no longer processing, result %s not saved", job.id, status)
+        else:
+            # следующая заявка этого водителя могла ждать окончания выплаты
+            request_withdrawal_processing()
+    except Exception:
+        # заявка останется в processing и по истечении аренды уйдёт в failed — повторной выплаты не будет
+        logger.exception("Failed to save result of withdrawal #%s (%s)", job.id, status)
+    await _notify_result(job, res, notify_manager=notify_manager)
+    return res
+
+
+async def run_withdrawal_batch(jobs: List[WithdrawalJobs],
+                               concurrency: int = WITHDRAW_BULK_CONCURRENCY,
+                               per_minute: int = WITHDRAW_BULK_PER_MINUTE) -> List[Tuple[WithdrawalJobs, Dict[str, Any]]]:
+    """
+    Выполняет одобренные заявки параллельно (не больше concurrency одновременно, не больше per_minute
+    стартов в минуту). Каждая заявка берётся в processing непосредственно перед выплатой, так что
+    остальные при падении остаются approved и их доделают воркеры. Одна выплата на водителя
+    гарантируется при взятии заявки (crud.claim_approved_withdrawal_job) для пакета и воркеров вместе;
+    внутри пакета заявки водителя ещё и ждут друг друга, чтобы не уходить воркерам. Каждая выплата —
+    со своим мемо поиска в Jump, баланс читается заново.
+    Результаты — в порядке jobs, без заявок, оставленных воркерам (взяты ими или водитель занят).
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    bucket = TokenBucket(per_minute)
+    driver_locks: Dict[str, asyncio.Lock] = {}
+
+    async def run(job: WithdrawalJobs) -> Optional[Dict[str, Any]]:
+        async with driver_locks.setdefault(phone_key(job.user_phone) or f"job:{job.id}", asyncio.Lock()):
+            async with semaphore:
+                while True:
+                    wait = bucket.try_take()
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+                try:
+                    claimed = await crud.claim_approved_withdrawal_job(job.id, INSTANCE_ID)
+                except Exception:
+                    logger.exception("Failed to claim approved withdrawal #%s", job.id)
+                    return None
+                if claimed is None:
+                    return None
+                with jump_request_scope(isolated=True):
+                    return await process_withdrawal_job(claimed, notify_manager=False)
+
+    results = await asyncio.gather(*(run(job) for job in jobs))
+    return [(job, res) for job, res in zip(jobs, results) if res is not None]
+
+
+def _method_label(job: WithdrawalJobs) -> str:
+    if job.method == "card":
+        return f"карта *{job.card_last4 or ''}"
+    return f"СБП {job.sbp_phone or ''} {job.sbp_bank or ''}".strip()
+
+
+def format_pending_withdrawals(jobs: List[WithdrawalJobs]) -> str:
+    total = sum(float(j.amount) for j in jobs)
+    lines = [f"Ожидают подтверждения: {len(jobs)} заявок на {total:.2f} ₽"]
+    for j in jobs:
+        lines.append(f"#{j.id} · {float(j.amount):.2f} ₽ · {_method_label(j)} · TG {j.user_id}")
+    lines.append("")
+    lines.append("Одобрить: /approve_withdrawals all или /approve_withdrawals 12 15 18")
+    return "\n".join(lines)
+
+
+def format_withdrawal_batch_summary(results: List[Tuple[WithdrawalJobs, Dict[str, Any]]],
+                                    skipped: Optional[List[int]] = None,
+                                    queued: Optional[List[int]] = None) -> str:
+    done = [(j, r) for j, r in results if r.get("ok")]
+    failed = [(j, r) for j, r in results if not r.get("ok")]
+    sent = sum(float(r.get("amount_sent") or 0) for _, r in done)
+    lines = [f"Пакет выводов: выполнено {len(done)} на {sent:.2f} ₽, ошибок {len(failed)}"]
+    if skipped:
+        lines.append("Пропущены (не найдены или уже обработаны): " + ", ".join(f"#{i}" for i in skipped))
+    if queued:
+        lines.append("Выполняются воркером очереди, итог придёт отдельно: " + ", ".join(f"#{i}" for i in queued))
+    for j, r in results:
+        if r.get("ok"):
+            lines.append(f"#{j.id} ✓ {float(r.get('amount_sent') or 0):.2f} ₽" + (" (уменьшена)" if r.get("adjusted") else ""))
+        else:
+            lines.append(f"#{j.id} ✗ {r.get('reason') or r.get('error') or 'unknown'}")
+    return "\n".join(lines)
+
+
+async def _worker(n: int) -> None:
+    while True:
+        try:
+            job = await crud.claim_withdrawal_job(INSTANCE_ID)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Withdrawal worker %d failed to claim a job", n)
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=WITHDRAW_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+        logger.info("Withdrawal worker %d took job #%s", n, job.id)
+        await process_withdrawal_job(job)
+
+
+async def _fail_expired_jobs() -> None:
+    jobs = await crud.fail_expired_withdrawal_jobs(WITHDRAW_LEASE_SECONDS)
+    for job in jobs:
+        logger.warning("Withdrawal #%s lost its owner %s, marked as failed", job.id, job.owner)
+        try:
+            reason = "прервана падением или перезапуском бота, проверьте выплату в Jump вручную"
+            await bot.send_message(int(MANAGER_CHAT_ID), get_msg("manager_withdraw_failed", "ru", pid=job.id, reason=reason))
+        except Exception:
+            logger.exception("Can't notify manager about interrupted withdrawal #%s", job.id)
+
+
+async def _lease_keeper() -> None:
+    """
+    Продлевает аренду заявок этого экземпляра и переводит в failed заявки экземпляров, переставших её продлевать.
+    """
+    while True:
+        try:
+            await crud.touch_withdrawal_jobs(INSTANCE_ID)
+            await _fail_expired_jobs()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Withdrawal lease keeper failed")
+        await asyncio.sleep(WITHDRAW_HEARTBEAT_INTERVAL)
+
+
+async def run_withdrawal_workers(workers: int = WITHDRAW_WORKERS) -> None:
+    """
+    Фоновая задача: пул воркеров, выполняющих одобренные заявки из WithdrawalJobs.
+    Заявки, брошенные упавшим экземпляром посреди выплаты, уходят в failed — их проверяет менеджер.
+    """
+    await asyncio.gather(_lease_keeper(), *(_worker(n) for n in range(max(1, workers))))
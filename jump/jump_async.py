@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+import asyncio
+import json
+import logging
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Tuple
+
+import aiohttp
+from decouple import config
+
+from jump.jump_integrations import (
+    BASE_URL,
+    JUMP_POOL_SIZE,
+    JUMP_CONNECT_TIMEOUT,
+    JUMP_READ_TIMEOUT,
+    JUMP_CONNECT_RETRIES,
+    OPERATION_TX_TYPE_FALLBACK,
+    PREVIEW_PARAM_CANDIDATE_NAMES,
+    TRANSACTION_PARAM_CANDIDATE_NAMES,
+    _TX_TYPE_LOOKUP,
+    _check_withdraw_driver,
+    _create_interrupted,
+    _configured_transaction_type_id,
+    _driver_balance,
+    _headers,
+    _list_items,
+    _remember_variant,
+    _variant_attempts,
+    _match_driver,
+    _needs_post_fallback,
+    _normalize_phone,
+    _params,
+    _preview_payload,
+    _transaction_payload,
+    _withdraw_candidates,
+    _withdraw_created,
+    _withdraw_tx_type,
+    _withdraw_unknown_outcome,
+    jump_upstream,
+)
+from resilience import CircuitOpenError
+from jump.jump_cache import jump_lookups, phone_key, DRIVER, PROFILE, tx_types, driver_index
+
+logger = logging.getLogger("jump_api")
+
+# сколько лучших кандидатов реквизитов проверять preview одновременно (1 — строго по очереди)
+JUMP_PREVIEW_CONCURRENCY = int(config("JUMP_PREVIEW_CONCURRENCY", "3"))
+
+
+class JumpResponse:
+    """
+    Прочитанный ответ Jump API с интерфейсом, как у requests.Response (status_code, text, headers, json()).
+    """
+
+    def __init__(self, status_code: int, text: str, headers: Dict[str, str]):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class AsyncJumpClient:
+    """
+    Асинхронный клиент Jump API поверх одной aiohttp-сессии: те же операции, что и в jump_integrations,
+    но без занятых потоков executor-а на время сетевых ожиданий.
+    Повторяются только ошибки установки соединения — запрос до сервера не дошёл, двойного списания не будет.
+    """
+
+    def __init__(self,
+                 base_url: str = BASE_URL,
+                 pool_size: int = JUMP_POOL_SIZE,
+                 connect_timeout: float = JUMP_CONNECT_TIMEOUT,
+                 read_timeout: float = JUMP_READ_TIMEOUT,
+                 connect_retries: int = JUMP_CONNECT_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connect_retries = connect_retries
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tx_types_refresh: Optional[asyncio.Task] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            timeout = aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, path: str,
+                       params: Optional[Dict[str, Any]] = None,
+                       json: Optional[Dict[str, Any]] = None,
+                       allow_redirects: Optional[bool] = None) -> JumpResponse:
+        session = await self._get_session()
+        url = f"{self.base_url}{path}"
+        if allow_redirects is None:
+            allow_redirects = method.upper() in ("GET", "HEAD", "OPTIONS")
+        attempt = 0
+        with jump_upstream.call(ceiling=self.read_timeout, adaptive=method.upper() == "GET") as call:
+            timeout = aiohttp.ClientTimeout(connect=self.connect_timeout, sock_read=call.timeout)
+            while True:
+                try:
+                    async with session.request(method, url, params=_params(params), json=json, headers=_headers(),
+                                               allow_redirects=allow_redirects, timeout=timeout) as resp:
+                        text = await resp.text()
+                        call.check_status(resp.status)
+                        return JumpResponse(resp.status, text, dict(resp.headers))
+                except aiohttp.ClientConnectorError:
+                    if attempt >= self.connect_retries:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(0.2 * attempt)
+
+    async def get_driver_by_phone(self, phone: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        pn = _normalize_phone(phone)
+        if not pn:
+            return None
+        hit, driver = jump_lookups.get(DRIVER, phone_key(pn), fresh=fresh)
+        if hit:
+            return driver
+        # совпадение из индекса в мемо не кладём: fresh=True в той же операции должен сходить в Jump
+        driver = None if fresh else driver_index.by_phone(pn)
+        if driver is not None:
+            return driver
+        driver = await self._fetch_driver_by_phone(pn)
+        driver_index.put(driver)
+        jump_lookups.put(DRIVER, phone_key(pn), driver)
+        return driver
+
+    async def _fetch_driver_by_phone(self, pn: str) -> Optional[Dict[str, Any]]:
+        try:
+            r = await self._request("GET", "/drivers", params={"search": pn})
+        except Exception:
+            logger.exception("Network error GET /drivers")
+            return None
+        if r.status_code != 200:
+            logger.warning("GET /drivers returned %s: %.300s", r.status_code, r.text)
+            return None
+        try:
+            j = r.json()
+        except Exception:
+            logger.exception("Failed to parse /drivers JSON")
+            return None
+        return _match_driver(j, pn)
+
+    async def fetch_drivers_page(self, page: int, per_page: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Одна страница списка водителей; None — ошибка (проход индекса продолжится с этой же страницы).
+        """
+        try:
+            r = await self._request("GET", "/drivers", params={"page": page, "per_page": per_page})
+        except Exception:
+            logger.exception("Network error GET /drivers page %s", page)
+            return None
+        if r.status_code != 200:
+            logger.warning("GET /drivers page %s returned %s: %.300s", page, r.status_code, r.text)
+            return None
+        try:
+            return _list_items(r.json())
+        except Exception:
+            logger.exception("Failed to parse /drivers page JSON")
+            return None
+
+    async def get_balance_by_phone(self, phone: str) -> Decimal:
+        return _driver_balance(await self.get_driver_by_phone(phone))
+
+    async def get_driver_profile(self, driver_id: int, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        hit, profile = jump_lookups.get(PROFILE, str(driver_id), fresh=fresh)
+        if hit:
+            return profile
+        profile = await self._fetch_driver_profile(driver_id)
+        jump_lookups.put(PROFILE, str(driver_id), profile)
+        return profile
+
+    async def _fetch_driver_profile(self, driver_id: int) -> Optional[Dict[str, Any]]:
+        try:
+            r = await self._request("GET", f"/drivers/{int(driver_id)}")
+        except Exception:
+            logger.exception("Network error GET /drivers/{id}")
+            return None
+        if r.status_code != 200:
+            logger.warning("GET /drivers/%s returned %s: %.500s", driver_id, r.status_code, r.text)
+            return None
+        try:
+            return r.json()
+        except Exception:
+            logger.exception("Failed to parse profile")
+            return None
+
+    async def get_transaction_types(self) -> List[Dict[str, Any]]:
+        try:
+            r = await self._request("GET", "/transaction-types")
+        except Exception:
+            logger.exception("Network error GET /transaction-types")
+            return []
+        if r.status_code != 200:
+            logger.debug("GET /transaction-types returned %s: %.300s", r.status_code, r.text)
+            return []
+        try:
+            return _list_items(r.json())
+        except Exception:
+            logger.exception("Failed to parse transaction-types")
+            return []
+
+    async def choose_transaction_type_id(self, operation: str = "withdraw",
+                                         preferred_id: Optional[int] = None) -> Optional[int]:
+        tx_type = _configured_transaction_type_id(operation, preferred_id)
+        if tx_type is not None:
+            return tx_type
+        if not tx_types.is_loaded():
+            await self.refresh_transaction_types()
+        elif tx_types.needs_refresh():
+            # устаревший справочник отдаём сразу, обновляем в фоне
+            if self._tx_types_refresh is None or self._tx_types_refresh.done():
+                self._tx_types_refresh = asyncio.create_task(self.refresh_transaction_types())
+        return tx_types.resolve(operation)
+
+    async def refresh_transaction_types(self) -> None:
+        tx_types.load(await self.get_transaction_types())
+
+    async def preview_withdrawal_try_variants(self, driver_id: int, amount: float, candidate_value: Any,
+                                              include_commission: bool = False,
+                                              kind: Optional[str] = None) -> Tuple[bool, Any, Any, Any, Any]:
+        url_path = f"/drivers/{int(driver_id)}/transactions-withdraw-preview"
+        last_status = None
+        last_raw = None
+        for key, shape, val in _variant_attempts("preview", PREVIEW_PARAM_CANDIDATE_NAMES, candidate_value, driver_id, kind):
+            payload = _preview_payload(amount, key, val, include_commission)
+            try:
+                r = await self._request("POST", url_path, json=payload)
+            except Exception:
+                logger.exception("Network error POST preview attempt key=%s val=%s", key, repr(val))
+                last_status = None
+                last_raw = {"text": "network_exception"}
+                continue
+            last_status = r.status_code
+            text = (r.text or "").strip()
+            try:
+                parsed = r.json() if text else None
+                last_raw = parsed if parsed is not None else {"text": text, "status_code": r.status_code}
+            except Exception:
+                last_raw = {"text": text, "status_code": r.status_code}
+            logger.debug("Preview try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, last_raw)
+            if r.status_code == 200:
+                _remember_variant("preview", driver_id, kind, candidate_value, key, shape)
+                return True, r.status_code, last_raw, key, val
+        return False, last_status, last_raw, None, None
+
+    async def _preview_candidate(self, driver_id: Any, amount: float, cand: Dict[str, Any],
+                                 include_commission: bool) -> Optional[Dict[str, Any]]:
+        """
+        None, если preview прошёл, иначе запись для preview_errors.
+        """
+        pref = cand.get("preferred_value")
+        logger.info("Previewing candidate kind=%s pref=%s score=%s", cand.get("kind"), repr(pref), cand.get("score"))
+        try:
+            ok, status, raw, used_key, used_val = await self.preview_withdrawal_try_variants(
+                driver_id=int(driver_id), amount=float(amount), candidate_value=pref,
+                include_commission=include_commission, kind=cand.get("kind"))
+        except Exception:
+            logger.exception("Preview exception for candidate %s", repr(pref))
+            return {"candidate": pref, "error": "exception"}
+        if not ok:
+            logger.warning("Preview failed for candidate %s; status=%s raw=%s", repr(pref), status, raw)
+            return {"candidate": pref, "status": status, "raw": raw}
+        logger.info("Preview OK for candidate %s (used_key=%s used_val=%s)", repr(pref), used_key, repr(used_val))
+        return None
+
+    async def _send_transaction(self, method: str, url_path: str, payload: Dict[str, Any]) -> Tuple[JumpResponse, Any]:
+        r = await self._request(method, url_path, json=payload, allow_redirects=False)
+        try:
+            raw = r.json() if r.text else None
+        except Exception:
+            raw = {"text": r.text}
+        return r, raw
+
+    async def create_withdrawal_transaction_try_variants(self,
+                                                         driver_id: int,
+                                                         amount: float,
+                                                         candidate_value: Any,
+                                                         transaction_type_id: Optional[int] = None,
+                                                         message: Optional[str] = None,
+                                                         create_payment: bool = True,
+                                                         include_commission: bool = False,
+                                                         kind: Optional[str] = None) -> Dict[str, Any]:
+        url_path = f"/drivers/{int(driver_id)}/transactions"
+        last_res = {"ok": False, "status_code": None, "raw": None, "used_key": None, "used_value": None, "tried": None}
+        for key, shape, val in _variant_attempts("create", TRANSACTION_PARAM_CANDIDATE_NAMES, candidate_value, driver_id, kind):
+            payload = _transaction_payload(amount, key, val, transaction_type_id, message, create_payment, include_commission)
+            try:
+                r, raw = await self._send_transaction("PUT", url_path, payload)
+            except CircuitOpenError:
+                logger.warning("Jump circuit open, PUT /transactions not sent key=%s val=%s", key, repr(val))
+                last_res.update({"raw": {"text": "circuit_open"}, "used_key": key, "used_value": val, "tried": "put"})
+                continue
+            except Exception:
+                logger.exception("Network error PUT /transactions attempt key=%s val=%s", key, repr(val))
+                return _create_interrupted(key, val, "put")
+            logger.debug("PUT try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, raw)
+            if r.status_code in (200, 201, 204):
+                _remember_variant("create", driver_id, kind, candidate_value, key, shape)
+                return {"ok": True, "status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"}
+            if not _needs_post_fallback(r.status_code, r.headers.get("Content-Type", "")):
+                last_res.update({"status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"})
+                continue
+            logger.info("PUT produced redirect/HTML; trying POST fallback for key=%s val=%s", key, repr(val))
+            try:
+                r2, raw2 = await self._send_transaction("POST", url_path, payload)
+            except CircuitOpenError:
+                logger.warning("Jump circuit open, POST fallback not sent key=%s val=%s", key, repr(val))
+                last_res.update({"raw": {"text": "circuit_open"}, "used_key": key, "used_value": val, "tried": "post"})
+                continue
+            except Exception:
+                logger.exception("Network error POST fallback")
+                return _create_interrupted(key, val, "post")
+            logger.debug("POST fallback key=%s val=%s -> status=%s raw=%s", key, repr(val), r2.status_code, raw2)
+            if r2.status_code in (200, 201, 204):
+                _remember_variant("create", driver_id, kind, candidate_value, key, shape)
+                return {"ok": True, "status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"}
+            last_res.update({"status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"})
+        return last_res
+
+    async def _resolve_tx_type(self, tx_type_id: Optional[int], operation: str) -> Any:
+        tx_type = _withdraw_tx_type(tx_type_id, operation)
+        if tx_type is _TX_TYPE_LOOKUP:
+            tx_type = await self.choose_transaction_type_id(operation=operation, preferred_id=None)
+            if tx_type is None:
+                tx_type = OPERATION_TX_TYPE_FALLBACK.get(operation.lower())
+        return tx_type
+
+    async def perform_withdrawal(self, *,
+                                 phone: str,
+                                 amount: float,
+                                 requisites: Optional[str] = None,
+                                 card_number: Optional[str] = None,
+                                 phone_hint: Optional[str] = None,
+                                 bank_hint: Optional[str] = None,
+                                 tx_type_id: Optional[int] = None,
+                                 use_preview: bool = True,
+                                 include_commission: bool = False,
+                                 create_payment: bool = True,
+                                 operation: str = "withdraw",
+                                 preview_concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """
+        То же, что jump_integrations.perform_withdrawal: поиск водителя и выбор типа транзакции
+        идут параллельно, preview лучших preview_concurrency кандидатов — тоже.
+        Транзакции создаются по очереди, так что успешной может быть не больше одной.
+        """
+        if not phone:
+            return {"ok": False, "reason": "need_driver_phone"}
+
+        driver, tx_type = await asyncio.gather(self.get_driver_by_phone(phone, fresh=True),
+                                               self._resolve_tx_type(tx_type_id, operation))
+        checked = _check_withdraw_driver(driver, phone, amount)
+        if not checked.get("ok"):
+            return checked
+        driver_id = checked["driver_id"]
+        amount_to_send = checked["amount_to_send"]
+
+        profile = await self.get_driver_profile(driver_id, fresh=True) or {}
+
+        candidates_scored = _withdraw_candidates(profile, phone, card_number, phone_hint, bank_hint)
+        if not candidates_scored:
+            return {"ok": False, "reason": "no_candidates_found", "driver": driver, "profile": profile}
+
+        preview_errors = []
+        create_errors = []
+        do_preview = use_preview and operation.lower() == "withdraw"
+        window_size = max(1, preview_concurrency or JUMP_PREVIEW_CONCURRENCY)
+
+        # кандидаты отсортированы по score: окно из N лучших проверяем preview параллельно,
+        # затем создаём транзакцию по прошедшим строго по очереди — успешной может быть только одна
+        for start in range(0, len(candidates_scored), window_size):
+            window = candidates_scored[start:start + window_size]
+            if do_preview:
+                results = await asyncio.gather(*(
+                    self._preview_candidate(driver_id, amount_to_send, cand, include_commission) for cand in window))
+                passed = []
+                for cand, err in zip(window, results):
+                    if err is None:
+                        passed.append(cand)
+                    else:
+                        preview_errors.append(err)
+            else:
+                passed = window
+
+            for cand in passed:
+                pref = cand.get("preferred_value")
+                logger.info("Creating withdrawal with candidate kind=%s pref=%s score=%s", cand.get("kind"), repr(pref), cand.get("score"))
+                try:
+                    tx_res = await self.create_withdrawal_transaction_try_variants(driver_id=int(driver_id),
+                                                                                   amount=float(amount_to_send),
+                                                                                   candidate_value=pref,
+                                                                                   transaction_type_id=tx_type,
+                                                                                   message=requisites or "Ручной вывод",
+                                                                                   create_payment=create_payment,
+                                                                                   include_commission=include_commission,
+                                                                                   kind=cand.get("kind"))
+                except Exception:
+                    logger.exception("Create exception for candidate %s", repr(pref))
+                    create_errors.append({"candidate": pref, "error": "exception"})
+                    return _withdraw_unknown_outcome(driver, pref, checked, create_errors)
+
+                if tx_res.get("ok"):
+                    logger.info("Withdrawal created successfully for driver %s using candidate %s", driver_id, repr(pref))
+                    return _withdraw_created(tx_res, driver, pref, tx_type, checked)
+                if tx_res.get("unknown_outcome"):
+                    create_errors.append({"candidate": pref, "error": "unknown_outcome", "used_key": tx_res.get("used_key"), "tried": tx_res.get("tried")})
+                    return _withdraw_unknown_outcome(driver, pref, checked, create_errors)
+
+                create_errors.append({"candidate": pref, "status": tx_res.get("status_code"), "raw": tx_res.get("raw"), "used_key": tx_res.get("used_key"), "tried": tx_res.get("tried")})
+                await asyncio.sleep(0.2)
+
+        return {"ok": False, "reason": "no_candidate_succeeded", "driver": driver, "profile": profile, "candidates": candidates_scored, "preview_errors": preview_errors, "create_errors": create_errors}
+
+
+_jump_client: Optional[AsyncJumpClient] = None
+
+
+def get_jump_client() -> AsyncJumpClient:
+    """
+    Общий асинхронный клиент Jump (одна aiohttp-сессия на процесс).
+    """
+    global _jump_client
+    if _jump_client is None:
+        _jump_client = AsyncJumpClient()
+    return _jump_client
+
+
+async def close_jump_client() -> None:
+    global _jump_client
+    if _jump_client is not None:
+        await _jump_client.close()
+        _jump_client = None
+
+
+# фоновое наполнение driver_index: за один тик читается JUMP_INDEX_PAGES_PER_TICK страниц,
+# так что весь список обходится за (водителей / страница / страниц за тик) тиков без всплесков нагрузки
+JUMP_INDEX_ENABLED = config("JUMP_INDEX_ENABLED", "1") == "1"
+JUMP_INDEX_PAGE_SIZE = int(config("JUMP_INDEX_PAGE_SIZE", "100"))
+JUMP_INDEX_PAGES_PER_TICK = int(config("JUMP_INDEX_PAGES_PER_TICK", "5"))
+JUMP_INDEX_INTERVAL = float(config("JUMP_INDEX_INTERVAL", "20"))
+
+
+class _DriverIndexCursor:
+    def __init__(self):
+        self.page = 1
+        self.first_ids: Optional[Tuple[Any, ...]] = None
+
+
+async def sync_driver_index_step(cursor: _DriverIndexCursor,
+                                 pages: int = JUMP_INDEX_PAGES_PER_TICK,
+                                 per_page: int = JUMP_INDEX_PAGE_SIZE) -> None:
+    """
+    Читает следующие pages страниц /drivers в индекс. Короткая страница завершает проход;
+    если Jump не листает (вторая страница совпала с первой), проход тоже завершается.
+    """
+    client = get_jump_client()
+    for _ in range(max(1, pages)):
+        items = await client.fetch_drivers_page(cursor.page, per_page)
+        if items is None:
+            return
+        ids = tuple(d.get("id") for d in items[:3] if isinstance(d, dict))
+        if cursor.page == 1:
+            cursor.first_ids = ids
+        elif ids and ids == cursor.first_ids:
+            logger.warning("Jump /drivers ignores paging, driver index holds only the first page")
+            items = []
+        driver_index.put_page(items, first_page=cursor.page == 1)
+        if len(items) < per_page:
+            removed = driver_index.finish_pass()
+            logger.info("Driver index pass done: %s drivers, %s removed", len(driver_index), removed)
+            cursor.page = 1
+            return
+        cursor.page += 1
+
+
+async def run_driver_index_sync(interval: float = JUMP_INDEX_INTERVAL) -> None:
+    """
+    Фоновая задача: постоянно обновляет локальный индекс водителей Jump.
+    """
+    if not JUMP_INDEX_ENABLED:
+        return
+    cursor = _DriverIndexCursor()
+    while True:
+        try:
+            await sync_driver_index_step(cursor)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Driver index sync failed")
+        await asyncio.sleep(interval)
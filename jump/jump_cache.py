@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# coding: utf-8
+from __future__ import annotations
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+from decouple import config
+
+# сколько секунд водитель/профиль из Jump считаются свежими между разными запросами
+JUMP_LOOKUP_TTL = float(config("JUMP_LOOKUP_TTL", "30"))
+JUMP_LOOKUP_CACHE_SIZE = int(config("JUMP_LOOKUP_CACHE_SIZE", "5000"))
+
+DRIVER = "driver"
+PROFILE = "profile"
+
+_MISS = (False, None)
+
+# мемо одной операции (апдейта бота): {(kind, key): value}, включая «не найден»
+_scope: contextvars.ContextVar[Optional[Dict[Tuple[str, Hashable], Any]]] = contextvars.ContextVar("jump_lookup_scope", default=None)
+
+
+def phone_key(phone: Optional[str]) -> str:
+    return re.sub(r"\D+", "", phone or "")[-10:]
+
+
+@contextmanager
+def jump_request_scope(isolated: bool = False):
+    """
+    Внутри блока повторные поиски водителя и профиля возвращают первый результат.
+    Контекст переносится и в asyncio.to_thread; вложенный блок использует внешний мемо,
+    isolated=True — свой (отдельные операции внутри одного апдейта, например выплаты пакета).
+    """
+    if _scope.get() is not None and not isolated:
+        yield
+        return
+    token = _scope.set({})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class JumpLookupCache:
+    """
+    Кэш поиска водителя (ключ — 10 последних цифр телефона) и профиля (ключ — id водителя):
+    мемо текущей операции поверх общего TTL-кэша. «Не найден» в TTL-кэш не попадает.
+    """
+
+    def __init__(self, ttl: float = JUMP_LOOKUP_TTL, maxsize: int = JUMP_LOOKUP_CACHE_SIZE):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, key: Hashable, fresh: bool = False) -> Tuple[bool, Any]:
+        """
+        (True, value) при попадании. fresh=True пропускает TTL-кэш, но не мемо текущей операции.
+        """
+        memo = _scope.get()
+        if memo is not None and (kind, key) in memo:
+            return True, memo[(kind, key)]
+        if fresh:
+            return _MISS
+        with self._lock:
+            value = self._cache.get((kind, key))
+        if value is None:
+            return _MISS
+        if memo is not None:
+            memo[(kind, key)] = value
+        return True, value
+
+    def put(self, kind: str, key: Hashable, value: Any) -> None:
+        memo = _scope.get()
+        if memo is not None:
+            memo[(kind, key)] = value
+        if value is not None:
+            with self._lock:
+                self._cache[(kind, key)] = value
+
+    def invalidate(self, phone: Optional[str] = None, driver_id: Any = None) -> None:
+        """
+        Сбрасывает записи после операций, меняющих баланс или реквизиты.
+        """
+        keys = []
+        if phone:
+            keys.append((DRIVER, phone_key(phone)))
+        if driver_id is not None:
+            keys.append((PROFILE, str(driver_id)))
+        memo = _scope.get()
+        with self._lock:
+            for k in keys:
+                self._cache.pop(k, None)
+                if memo is not None:
+                    memo.pop(k, None)
+
+
+jump_lookups = JumpLookupCache()
+
+
+# ключевые слова в названии типа транзакции для операции; неизвестная операция ищется по своему имени
+OPERATION_TX_TYPE_KEYWORDS = {
+    "withdraw": ("withdraw", "payout", "вывод", "выплата"),
+    "deposit": ("deposit", "пополнение", "зачислен"),
+    "transfer": ("transfer", "перевод"),
+}
+JUMP_TX_TYPES_TTL = float(config("JUMP_TX_TYPES_TTL", "3600"))
+# если справочник не загрузился — когда пробовать снова
+JUMP_TX_TYPES_RETRY = float(config("JUMP_TX_TYPES_RETRY", "60"))
+
+
+class TransactionTypeCatalog:
+    """
+    Справочник /transaction-types: грузится один раз и обновляется раз в JUMP_TX_TYPES_TTL.
+    Индексы по нормализованному названию и по ключевому слову, так что выбор типа — поиск в словаре.
+    При неудачной загрузке остаётся предыдущая версия.
+    """
+
+    def __init__(self, ttl: float = JUMP_TX_TYPES_TTL, retry: float = JUMP_TX_TYPES_RETRY):
+        self.ttl = ttl
+        self.retry = retry
+        self._names: List[Tuple[str, int]] = []
+        self._by_name: Dict[str, int] = {}
+        self._by_keyword: Dict[str, Optional[int]] = {}
+        self._first_id: Optional[int] = None
+        self._loaded = False
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def needs_refresh(self) -> bool:
+        return time.monotonic() >= self._next_refresh
+
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, types: List[Dict[str, Any]]) -> None:
+        names: List[Tuple[str, int]] = []
+        for t in types or []:
+            if not t.get("id"):
+                continue
+            try:
+                names.append((str(t.get("name") or "").lower(), int(t.get("id"))))
+            except Exception:
+                continue
+        with self._lock:
+            if not names:
+                self._next_refresh = time.monotonic() + self.retry
+                return
+            self._names = names
+            self._by_name = {}
+            for name, type_id in names:
+                self._by_name.setdefault(" ".join(name.split()), type_id)
+            self._by_keyword = {}
+            for keywords in OPERATION_TX_TYPE_KEYWORDS.values():
+                for kw in keywords:
+                    self._by_keyword[kw] = self._scan(kw)
+            self._first_id = names[0][1]
+            self._loaded = True
+            self._next_refresh = time.monotonic() + self.ttl
+
+    def _scan(self, keyword: str) -> Optional[int]:
+        for name, type_id in self._names:
+            if keyword in name:
+                return type_id
+        return None
+
+    def by_name(self, name: str) -> Optional[int]:
+        return self._by_name.get(" ".join((name or "").lower().split()))
+
+    def resolve(self, operation: str) -> Optional[int]:
+        """
+        Первый тип, в названии которого есть ключевое слово операции (в порядке слов), иначе первый тип.
+        """
+        op_lower = (operation or "").lower()
+        with self._lock:
+            if not self._loaded:
+                return None
+            for kw in OPERATION_TX_TYPE_KEYWORDS.get(op_lower, (op_lower,)):
+                if kw not in self._by_keyword:
+                    self._by_keyword[kw] = self._scan(kw)
+                if self._by_keyword[kw] is not None:
+                    return self._by_keyword[kw]
+            return self._first_id
+
+
+tx_types = TransactionTypeCatalog()
+
+
+JUMP_VARIANT_MEMORY_SIZE = int(config("JUMP_VARIANT_MEMORY_SIZE", "10000"))
+
+
+class VariantMemory:
+    """
+    Какая пара (имя параметра, форма значения) последней сработала для preview/create:
+    для конкретного водителя, для вида реквизита и глобально. Эти пары пробуются первыми.
+    """
+
+    def __init__(self, maxsize: int = JUMP_VARIANT_MEMORY_SIZE):
+        self._drivers: LRUCache = LRUCache(maxsize=maxsize)
+        self._kinds: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._global: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def preferred(self, endpoint: str, driver_id: Any, kind: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            pairs = [self._drivers.get((endpoint, str(driver_id))),
+                     self._kinds.get((endpoint, kind)),
+                     self._global.get(endpoint)]
+        out: List[Tuple[str, str]] = []
+        for pair in pairs:
+            if pair is not None and pair not in out:
+                out.append(pair)
+        return out
+
+    def remember(self, endpoint: str, driver_id: Any, kind: str, key: str, shape: str) -> None:
+        with self._lock:
+            self._drivers[(endpoint, str(driver_id))] = (key, shape)
+            self._kinds[(endpoint, kind)] = (key, shape)
+            self._global[endpoint] = (key, shape)
+
+
+variant_memory = VariantMemory()
+
+
+# локальный индекс водителей Jump, который фоновая задача наполняет постранично из /drivers
+JUMP_INDEX_MAX_AGE = float(config("JUMP_INDEX_MAX_AGE", "600"))
+
+
+class DriverIndex:
+    """
+    Индекс водителей: id -> водитель (с балансом) и 10 цифр телефона -> id.
+    Запись старше max_age считается промахом — тогда поиск идёт в Jump вживую.
+    Проход по страницам обновляет записи по мере чтения; водители, не встреченные
+    за полный проход, удаляются в его конце.
+    """
+
+    def __init__(self, max_age: float = JUMP_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._by_id: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        self._by_phone: Dict[str, str] = {}
+        self._pass_seen: set = set()
+        self._pass_started = 0.0
+        self._complete = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def is_complete(self) -> bool:
+        return self._complete
+
+    def _fresh(self, entry: Optional[Tuple[Dict[str, Any], float]]) -> Optional[Dict[str, Any]]:
+        if entry is None or time.monotonic() - entry[1] > self.max_age:
+            return None
+        return entry[0]
+
+    def by_phone(self, phone: Optional[str]) -> Optional[Dict[str, Any]]:
+        key = phone_key(phone)
+        if not key:
+            return None
+        with self._lock:
+            driver_id = self._by_phone.get(key)
+            return self._fresh(self._by_id.get(driver_id)) if driver_id is not None else None
+
+    def by_id(self, driver_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._fresh(self._by_id.get(str(driver_id)))
+
+    def _put(self, driver: Dict[str, Any], now: float) -> None:
+        driver_id = driver.get("id")
+        if driver_id is None:
+            return
+        driver_id = str(driver_id)
+        old = self._by_id.get(driver_id)
+        if old is not None:
+            old_key = phone_key(str(old[0].get("phone") or ""))
+            if self._by_phone.get(old_key) == driver_id:
+                del self._by_phone[old_key]
+        self._by_id[driver_id] = (driver, now)
+        key = phone_key(str(driver.get("phone") or ""))
+        if key:
+            self._by_phone[key] = driver_id
+        self._pass_seen.add(driver_id)
+
+    def put(self, driver: Optional[Dict[str, Any]]) -> None:
+        """
+        Записывает водителя, полученного живым запросом.
+        """
+        if not driver:
+            return
+        with self._lock:
+            self._put(driver, time.monotonic())
+
+    def put_page(self, drivers: List[Dict[str, Any]], first_page: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if first_page:
+                self._pass_seen = set()
+                self._pass_started = now
+            for d in drivers:
+                if isinstance(d, dict):
+                    self._put(d, now)
+
+    def finish_pass(self) -> int:
+        """
+        Завершает полный проход: удаляет водителей, которых в нём не было. Возвращает число удалённых.
+        """
+        with self._lock:
+            gone = [i for i, (_, ts) in self._by_id.items() if i not in self._pass_seen and ts < self._pass_started]
+            for driver_id in gone:
+                driver, _ = self._by_id.pop(driver_id)
+                key = phone_key(str(driver.get("phone") or ""))
+                if self._by_phone.get(key) == driver_id:
+                    del self._by_phone[key]
+            self._complete = True
+            return len(gone)
+
+    def invalidate(self, phone: Optional[str] = None, driver_id: Any = None) -> None:
+        """
+        Убирает водителя после операции, меняющей баланс: следующий поиск пойдёт в Jump.
+        """
+        with self._lock:
+            ids = set()
+            if driver_id is not None:
+                ids.add(str(driver_id))
+            if phone and phone_key(phone) in self._by_phone:
+                ids.add(self._by_phone[phone_key(phone)])
+            for i in ids:
+                entry = self._by_id.pop(i, None)
+                if entry is not None:
+                    key = phone_key(str(entry[0].get("phone") or ""))
+                    if self._by_phone.get(key) == i:
+                        del self._by_phone[key]
+
+
+driver_index = DriverIndex()
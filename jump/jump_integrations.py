@@ -6,11 +6,17 @@ import logging
 import time
 import json
 import os
+import threading
 from decimal import Decimal
 from typing import Optional, Dict, Any, List, Tuple
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from decouple import config
 
+from resilience import CircuitOpenError, Upstream
+from jump.jump_cache import jump_lookups, phone_key, DRIVER, PROFILE, tx_types, variant_memory, driver_index
+
 logger = logging.getLogger("jump_api")
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
@@ -23,6 +29,16 @@ DEFAULT_TRANSACTION_TYPE_ID = config("DEFAULT_TRANSACTION_TYPE_ID", "") or None
 PREVIEW_PARAM_CANDIDATE_NAMES = ("balance_id", "requisites_id", "write_off_account_id", "bank_account_id", "write_off_account")
 TRANSACTION_PARAM_CANDIDATE_NAMES = PREVIEW_PARAM_CANDIDATE_NAMES
 
+# пул соединений: одна сессия на процесс, TCP+TLS переиспользуются между вызовами
+JUMP_POOL_SIZE = int(config("JUMP_POOL_SIZE", "20"))
+JUMP_CONNECT_TIMEOUT = float(config("JUMP_CONNECT_TIMEOUT", "5"))
+JUMP_READ_TIMEOUT = float(config("JUMP_READ_TIMEOUT", "15"))
+JUMP_CONNECT_RETRIES = int(config("JUMP_CONNECT_RETRIES", "2"))
+
+# общий для синхронного и асинхронного клиента предохранитель Jump; адаптивный таймаут — только для GET,
+# создание транзакции ждёт полный JUMP_READ_TIMEOUT, чтобы не гадать, прошло ли списание
+jump_upstream = Upstream("jump", max_timeout=JUMP_READ_TIMEOUT)
+
 OPERATION_TX_TYPE_FALLBACK = {
     "withdraw": 14,
 }
@@ -44,30 +60,68 @@ def _params(extra: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         p.update(extra)
     return p or None
 
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # повторяем только ошибки установки соединения: запрос до сервера не дошёл,
+                # так что это безопасно и для POST/PUT (двойного списания не будет)
+                retry = Retry(total=JUMP_CONNECT_RETRIES, connect=JUMP_CONNECT_RETRIES, read=0, status=0, other=0,
+                              backoff_factor=0.2, allowed_methods=None)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=JUMP_POOL_SIZE, max_retries=retry)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def close_jump_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
 def _request(method: str, path: str, **kwargs) -> requests.Response:
     url = f"{BASE_URL}{path}"
     params = kwargs.pop("params", None) or _params()
     headers = kwargs.pop("headers", None) or _headers()
-    timeout = kwargs.pop("timeout", 15)
+    timeout = kwargs.pop("timeout", (JUMP_CONNECT_TIMEOUT, JUMP_READ_TIMEOUT))
     allow_redirects = kwargs.pop("allow_redirects", None)
     if allow_redirects is None:
         allow_redirects = method.upper() in ("GET", "HEAD", "OPTIONS")
-    return requests.request(method, url, headers=headers, params=params, timeout=timeout, allow_redirects=allow_redirects, **kwargs)
+    return jump_upstream.request(_get_session().request, method, url, headers=headers, params=params, timeout=timeout,
+                                 allow_redirects=allow_redirects, adaptive=method.upper() == "GET", **kwargs)
 
 def get_balance_by_phone(phone: str) -> Decimal:
-    d = get_driver_by_phone(phone)
-    if not d:
-        return Decimal(0)
-    bal = d.get("balance")
-    try:
-        return Decimal(str(bal)) if bal is not None else Decimal(0)
-    except Exception:
-        return Decimal(0)
-
-def get_driver_by_phone(phone: str) -> Optional[Dict[str, Any]]:
+    return _driver_balance(get_driver_by_phone(phone))
+
+def get_driver_by_phone(phone: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Водитель по телефону; повторные вызовы в пределах операции и JUMP_LOOKUP_TTL берутся из кэша,
+    затем из локального индекса водителей, и только при промахе — из Jump.
+    fresh=True — обязательно свежие данные (баланс перед выводом).
+    """
     pn = _normalize_phone(phone)
     if not pn:
         return None
+    hit, driver = jump_lookups.get(DRIVER, phone_key(pn), fresh=fresh)
+    if hit:
+        return driver
+    # совпадение из индекса в мемо не кладём: fresh=True в той же операции должен сходить в Jump
+    driver = None if fresh else driver_index.by_phone(pn)
+    if driver is not None:
+        return driver
+    driver = _fetch_driver_by_phone(pn)
+    driver_index.put(driver)
+    jump_lookups.put(DRIVER, phone_key(pn), driver)
+    return driver
+
+def _fetch_driver_by_phone(pn: str) -> Optional[Dict[str, Any]]:
     try:
         r = _request("GET", "/drivers", params={"search": pn})
     except Exception:
@@ -81,6 +135,9 @@ def get_driver_by_phone(phone: str) -> Optional[Dict[str, Any]]:
     except Exception:
         logger.exception("Failed to parse /drivers JSON")
         return None
+    return _match_driver(j, pn)
+
+def _match_driver(j: Any, pn: str) -> Optional[Dict[str, Any]]:
     items = j.get("items") if isinstance(j, dict) else (j if isinstance(j, list) else [])
     for it in items:
         ph = str(it.get("phone") or "")
@@ -88,7 +145,24 @@ def get_driver_by_phone(phone: str) -> Optional[Dict[str, Any]]:
             return it
     return None
 
-def get_driver_profile(driver_id: int) -> Optional[Dict[str, Any]]:
+def _driver_balance(d: Optional[Dict[str, Any]]) -> Decimal:
+    if not d:
+        return Decimal(0)
+    bal = d.get("balance")
+    try:
+        return Decimal(str(bal)) if bal is not None else Decimal(0)
+    except Exception:
+        return Decimal(0)
+
+def get_driver_profile(driver_id: int, fresh: bool = False) -> Optional[Dict[str, Any]]:
+    hit, profile = jump_lookups.get(PROFILE, str(driver_id), fresh=fresh)
+    if hit:
+        return profile
+    profile = _fetch_driver_profile(driver_id)
+    jump_lookups.put(PROFILE, str(driver_id), profile)
+    return profile
+
+def _fetch_driver_profile(driver_id: int) -> Optional[Dict[str, Any]]:
     try:
         r = _request("GET", f"/drivers/{int(driver_id)}")
     except Exception:
@@ -117,6 +191,9 @@ def get_payments_for_driver(driver_id: int, per_page: int = 5) -> List[Dict[str,
     except Exception:
         logger.exception("Failed to parse payments JSON")
         return []
+    return _list_items(j)
+
+def _list_items(j: Any) -> List[Dict[str, Any]]:
     if isinstance(j, dict):
         return j.get("items") or j.get("data") or []
     return j if isinstance(j, list) else []
@@ -131,15 +208,23 @@ def get_transaction_types() -> List[Dict[str, Any]]:
         logger.debug("GET /transaction-types returned %s: %.300s", r.status_code, r.text)
         return []
     try:
-        j = r.json()
-        if isinstance(j, dict):
-            return j.get("items") or j.get("data") or []
-        return j if isinstance(j, list) else []
+        return _list_items(r.json())
     except Exception:
         logger.exception("Failed to parse transaction-types")
         return []
 
 def choose_transaction_type_id(operation: str = "withdraw", preferred_id: Optional[int] = None) -> Optional[int]:
+    tx_type = _configured_transaction_type_id(operation, preferred_id)
+    if tx_type is not None:
+        return tx_type
+    if tx_types.needs_refresh():
+        tx_types.load(get_transaction_types())
+    return tx_types.resolve(operation)
+
+def _configured_transaction_type_id(operation: str, preferred_id: Optional[int]) -> Optional[int]:
+    """
+    Тип транзакции без похода в API: из настроек, аргумента или OPERATION_TX_TYPE_FALLBACK.
+    """
     if DEFAULT_TRANSACTION_TYPE_ID:
         try:
             return int(DEFAULT_TRANSACTION_TYPE_ID)
@@ -156,32 +241,6 @@ def choose_transaction_type_id(operation: str = "withdraw", preferred_id: Option
             return int(OPERATION_TX_TYPE_FALLBACK[op_lower])
         except Exception:
             pass
-    types = get_transaction_types()
-    if not types:
-        return None
-    keywords = []
-    if op_lower == "withdraw":
-        keywords = ("withdraw", "payout", "вывод", "выплата")
-    elif op_lower == "deposit":
-        keywords = ("deposit", "пополнение", "зачислен")
-    elif op_lower == "transfer":
-        keywords = ("transfer", "перевод")
-    else:
-        keywords = (op_lower,)
-    for kw in keywords:
-        for t in types:
-            name = str(t.get("name") or "").lower()
-            if kw in name and t.get("id"):
-                try:
-                    return int(t.get("id"))
-                except Exception:
-                    continue
-    for t in types:
-        if t.get("id"):
-            try:
-                return int(t.get("id"))
-            except Exception:
-                continue
     return None
 
 def is_antifraud_by_phone(phone: str) -> bool:
@@ -272,51 +331,117 @@ def get_withdraw_conditions_by_phone(phone: str) -> Dict[str, Any]:
         pass
     return out
 
-def _make_value_variants(candidate_value: Any) -> List[Any]:
-    vals: List[Any] = []
-    vals.append(candidate_value)
+def _make_shaped_variants(candidate_value: Any) -> List[Tuple[str, Any]]:
+    """
+    Формы значения реквизита для перебора: [(форма, значение)].
+    """
+    vals: List[Tuple[str, Any]] = []
+    vals.append(("raw", candidate_value))
     try:
         if isinstance(candidate_value, int):
-            vals.append({"id": int(candidate_value)})
-            vals.append(str(candidate_value))
+            vals.append(("id_obj", {"id": int(candidate_value)}))
+            vals.append(("str", str(candidate_value)))
     except Exception:
         pass
     if isinstance(candidate_value, str) and "-" in candidate_value:
-        vals.append({"uuid": candidate_value})
+        vals.append(("uuid_obj", {"uuid": candidate_value}))
     seen = set()
     dedup = []
-    for v in vals:
+    for shape, v in vals:
         k = repr(v)
         if k not in seen:
             seen.add(k)
-            dedup.append(v)
+            dedup.append((shape, v))
     return dedup
 
-def preview_withdrawal_try_variants(driver_id: int, amount: float, candidate_value: Any, include_commission: bool = False):
+def _make_value_variants(candidate_value: Any) -> List[Any]:
+    return [v for _, v in _make_shaped_variants(candidate_value)]
+
+def _variant_kind(kind: Optional[str], candidate_value: Any) -> str:
+    if isinstance(candidate_value, bool) or not isinstance(candidate_value, (int, str)):
+        value_type = "obj"
+    elif isinstance(candidate_value, int):
+        value_type = "int"
+    else:
+        value_type = "uuid" if "-" in candidate_value else "str"
+    return f"{kind or 'other'}:{value_type}"
+
+def _variant_attempts(endpoint: str, param_names: Tuple[str, ...], candidate_value: Any,
+                      driver_id: Any, kind: Optional[str]) -> List[Tuple[str, str, Any]]:
+    """
+    Порядок перебора [(параметр, форма, значение)]: сначала пары, которые сработали раньше
+    (для этого водителя, вида реквизита, глобально), затем остальной полный перебор.
+    """
+    shaped = _make_shaped_variants(candidate_value)
+    by_shape = dict(shaped)
+    attempts: List[Tuple[str, str, Any]] = []
+    for key, shape in variant_memory.preferred(endpoint, driver_id, _variant_kind(kind, candidate_value)):
+        if key in param_names and shape in by_shape:
+            attempts.append((key, shape, by_shape[shape]))
+    tried = {(key, shape) for key, shape, _ in attempts}
+    for key in param_names:
+        for shape, val in shaped:
+            if (key, shape) not in tried:
+                attempts.append((key, shape, val))
+    return attempts
+
+def _remember_variant(endpoint: str, driver_id: Any, kind: Optional[str], candidate_value: Any,
+                      key: str, shape: str) -> None:
+    variant_memory.remember(endpoint, driver_id, _variant_kind(kind, candidate_value), key, shape)
+
+def _preview_payload(amount: float, key: str, val: Any, include_commission: bool) -> Dict[str, Any]:
+    return {"amount": float(amount), key: val, "include_commission": bool(include_commission)}
+
+def _transaction_payload(amount: float, key: str, val: Any,
+                         transaction_type_id: Optional[int],
+                         message: Optional[str],
+                         create_payment: bool,
+                         include_commission: bool) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "operation": "withdraw",
+        "amount": float(amount),
+        key: val,
+        "create_payment": bool(create_payment),
+        "include_commission": bool(include_commission),
+    }
+    if transaction_type_id is not None:
+        try:
+            payload["transaction_type_id"] = int(transaction_type_id)
+        except Exception:
+            payload["transaction_type_id"] = transaction_type_id
+    if message:
+        payload["message"] = str(message)
+    return payload
+
+def _needs_post_fallback(status_code: int, content_type: str) -> bool:
+    # PUT иногда отвечает редиректом или HTML-страницей — тогда повторяем тот же запрос через POST
+    return 300 <= status_code < 400 or ("text/html" in (content_type or "") and status_code < 500)
+
+def preview_withdrawal_try_variants(driver_id: int, amount: float, candidate_value: Any, include_commission: bool = False,
+                                    kind: Optional[str] = None):
     url_path = f"/drivers/{int(driver_id)}/transactions-withdraw-preview"
-    value_variants = _make_value_variants(candidate_value)
     last_status = None
     last_raw = None
-    for key in PREVIEW_PARAM_CANDIDATE_NAMES:
-        for val in value_variants:
-            payload = {"amount": float(amount), key: val, "include_commission": bool(include_commission)}
-            try:
-                r = _request("POST", url_path, json=payload)
-            except Exception:
-                logger.exception("Network error POST preview attempt key=%s val=%s", key, repr(val))
-                last_status = None
-                last_raw = {"text": "network_exception"}
-                continue
-            last_status = r.status_code
-            text = (r.text or "").strip()
-            try:
-                parsed = r.json() if text else None
-                last_raw = parsed if parsed is not None else {"text": text, "status_code": r.status_code}
-            except Exception:
-                last_raw = {"text": text, "status_code": r.status_code}
-            logger.debug("Preview try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, last_raw)
-            if r.status_code == 200:
-                return True, r.status_code, last_raw, key, val
+    for key, shape, val in _variant_attempts("preview", PREVIEW_PARAM_CANDIDATE_NAMES, candidate_value, driver_id, kind):
+        payload = _preview_payload(amount, key, val, include_commission)
+        try:
+            r = _request("POST", url_path, json=payload)
+        except Exception:
+            logger.exception("Network error POST preview attempt key=%s val=%s", key, repr(val))
+            last_status = None
+            last_raw = {"text": "network_exception"}
+            continue
+        last_status = r.status_code
+        text = (r.text or "").strip()
+        try:
+            parsed = r.json() if text else None
+            last_raw = parsed if parsed is not None else {"text": text, "status_code": r.status_code}
+        except Exception:
+            last_raw = {"text": text, "status_code": r.status_code}
+        logger.debug("Preview try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, last_raw)
+        if r.status_code == 200:
+            _remember_variant("preview", driver_id, kind, candidate_value, key, shape)
+            return True, r.status_code, last_raw, key, val
     return False, last_status, last_raw, None, None
 
 def _create_withdrawal_transaction_api_try_variants(driver_id: int,
@@ -325,58 +450,51 @@ def _create_withdrawal_transaction_api_try_variants(driver_id: int,
                                                     transaction_type_id: Optional[int] = None,
                                                     message: Optional[str] = None,
                                                     create_payment: bool = True,
-                                                    include_commission: bool = False) -> Dict[str, Any]:
+                                                    include_commission: bool = False,
+                                                    kind: Optional[str] = None) -> Dict[str, Any]:
     url_path = f"/drivers/{int(driver_id)}/transactions"
-    value_variants = _make_value_variants(candidate_value)
     last_res = {"ok": False, "status_code": None, "raw": None, "used_key": None, "used_value": None, "tried": None}
-    for key in TRANSACTION_PARAM_CANDIDATE_NAMES:
-        for val in value_variants:
-            payload: Dict[str, Any] = {
-                "operation": "withdraw",
-                "amount": float(amount),
-                key: val,
-                "create_payment": bool(create_payment),
-                "include_commission": bool(include_commission),
-            }
-            if transaction_type_id is not None:
-                try:
-                    payload["transaction_type_id"] = int(transaction_type_id)
-                except Exception:
-                    payload["transaction_type_id"] = transaction_type_id
-            if message:
-                payload["message"] = str(message)
+    for key, shape, val in _variant_attempts("create", TRANSACTION_PARAM_CANDIDATE_NAMES, candidate_value, driver_id, kind):
+        payload = _transaction_payload(amount, key, val, transaction_type_id, message, create_payment, include_commission)
+        try:
+            r = _request("PUT", url_path, json=payload, allow_redirects=False)
+        except CircuitOpenError:
+            logger.warning("Jump circuit open, PUT /transactions not sent key=%s val=%s", key, repr(val))
+            last_res.update({"raw": {"text": "circuit_open"}, "used_key": key, "used_value": val, "tried": "put"})
+            continue
+        except Exception:
+            logger.exception("Network error PUT /transactions attempt key=%s val=%s", key, repr(val))
+            return _create_interrupted(key, val, "put")
+        try:
+            raw = r.json() if r.text else None
+        except Exception:
+            raw = {"text": r.text}
+        logger.debug("PUT try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, raw)
+        if r.status_code in (200, 201, 204):
+            _remember_variant("create", driver_id, kind, candidate_value, key, shape)
+            return {"ok": True, "status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"}
+        if _needs_post_fallback(r.status_code, r.headers.get("Content-Type", "")):
+            logger.info("PUT produced redirect/HTML; trying POST fallback for key=%s val=%s", key, repr(val))
             try:
-                r = _request("PUT", url_path, json=payload, allow_redirects=False)
-            except Exception:
-                logger.exception("Network error PUT /transactions attempt key=%s val=%s", key, repr(val))
-                last_res.update({"raw": {"text": "network_exception"}, "used_key": key, "used_value": val, "tried": "put"})
+                r2 = _request("POST", url_path, json=payload, allow_redirects=False)
+            except CircuitOpenError:
+                logger.warning("Jump circuit open, POST fallback not sent key=%s val=%s", key, repr(val))
+                last_res.update({"raw": {"text": "circuit_open"}, "used_key": key, "used_value": val, "tried": "post"})
                 continue
+            except Exception:
+                logger.exception("Network error POST fallback")
+                return _create_interrupted(key, val, "post")
             try:
-                raw = r.json() if r.text else None
+                raw2 = r2.json() if r2.text else None
             except Exception:
-                raw = {"text": r.text}
-            logger.debug("PUT try key=%s val=%s -> status=%s raw=%s", key, repr(val), r.status_code, raw)
-            if r.status_code in (200, 201, 204):
-                return {"ok": True, "status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"}
-            ct = r.headers.get("Content-Type", "") or ""
-            if 300 <= r.status_code < 400 or ("text/html" in ct and r.status_code < 500):
-                logger.info("PUT produced redirect/HTML; trying POST fallback for key=%s val=%s", key, repr(val))
-                try:
-                    r2 = _request("POST", url_path, json=payload, allow_redirects=False)
-                except Exception:
-                    logger.exception("Network error POST fallback")
-                    last_res.update({"raw": {"text": "network_exception_post"}, "used_key": key, "used_value": val, "tried": "post"})
-                    continue
-                try:
-                    raw2 = r2.json() if r2.text else None
-                except Exception:
-                    raw2 = {"text": r2.text}
-                logger.debug("POST fallback key=%s val=%s -> status=%s raw=%s", key, repr(val), r2.status_code, raw2)
-                if r2.status_code in (200, 201, 204):
-                    return {"ok": True, "status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"}
-                last_res.update({"status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"})
-            else:
-                last_res.update({"status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"})
+                raw2 = {"text": r2.text}
+            logger.debug("POST fallback key=%s val=%s -> status=%s raw=%s", key, repr(val), r2.status_code, raw2)
+            if r2.status_code in (200, 201, 204):
+                _remember_variant("create", driver_id, kind, candidate_value, key, shape)
+                return {"ok": True, "status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"}
+            last_res.update({"status_code": r2.status_code, "raw": raw2, "used_key": key, "used_value": val, "tried": "post"})
+        else:
+            last_res.update({"status_code": r.status_code, "raw": raw, "used_key": key, "used_value": val, "tried": "put"})
     return last_res
 
 def _only_digits(s: str) -> str:
@@ -512,24 +630,15 @@ def choose_candidates(profile: Dict[str, Any], card_number_hint: Optional[str],
     scored.sort(key=lambda x: x.get("score", 0), reverse=True)
     return scored
 
-def perform_withdrawal(*,
-                       phone: str,
-                       amount: float,
-                       requisites: Optional[str] = None,
-                       card_number: Optional[str] = None,
-                       phone_hint: Optional[str] = None,
-                       bank_hint: Optional[str] = None,
-                       tx_type_id: Optional[int] = None,
-                       use_preview: bool = True,
-                       include_commission: bool = False,
-                       create_payment: bool = True,
-                       operation: str = "withdraw",
-                       force_try_without_tx_type: bool = False) -> Dict[str, Any]:
-    MIN_REMAIN = Decimal("50")
-    if not phone:
-        return {"ok": False, "reason": "need_driver_phone"}
+WITHDRAW_MIN_REMAIN = Decimal("50")
+# маркер: тип транзакции нужно выбрать через choose_transaction_type_id
+_TX_TYPE_LOOKUP = object()
 
-    driver = get_driver_by_phone(phone)
+def _check_withdraw_driver(driver: Optional[Dict[str, Any]], phone: str, amount: Any) -> Dict[str, Any]:
+    """
+    Проверки перед выводом: водитель найден, сумма корректна, после вывода на счёте остаётся минимум.
+    Сумму больше допустимой уменьшает до допустимой (adjusted=True).
+    """
     if not driver:
         return {"ok": False, "reason": "driver_not_found", "phone": phone}
     driver_id = driver.get("id")
@@ -541,25 +650,20 @@ def perform_withdrawal(*,
     except Exception:
         return {"ok": False, "reason": "invalid_amount", "amount": amount}
 
-    balance = driver.get("balance")
-    try:
-        bal_dec = Decimal(str(balance)) if balance is not None else Decimal(0)
-    except Exception:
-        bal_dec = Decimal(0)
-
-    allowed_withdrawable = float(max(bal_dec - MIN_REMAIN, Decimal(0)))
+    bal_dec = _driver_balance(driver)
+    allowed_withdrawable = float(max(bal_dec - WITHDRAW_MIN_REMAIN, Decimal(0)))
     if allowed_withdrawable <= 0:
         return {"ok": False, "reason": "insufficient_after_minimum", "allowed": 0, "balance": str(bal_dec)}
 
-    adjusted = False
-    if amount > allowed_withdrawable:
-        amount_to_send = allowed_withdrawable
-        adjusted = True
-    else:
-        amount_to_send = amount
-
-    profile = get_driver_profile(driver_id) or {}
+    adjusted = amount > allowed_withdrawable
+    return {"ok": True, "phone": phone, "driver_id": driver_id, "amount_to_send": allowed_withdrawable if adjusted else amount,
+            "adjusted": adjusted, "allowed": allowed_withdrawable}
 
+def _withdraw_candidates(profile: Dict[str, Any],
+                         phone: str,
+                         card_number: Optional[str],
+                         phone_hint: Optional[str],
+                         bank_hint: Optional[str]) -> List[Dict[str, Any]]:
     # phone_hint:
     #  - if explicitly передан (для СБП) — используем его для матчинга реквизитов
     #  - иначе сохраняем старое поведение — используем номер водителя
@@ -572,27 +676,85 @@ def perform_withdrawal(*,
         bank_hint=bank_hint,
     )
     if not candidates_scored:
-        card_ids = []
         p = profile.get("item") if isinstance(profile.get("item"), dict) else profile
         for c in (p.get("cards") or []):
             if isinstance(c, dict) and c.get("id"):
                 try:
-                    card_ids.append(int(c.get("id")))
+                    candidates_scored.append({"kind": "card", "obj": {}, "preferred_value": int(c.get("id")), "score": 0})
                 except Exception:
                     pass
-        if not card_ids:
-            return {"ok": False, "reason": "no_candidates_found", "driver": driver, "profile": profile}
-        for cid in card_ids:
-            candidates_scored.append({"kind": "card", "obj": {}, "preferred_value": int(cid), "score": 0})
+    return candidates_scored
 
+def _withdraw_tx_type(tx_type_id: Optional[int], operation: str) -> Any:
     if DEFAULT_TRANSACTION_TYPE_ID:
         try:
-            tx_type = int(DEFAULT_TRANSACTION_TYPE_ID)
+            return int(DEFAULT_TRANSACTION_TYPE_ID)
         except Exception:
-            tx_type = None
-    elif tx_type_id:
-        tx_type = tx_type_id
-    else:
+            return None
+    if tx_type_id:
+        return tx_type_id
+    return _TX_TYPE_LOOKUP
+
+def _create_interrupted(key: Any, val: Any, tried: str) -> Dict[str, Any]:
+    """
+    Запрос на создание транзакции оборвался без ответа (таймаут, обрыв соединения): транзакция могла создаться,
+    поэтому следующие варианты и кандидаты не пробуем.
+    """
+    return {"ok": False, "unknown_outcome": True, "status_code": None, "raw": {"text": "network_exception"},
+            "used_key": key, "used_value": val, "tried": tried}
+
+def _withdraw_unknown_outcome(driver: Dict[str, Any], pref: Any, checked: Dict[str, Any],
+                              create_errors: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # выплата могла пройти — баланс перечитываем из Jump, менеджер проверяет транзакцию вручную
+    jump_lookups.invalidate(phone=checked["phone"], driver_id=checked["driver_id"])
+    driver_index.invalidate(phone=checked["phone"], driver_id=checked["driver_id"])
+    return {"ok": False, "reason": "unknown_outcome", "driver": driver, "candidate": pref, "create_errors": create_errors}
+
+def _withdraw_created(tx_res: Dict[str, Any], driver: Dict[str, Any], pref: Any, tx_type: Any,
+                      checked: Dict[str, Any]) -> Dict[str, Any]:
+    amount_to_send = checked["amount_to_send"]
+    # баланс изменился — следующий показ должен сходить в Jump
+    jump_lookups.invalidate(phone=checked["phone"], driver_id=checked["driver_id"])
+    driver_index.invalidate(phone=checked["phone"], driver_id=checked["driver_id"])
+    res = {"ok": True, "reason": "created", "tx": tx_res.get("raw"), "driver": driver,
+           "candidate": pref, "used_key": tx_res.get("used_key"), "used_value": tx_res.get("used_value"),
+           "tx_type_id": tx_type, "amount_sent": amount_to_send, "adjusted": checked["adjusted"],
+           "allowed": checked["allowed"]}
+    if checked["adjusted"]:
+        res["notice"] = f"Сумма уменьшена до {amount_to_send:.2f} ₽ чтобы на счёте осталось 50 ₽."
+    return res
+
+def perform_withdrawal(*,
+                       phone: str,
+                       amount: float,
+                       requisites: Optional[str] = None,
+                       card_number: Optional[str] = None,
+                       phone_hint: Optional[str] = None,
+                       bank_hint: Optional[str] = None,
+                       tx_type_id: Optional[int] = None,
+                       use_preview: bool = True,
+                       include_commission: bool = False,
+                       create_payment: bool = True,
+                       operation: str = "withdraw",
+                       force_try_without_tx_type: bool = False) -> Dict[str, Any]:
+    if not phone:
+        return {"ok": False, "reason": "need_driver_phone"}
+
+    driver = get_driver_by_phone(phone, fresh=True)
+    checked = _check_withdraw_driver(driver, phone, amount)
+    if not checked.get("ok"):
+        return checked
+    driver_id = checked["driver_id"]
+    amount_to_send = checked["amount_to_send"]
+
+    profile = get_driver_profile(driver_id, fresh=True) or {}
+
+    candidates_scored = _withdraw_candidates(profile, phone, card_number, phone_hint, bank_hint)
+    if not candidates_scored:
+        return {"ok": False, "reason": "no_candidates_found", "driver": driver, "profile": profile}
+
+    tx_type = _withdraw_tx_type(tx_type_id, operation)
+    if tx_type is _TX_TYPE_LOOKUP:
         tx_type = choose_transaction_type_id(operation=operation, preferred_id=None)
         if tx_type is None:
             tx_type = OPERATION_TX_TYPE_FALLBACK.get(operation.lower())
@@ -608,7 +770,7 @@ def perform_withdrawal(*,
 
         if use_preview and operation.lower() == "withdraw":
             try:
-                ok, status, raw, used_key, used_val = preview_withdrawal_try_variants(driver_id=int(driver_id), amount=float(amount_to_send), candidate_value=pref, include_commission=include_commission)
+                ok, status, raw, used_key, used_val = preview_withdrawal_try_variants(driver_id=int(driver_id), amount=float(amount_to_send), candidate_value=pref, include_commission=include_commission, kind=kind)
             except Exception:
                 logger.exception("Preview exception for candidate %s", repr(pref))
                 preview_errors.append({"candidate": pref, "error": "exception"})
@@ -627,20 +789,19 @@ def perform_withdrawal(*,
                                                                      transaction_type_id=tx_type,
                                                                      message=message_text,
                                                                      create_payment=create_payment,
-                                                                     include_commission=include_commission)
+                                                                     include_commission=include_commission,
+                                                                     kind=kind)
         except Exception:
             logger.exception("Create exception for candidate %s", repr(pref))
             create_errors.append({"candidate": pref, "error": "exception"})
-            continue
+            return _withdraw_unknown_outcome(driver, pref, checked, create_errors)
 
         if tx_res.get("ok"):
             logger.info("Withdrawal created successfully for driver %s using candidate %s", driver_id, repr(pref))
-            res = {"ok": True, "reason": "created", "tx": tx_res.get("raw"), "driver": driver,
-                   "candidate": pref, "used_key": tx_res.get("used_key"), "used_value": tx_res.get("used_value"),
-                   "tx_type_id": tx_type, "amount_sent": amount_to_send, "adjusted": adjusted, "allowed": allowed_withdrawable}
-            if adjusted:
-                res["notice"] = f"Сумма уменьшена до {amount_to_send:.2f} ₽ чтобы на счёте осталось 50 ₽."
-            return res
+            return _withdraw_created(tx_res, driver, pref, tx_type, checked)
+        if tx_res.get("unknown_outcome"):
+            create_errors.append({"candidate": pref, "error": "unknown_outcome", "used_key": tx_res.get("used_key"), "tried": tx_res.get("tried")})
+            return _withdraw_unknown_outcome(driver, pref, checked, create_errors)
 
         create_errors.append({"candidate": pref, "status": tx_res.get("status_code"), "raw": tx_res.get("raw"), "used_key": tx_res.get("used_key"), "tried": tx_res.get("tried")})
         time.sleep(0.2)
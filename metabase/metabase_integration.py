@@ -1,17 +1,25 @@
+import csv
 import datetime
+import io
 import uuid
 import re
 from decimal import Decimal
 
 import requests
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 from decouple import config
 
+from resilience import Upstream
 from handlers.services import (
-    get_refer_a_friend_promo,
+    _read_refer_friend_rows_structured,
+    _format_refer_friend_promo,
     _read_first_order_rows_structured,
     get_table3_coeffs,
+    prefetch_promotion_sheets,
+    INVITE_FRIEND_SHEET_TITLE,
+    FIRST_ORDER_SHEET_TITLE,
+    COMPLETED_ORDERS_SHEET_TITLE,
 )
 
 logger = logging.getLogger("metabase_integration")
@@ -20,14 +28,19 @@ logger.setLevel(logging.INFO)
 
 BASE = "https://metabase.sbmt.io"
 CARD_ID = []
+METABASE_AUTH_TIMEOUT = float(config("METABASE_AUTH_TIMEOUT", default="10"))
+
+# предохранитель и адаптивный таймаут: медленный Metabase не держит обработчики по 15–60 секунд
+metabase_upstream = Upstream("metabase", max_timeout=60)
 
 
 def update_metabase_token():
     url = f"https://metabase.sbmt.io/api/session"
     headers = {"Content-Type": "application/json"}
 
-    response = requests.post(url, headers=headers,
-                             json={"username": config('METABASE_EMAIL'), "password": config('METABASE_PASSWORD')})
+    response = metabase_upstream.request(requests.post, url, headers=headers,
+                                         json={"username": config('METABASE_EMAIL'), "password": config('METABASE_PASSWORD')},
+                                         timeout=METABASE_AUTH_TIMEOUT)
     response.raise_for_status()
     data = response.json()
     return data.get("id")
@@ -94,7 +107,7 @@ def get_completed_orders_by_phone(phone: str, timeout: int = 15) -> int:
     url = f"{BASE}/api/card/{CARD_ID}/query/json"
     headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
     payload = {"parameters": [], "ignore_cache": True}
-    resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
     resp.raise_for_status()
     data = resp.json()
 
@@ -139,7 +152,7 @@ def courier_data(phone: str, timeout: int = 15):
     headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
     payload = {"parameters": [], "ignore_cache": True}
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
     except Exception as e:
@@ -167,7 +180,7 @@ def courier_exists(phone: str, timeout: int = 15):
     headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
     payload = {"parameters": [], "ignore_cache": True}
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
     except Exception as e:
@@ -200,6 +213,22 @@ def courier_exists(phone: str, timeout: int = 15):
     return {"found": False, "row": None, "error": None}
 
 
+def _metabase_cell(value: Any) -> Any:
+    """
+    Значение ячейки в одном виде для JSON- и CSV-выгрузки: пустая ячейка CSV — None,
+    булевы — строкой, как их пишет CSV.
+    """
+    if value == "":
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def _metabase_record(pairs) -> Dict[str, Any]:
+    return {str(k).strip(): _metabase_cell(v) for k, v in pairs if k is not None}
+
+
 def fetch_all_metabase_rows(timeout: int = 30) -> List[Dict[str, Any]]:
     """
     Возвращает все строки карточки Metabase в виде списка dict.
@@ -208,7 +237,7 @@ def fetch_all_metabase_rows(timeout: int = 30) -> List[Dict[str, Any]]:
     url = f"{BASE}/api/card/{CARD_ID}/query/json"
     headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
     payload = {"parameters": [], "ignore_cache": True}
-    resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
     resp.raise_for_status()
     data = resp.json()
 
@@ -216,20 +245,44 @@ def fetch_all_metabase_rows(timeout: int = 30) -> List[Dict[str, Any]]:
     if isinstance(data, list):
         for obj in data:
             if isinstance(obj, dict):
-                rows.append(obj)
+                rows.append(_metabase_record(obj.items()))
         return rows
 
     if isinstance(data, dict) and data.get("data"):
-        cols = [c.get("name") for c in data["data"].get("cols", [])]
+        # как в CSV-выгрузке: колонки под отображаемыми названиями
+        cols = [c.get("display_name") or c.get("name") for c in data["data"].get("cols", [])]
         raw_rows = data["data"].get("rows", []) or []
         for row in raw_rows:
             if not isinstance(row, (list, tuple)):
                 continue
-            obj = {cols[i]: row[i] for i in range(min(len(cols), len(row)))}
-            rows.append(obj)
+            rows.append(_metabase_record(zip(cols, row)))
     return rows
 
 
+def iter_metabase_rows(timeout: int = 60) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково отдаёт строки карточки Metabase через CSV-выгрузку, не загружая весь ответ в память.
+    Параметры запроса и вид строк те же, что у fetch_all_metabase_rows: неформатированные значения,
+    пустые ячейки — None.
+    """
+    token = update_metabase_token()
+    url = f"{BASE}/api/card/{CARD_ID}/query/csv"
+    headers = {"X-Metabase-Session": token}
+    payload = {"parameters": "[]", "ignore_cache": "true", "format_rows": "false"}
+    with metabase_upstream.request(requests.post, url, headers=headers, data=payload,
+                                   timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        # csv сам разбирает переводы строк внутри кавычек; gzip снимает urllib3, BOM — utf-8-sig
+        resp.raw.decode_content = True
+        reader = csv.reader(io.TextIOWrapper(resp.raw, encoding="utf-8-sig", newline=""))
+        cols = next(reader, None)
+        if not cols:
+            return
+        for row in reader:
+            if row:
+                yield _metabase_record(zip(cols, row))
+
+
 def _parse_date_lead(value) -> Optional[datetime.datetime]:
     if not value:
         return None
@@ -264,10 +317,12 @@ def _parse_date_lead(value) -> Optional[datetime.datetime]:
     return None
 
 
-def get_promotions(phone: str, timeout: int = 15) -> List[Dict[str, Any]]:
+def get_promotions(phone: str, timeout: int = 15, sources: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Собирает и возвращает все акции для номера телефона.
     Формат ступеней: "N заказов - DD.MM.YYYY - SUM ₽"
+    sources — уже прочитанные из зеркала в Postgres строки акций
+    ({"refer", "first_order", "coeffs"}); без них листы читаются из Google Sheets.
     """
     results: List[Dict[str, Any]] = []
 
@@ -277,12 +332,22 @@ def get_promotions(phone: str, timeout: int = 15) -> List[Dict[str, Any]]:
         if norm_phone == normalize_phone("+79137619949") or norm_phone.endswith("9137619949"):
             show_all = True
 
+    # зеркало содержит только строки этого телефона, для show_all нужен весь лист
+    if show_all:
+        sources = None
+    # all promotion sheets in one batchGet round-trip
+    sheets = prefetch_promotion_sheets() if sources is None else {}
+
     # 1) generic refer promo (always try to fetch general promo info)
     try:
-        refer_text_generic = get_refer_a_friend_promo()  # generic info
+        if sources is not None:
+            refer_rows = sources.get("refer") or []
+        else:
+            refer_rows = _read_refer_friend_rows_structured(sheets.get(INVITE_FRIEND_SHEET_TITLE))
+        refer_text_generic = _format_refer_friend_promo(refer_rows)  # generic info
         refer_text_personal = None
         try:
-            refer_text_personal = get_refer_a_friend_promo(user_identifier=phone)
+            refer_text_personal = _format_refer_friend_promo(refer_rows, user_identifier=phone)
         except Exception:
             refer_text_personal = None
         # prefer personal detailed info if exists, otherwise generic
@@ -301,7 +366,10 @@ def get_promotions(phone: str, timeout: int = 15) -> List[Dict[str, Any]]:
 
     # 2) first order promos (from sheet)
     try:
-        rows = _read_first_order_rows_structured()
+        if sources is not None:
+            rows = sources.get("first_order") or []
+        else:
+            rows = _read_first_order_rows_structured(sheets.get(FIRST_ORDER_SHEET_TITLE))
         for r in rows:
             if show_all or (r.get("phone") and match_by_phone(r.get("phone"), phone)):
                 st = (r.get("status") or "").strip().lower()
@@ -323,7 +391,7 @@ def get_promotions(phone: str, timeout: int = 15) -> List[Dict[str, Any]]:
         url = f"{BASE}/api/card/{CARD_ID}/query/json"
         headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
         payload = {"parameters": [], "ignore_cache": True}
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
 
@@ -337,7 +405,10 @@ def get_promotions(phone: str, timeout: int = 15) -> List[Dict[str, Any]]:
                 obj = {cols[i]: row[i] for i in range(min(len(cols), len(row)))}
                 objs.append(obj)
 
-        table3 = get_table3_coeffs() or {}
+        if sources is not None:
+            table3 = sources.get("coeffs") or {}
+        else:
+            table3 = get_table3_coeffs(sheets.get(COMPLETED_ORDERS_SHEET_TITLE)) or {}
         thresholds = [10, 25, 50, 75, 100]
         base_sum = 1000
 
@@ -411,7 +482,7 @@ def get_date_lead(phone_number: str, timeout=15):
         url = f"{BASE}/api/card/{CARD_ID}/query/json"
         headers = {"X-Metabase-Session": token, "Content-Type": "application/json"}
         payload = {"parameters": [], "ignore_cache": True}
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
         for obj in data:
@@ -550,7 +621,7 @@ def compute_referral_commissions_for_inviter(inviter_identifier: str,
 
     payload = {"parameters": [], "ignore_cache": True}
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        resp = metabase_upstream.request(requests.post, url, headers=headers, json=payload, timeout=timeout)
         resp.raise_for_status()
         data = resp.json()
     except Exception as e:
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Optional
+
+from decouple import config
+
+logger = logging.getLogger("resilience")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+# сколько ошибок подряд открывают предохранитель и сколько секунд он открыт до пробного запроса
+BREAKER_FAILURE_THRESHOLD = int(config("BREAKER_FAILURE_THRESHOLD", default="5"))
+BREAKER_OPEN_SECONDS = float(config("BREAKER_OPEN_SECONDS", default="30"))
+# адаптивный таймаут = перцентиль последних задержек * множитель, в пределах [минимум, фиксированный таймаут вызова]
+ADAPTIVE_TIMEOUT_PERCENTILE = float(config("ADAPTIVE_TIMEOUT_PERCENTILE", default="99"))
+ADAPTIVE_TIMEOUT_FACTOR = float(config("ADAPTIVE_TIMEOUT_FACTOR", default="2"))
+ADAPTIVE_TIMEOUT_MIN = float(config("ADAPTIVE_TIMEOUT_MIN", default="2"))
+ADAPTIVE_TIMEOUT_WINDOW = int(config("ADAPTIVE_TIMEOUT_WINDOW", default="200"))
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = int(config("ADAPTIVE_TIMEOUT_MIN_SAMPLES", default="20"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Внешний сервис считается недоступным: запрос не отправлялся.
+    """
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"{upstream} is unavailable, circuit open (next probe in {retry_in:.0f}s)")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class UpstreamCall:
+    """
+    Один вызов внешнего сервиса: timeout — сколько ждать ответа; fail()/check_status() отмечают
+    неудачу без исключения (например, ответ 5xx).
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.failed = False
+
+    def fail(self) -> None:
+        self.failed = True
+
+    def check_status(self, status: int) -> None:
+        if status >= 500:
+            self.failed = True
+
+
+class Upstream:
+    """
+    Предохранитель (closed -> open -> half_open) и адаптивный таймаут для одного внешнего сервиса.
+
+    closed: запросы идут, failure_threshold ошибок подряд (исключение, таймаут, 5xx) открывают предохранитель.
+    open: запросы сразу получают CircuitOpenError, пока не пройдёт open_seconds.
+    half_open: проходит один пробный запрос с полным таймаутом; успех закрывает предохранитель, ошибка снова открывает.
+    """
+
+    def __init__(self, name: str, max_timeout: float,
+                 min_timeout: float = ADAPTIVE_TIMEOUT_MIN,
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 percentile: float = ADAPTIVE_TIMEOUT_PERCENTILE,
+                 factor: float = ADAPTIVE_TIMEOUT_FACTOR,
+                 window: int = ADAPTIVE_TIMEOUT_WINDOW,
+                 min_samples: int = ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.percentile = percentile
+        self.factor = factor
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def timeout(self, ceiling: Optional[float] = None) -> float:
+        ceiling = ceiling or self.max_timeout
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return ceiling
+        idx = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(min(self.min_timeout, ceiling), min(ceiling, samples[idx] * self.factor))
+
+    def _acquire(self) -> bool:
+        """
+        Пропускает вызов или бросает CircuitOpenError. True — это пробный вызов в half_open.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                retry_in = self._opened_at + self.open_seconds - time.monotonic()
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info("%s circuit half-open, probing", self.name)
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def _record(self, ok: bool, elapsed: float, timeout: float, probe: bool) -> None:
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            # ответ в пределах таймаута — обычная задержка; упёршийся в таймаут вызов тоже учитывается,
+            # чтобы слишком тесный таймаут сам расширялся
+            if ok or elapsed >= timeout:
+                self._latencies.append(elapsed)
+            if ok:
+                if self._state != CLOSED:
+                    logger.info("%s circuit closed", self.name)
+                self._state = CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                logger.warning("%s circuit open after %d failures, failing fast for %.0fs",
+                               self.name, self._failures, self.open_seconds)
+
+    def _release(self, probe: bool) -> None:
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    @contextmanager
+    def call(self, ceiling: Optional[float] = None, adaptive: bool = True):
+        """
+        with upstream.call(ceiling=15) as call: ... timeout=call.timeout ...
+        Исключение внутри блока или call.fail() — неудача. adaptive=False оставляет фиксированный таймаут
+        (для неидемпотентных запросов, где обрыв по таймауту оставляет неясным, выполнилась ли операция).
+        Работает и в корутинах: отмена задачи не считается ни успехом, ни ошибкой.
+        """
+        probe = self._acquire()
+        full = ceiling or self.max_timeout
+        call = UpstreamCall(full if probe or not adaptive else self.timeout(full))
+        start = time.monotonic()
+        try:
+            yield call
+        except (asyncio.CancelledError, GeneratorExit):
+            self._release(probe)
+            raise
+        except BaseException:
+            self._record(False, time.monotonic() - start, call.timeout, probe)
+            raise
+        self._record(not call.failed, time.monotonic() - start, call.timeout, probe)
+
+    def request(self, send: Callable[..., Any], *args, timeout: Any = None, adaptive: bool = True, **kwargs) -> Any:
+        """
+        Обёртка для requests: upstream.request(requests.post, url, json=..., timeout=15).
+        timeout может быть парой (connect, read) — адаптируется только read.
+        """
+        connect = None
+        if isinstance(timeout, tuple):
+            connect, timeout = timeout
+        with self.call(ceiling=timeout, adaptive=adaptive) as call:
+            resp = send(*args, timeout=(connect, call.timeout) if connect is not None else call.timeout, **kwargs)
+            call.check_status(resp.status_code)
+            return resp
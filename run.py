@@ -6,6 +6,12 @@ from db.db import init_engine, dispose_engine, current_loop_id
 from db.create_tables import create_all
 from create_bot import bot as bot_instance, dp as dispatcher
 from handlers.user_handlers import urouter
+from handlers.services import close_sheets_client
+from sheets.promotion_mirror import run_promotion_mirror_sync
+from jump.jump_integrations import close_jump_session
+from jump.jump_async import close_jump_client, run_driver_index_sync
+from amocrm.amocrm_integration import get_amocrm_client, close_amocrm_client
+from handlers.withdrawals import run_withdrawal_workers
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -20,12 +26,26 @@ async def main():
     except Exception:
         logger.exception("Can't set commands")
 
+    await get_amocrm_client().start()
+    mirror_task = asyncio.create_task(run_promotion_mirror_sync())
+    withdrawal_task = asyncio.create_task(run_withdrawal_workers())
+    driver_index_task = asyncio.create_task(run_driver_index_sync())
     try:
         logger.info("Start polling")
         await dispatcher.start_polling(bot_instance)
     finally:
         logger.info("Shutting down, disposing engine")
+        for task in (mirror_task, withdrawal_task, driver_index_task):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
         await dispose_engine()
+        await close_sheets_client()
+        close_jump_session()
+        await close_jump_client()
+        await close_amocrm_client()
         await bot_instance.close()
 
 if __name__ == "__main__":
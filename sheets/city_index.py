@@ -0,0 +1,161 @@
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from decouple import config
+
+# минимальная похожесть (коэффициент Дайса по триграммам) для нечёткого совпадения
+CITY_FUZZY_MIN_SIMILARITY = float(config("CITY_FUZZY_MIN_SIMILARITY", default="0.7"))
+
+_PREFIX_RE = re.compile(r"^(?:г|гор|город|пгт|пос|поселок|с|село|д|дер|деревня)\.?\s+|^(?:г|гор|пгт|пос|с|д)\.\s*")
+_SEPARATORS_RE = re.compile(r"[-‐‑‒–—_/.,()]+")
+_NON_WORD_RE = re.compile(r"[^0-9a-zа-я\s]+")
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s",
+    "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "u", "я": "a",
+    # узбекская/таджикская/кыргызская кириллица
+    "ў": "u", "қ": "k", "ғ": "g", "ҳ": "h", "ҷ": "j", "ӣ": "i", "ӯ": "u", "ң": "n", "ө": "o",
+    "ү": "u", "ә": "a", "і": "i",
+}
+# разные системы латиницы приводим к одному виду (применяется к обеим сторонам сравнения)
+_LATIN_FOLDS = (("kh", "h"), ("ts", "c"), ("ya", "a"), ("yu", "u"), ("yo", "o"), ("ye", "e"),
+                ("ck", "k"), ("w", "v"), ("x", "ks"), ("q", "k"), ("iy", "i"), ("ii", "i"))
+
+
+def normalize_city(city: Optional[str]) -> str:
+    """
+    «г. Санкт-Петербург» -> «санкт петербург»: регистр, ё/е, префиксы «г.»/«пгт», дефисы и знаки.
+    """
+    s = (city or "").strip().lower().replace("ё", "е")
+    for src, dst in (("ў", "у"), ("қ", "к"), ("ғ", "г"), ("ҳ", "х"), ("ҷ", "ч"), ("ӣ", "и"),
+                     ("ӯ", "у"), ("ң", "н"), ("ө", "о"), ("ү", "у"), ("ә", "а"), ("і", "и")):
+        s = s.replace(src, dst)
+    s = _PREFIX_RE.sub("", s)
+    s = _SEPARATORS_RE.sub(" ", s)
+    s = _NON_WORD_RE.sub("", s)
+    return " ".join(s.split())
+
+
+def city_key(city: Optional[str]) -> str:
+    """
+    Ключ для сравнения: нормализованное название в латинице без пробелов,
+    так что «Санкт Петербург», «Санкт-Петербург» и «Sankt-Peterburg» совпадают.
+    """
+    s = "".join(_TRANSLIT.get(ch, ch) for ch in normalize_city(city)).replace(" ", "")
+    for src, dst in _LATIN_FOLDS:
+        s = s.replace(src, dst)
+    return s
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_typos(key: str) -> int:
+    # в коротких названиях триграммы слишком грубые: «масква» и «москва» делят мало триграмм
+    if len(key) >= 9:
+        return 2
+    if len(key) >= 5:
+        return 1
+    return 0
+
+
+def _within_edits(a: str, b: str, limit: int) -> bool:
+    """
+    Расстояние Левенштейна между a и b не больше limit (с ранним выходом).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return False
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i]
+        for j, cb in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return False
+        prev = cur
+    return prev[-1] <= limit
+
+
+class CityIndex:
+    """
+    Индекс город -> адрес: точное совпадение по city_key, иначе ближайший город по триграммам
+    (или единственный город той же длины и с той же первой буквой, отличающийся 1–2 заменёнными буквами).
+    Неизменяем после построения — при обновлении листа строится новый индекс.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str]], min_similarity: float = CITY_FUZZY_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._exact: Dict[str, str] = {}
+        self._keys: List[str] = []
+        self._addresses: List[str] = []
+        self._grams: List[Set[str]] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for city, address in rows:
+            key = city_key(city)
+            # как и при полном просмотре листа, побеждает первая строка с этим городом
+            if not key or key in self._exact:
+                continue
+            self._exact[key] = address
+            grams = _trigrams(key)
+            idx = len(self._addresses)
+            self._keys.append(key)
+            self._addresses.append(address)
+            self._grams.append(grams)
+            for g in grams:
+                self._postings[g].append(idx)
+
+    @classmethod
+    def from_sheet(cls, vals: Optional[List[List[str]]], **kwargs) -> "CityIndex":
+        """
+        Строит индекс по листу адресов: столбец A — город, B — адрес.
+        """
+        rows = [((row[0] or "").strip(), (row[1] or "").strip()) for row in vals or [] if len(row) >= 2]
+        return cls(rows, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._addresses)
+
+    def lookup(self, city: Optional[str]) -> Optional[str]:
+        """
+        Адрес по городу или None. Соседний реальный город не подставляется вместо отсутствующего:
+
+        >>> index = CityIndex([("Омск", "Omsk"), ("Москва", "Moscow")])
+        >>> index.lookup("Томск") is None
+        True
+        >>> index.lookup("масква")
+        'Moscow'
+        """
+        key = city_key(city)
+        if not key:
+            return None
+        if key in self._exact:
+            return self._exact[key] or None
+
+        grams = _trigrams(key)
+        common = Counter()
+        for g in grams:
+            for idx in self._postings.get(g, ()):
+                common[idx] += 1
+        best_idx, best_score = None, 0.0
+        for idx, n in common.items():
+            score = 2.0 * n / (len(grams) + len(self._grams[idx]))
+            if score > best_score:
+                best_idx, best_score = idx, score
+        if best_idx is not None and best_score >= self.min_similarity:
+            return self._addresses[best_idx] or None
+
+        # только замены букв при той же первой: вставка или удаление буквы превращает «Томск» в «Омск»,
+        # а при нескольких близких городах выбрать нельзя — лучше не найти город, чем дать адрес другого
+        limit = _max_typos(key)
+        if limit:
+            near = [idx for idx in common
+                    if len(self._keys[idx]) == len(key) and self._keys[idx][0] == key[0]
+                    and _within_edits(key, self._keys[idx], limit)]
+            if len(near) == 1:
+                return self._addresses[near[0]] or None
+        return None
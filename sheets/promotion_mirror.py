@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from decouple import config
+
+from db import crud
+from db.models import ReferFriendPromos, FirstOrderPromos
+from handlers.services import (
+    INVITE_FRIEND_SHEET_TITLE,
+    FIRST_ORDER_SHEET_TITLE,
+    COMPLETED_ORDERS_SHEET_TITLE,
+    PROMOTION_SHEET_TITLES,
+    batch_get_sheet_values,
+    read_uniform_addresses,
+    get_uniform_address_by_city,
+    get_city_index,
+    get_table3_coeffs,
+    _read_refer_friend_rows_structured,
+    _read_first_order_rows_structured,
+    _normalize_phone,
+)
+from sheets.quota import sheets_priority, PRIORITY_BACKGROUND
+
+logger = logging.getLogger("promotion_mirror")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+PROMOTION_MIRROR_SYNC_INTERVAL = float(config("PROMOTION_MIRROR_SYNC_INTERVAL", default="60"))
+
+# читать из Postgres можно только после первой успешной синхронизации в этом процессе
+_ready: Dict[str, bool] = {"promotions": False}
+# последние синхронизированные снимки листов: кэш отдаёт тот же объект, пока лист не менялся
+_last_synced: Dict[str, Any] = {}
+
+
+def _phone10(phone: Optional[str]) -> str:
+    return _normalize_phone(phone)[-10:]
+
+
+def _fit(model, row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обрезает строки под длину колонок модели, чтобы длинная ячейка не ломала весь upsert.
+    """
+    out = {}
+    for key, value in row.items():
+        length = getattr(model.__table__.c[key].type, "length", None)
+        if length and isinstance(value, str) and len(value) > length:
+            value = value[:length]
+        out[key] = value
+    return out
+
+
+def _refer_row_to_db(r: Dict[str, Any]) -> Dict[str, Any]:
+    row = {k: v for k, v in r.items() if k != "desc"}
+    row["description"] = r.get("desc") or ""
+    row["inviter_phone10"] = _phone10(r.get("inviter_phone"))
+    row["invited_phone10"] = _phone10(r.get("invited_phone"))
+    return _fit(ReferFriendPromos, row)
+
+
+def _first_order_row_to_db(r: Dict[str, Any]) -> Dict[str, Any]:
+    row = {k: v for k, v in r.items() if k != "desc"}
+    row["description"] = r.get("desc") or ""
+    row["phone10"] = _phone10(r.get("phone"))
+    return _fit(FirstOrderPromos, row)
+
+
+def _refer_row_from_db(r: ReferFriendPromos) -> Dict[str, Any]:
+    return {
+        "sheet_row": r.sheet_row,
+        "inviter_phone": r.inviter_phone or "",
+        "inviter_name": r.inviter_name or "",
+        "inviter_tg": r.inviter_tg or "",
+        "invited_phone": r.invited_phone or "",
+        "invited_name": r.invited_name or "",
+        "invited_tg": r.invited_tg or "",
+        "status": r.status or "",
+        "payout": r.payout or "",
+        "friend_order": r.friend_order or "",
+        "title": r.title or "",
+        "desc": r.description or "",
+        "reward": r.reward or "",
+    }
+
+
+def _first_order_row_from_db(r: FirstOrderPromos) -> Dict[str, Any]:
+    return {
+        "sheet_row": r.sheet_row,
+        "phone": r.phone or "",
+        "title": r.title or "",
+        "desc": r.description or "",
+        "reward": r.reward or "",
+        "status": r.status or "",
+    }
+
+
+def _changed(key: str, vals: Any) -> bool:
+    return vals is not None and _last_synced.get(key) is not vals
+
+
+async def sync_promotion_mirror() -> None:
+    """
+    Один проход синхронизации: перекладывает в Postgres листы, которые изменились с прошлого прохода.
+    """
+    with sheets_priority(PRIORITY_BACKGROUND):
+        sheets = await asyncio.to_thread(batch_get_sheet_values, PROMOTION_SHEET_TITLES)
+        addresses = await asyncio.to_thread(read_uniform_addresses)
+
+    refer_vals = sheets.get(INVITE_FRIEND_SHEET_TITLE)
+    if _changed(INVITE_FRIEND_SHEET_TITLE, refer_vals):
+        rows = [_refer_row_to_db(r) for r in _read_refer_friend_rows_structured(refer_vals)]
+        await crud.sync_refer_friend_promos(rows, len(refer_vals))
+        _last_synced[INVITE_FRIEND_SHEET_TITLE] = refer_vals
+
+    first_vals = sheets.get(FIRST_ORDER_SHEET_TITLE)
+    if _changed(FIRST_ORDER_SHEET_TITLE, first_vals):
+        rows = [_first_order_row_to_db(r) for r in _read_first_order_rows_structured(first_vals)]
+        await crud.sync_first_order_promos(rows, len(first_vals))
+        _last_synced[FIRST_ORDER_SHEET_TITLE] = first_vals
+
+    coeff_vals = sheets.get(COMPLETED_ORDERS_SHEET_TITLE)
+    if _changed(COMPLETED_ORDERS_SHEET_TITLE, coeff_vals):
+        await crud.sync_completed_orders_coeffs(get_table3_coeffs(coeff_vals))
+        _last_synced[COMPLETED_ORDERS_SHEET_TITLE] = coeff_vals
+
+    _ready["promotions"] = all(t in _last_synced for t in PROMOTION_SHEET_TITLES)
+
+    if _changed("uniform_addresses", addresses):
+        await asyncio.to_thread(get_city_index, addresses)
+        _last_synced["uniform_addresses"] = addresses
+
+
+async def run_promotion_mirror_sync(interval: float = PROMOTION_MIRROR_SYNC_INTERVAL) -> None:
+    """
+    Фоновая задача: синхронизирует зеркало раз в interval секунд.
+    """
+    while True:
+        try:
+            await sync_promotion_mirror()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Promotion mirror sync failed")
+        await asyncio.sleep(interval)
+
+
+async def load_promotion_sources_from_db(phone: str) -> Optional[Dict[str, Any]]:
+    """
+    Данные листов акций для get_promotions(sources=...) из Postgres.
+    None — зеркало ещё не готово или недоступно, тогда get_promotions читает таблицу.
+    """
+    if not _ready["promotions"]:
+        return None
+    phone10 = _phone10(phone)
+    try:
+        refer = await crud.get_refer_friend_promos(phone10, str(phone).strip() if phone else None)
+        first = await crud.get_first_order_promos_by_phone(phone10) if phone10 else []
+        coeffs = await crud.get_completed_orders_coeffs()
+    except Exception:
+        logger.exception("Failed to read promotions mirror for %s", phone)
+        return None
+    return {
+        "refer": [_refer_row_from_db(r) for r in refer],
+        "first_order": [_first_order_row_from_db(r) for r in first],
+        "coeffs": coeffs,
+    }
+
+
+async def find_uniform_address(city: str) -> Optional[str]:
+    """
+    Адрес получения формы по городу из индекса в памяти, который обновляет фоновая синхронизация;
+    пока индекс не построен — из таблицы.
+    """
+    if not city:
+        return None
+    addresses = _last_synced.get("uniform_addresses")
+    if addresses is not None:
+        # тот же снимок, по которому синхронизация уже построила индекс, — get_city_index не перестраивает его
+        return get_city_index(addresses).lookup(city)
+    return await asyncio.to_thread(get_uniform_address_by_city, city)
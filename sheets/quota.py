@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from decouple import config
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+from resilience import Upstream
+
+logger = logging.getLogger("sheets_quota")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+# Квоты Sheets API считаются в запросах в минуту (отдельно чтение и запись)
+SHEETS_READ_PER_MINUTE = int(config("SHEETS_READ_PER_MINUTE", default="60"))
+SHEETS_WRITE_PER_MINUTE = int(config("SHEETS_WRITE_PER_MINUTE", default="60"))
+# доля бюджета, которую фоновые запросы (выгрузки админов) не трогают — она остаётся пользователям
+SHEETS_BACKGROUND_RESERVE = float(config("SHEETS_BACKGROUND_RESERVE", default="0.3"))
+SHEETS_MAX_RETRIES = int(config("SHEETS_MAX_RETRIES", default="6"))
+SHEETS_MAX_BACKOFF = float(config("SHEETS_MAX_BACKOFF", default="64"))
+
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 5xx на записи не значит, что запись не применилась (append повторно добавил бы строки) — повторяем только 429
+WRITE_RETRY_STATUSES = (429,)
+
+SHEETS_HTTP_TIMEOUT = float(config("SHEETS_HTTP_TIMEOUT", default="30"))
+# общий предохранитель Sheets для gspread и AsyncSheetsClient; запись ждёт полный таймаут
+sheets_upstream = Upstream("sheets", max_timeout=SHEETS_HTTP_TIMEOUT)
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("sheets_priority", default=PRIORITY_USER)
+
+
+@contextmanager
+def sheets_priority(priority: int):
+    """
+    Задаёт приоритет всех запросов к Sheets внутри блока.
+    Контекст переносится и в asyncio.to_thread, так что достаточно обернуть вызов.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: rate_per_minute токенов в минуту, запас до capacity.
+    """
+
+    def __init__(self, rate_per_minute: int, capacity: Optional[float] = None):
+        self.rate = max(1, rate_per_minute) / 60.0
+        # небольшой burst, чтобы в любое окно в минуту не уйти сильно выше квоты
+        self.capacity = float(capacity if capacity is not None else max(1, rate_per_minute // 4))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, reserve: float = 0.0) -> float:
+        """
+        Пытается взять токен, оставив в ведре не меньше reserve токенов.
+        Возвращает 0, если токен взят, иначе сколько секунд подождать.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens - reserve >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 + reserve - self._tokens) / self.rate
+
+
+class SheetsQuotaScheduler:
+    """
+    Единая точка ограничения запросов к Sheets API: отдельные бюджеты на чтение и запись,
+    приоритет пользовательских запросов над фоновыми и backoff с учётом Retry-After.
+    """
+
+    def __init__(self,
+                 read_per_minute: int = SHEETS_READ_PER_MINUTE,
+                 write_per_minute: int = SHEETS_WRITE_PER_MINUTE,
+                 background_reserve: float = SHEETS_BACKGROUND_RESERVE,
+                 max_retries: int = SHEETS_MAX_RETRIES,
+                 max_backoff: float = SHEETS_MAX_BACKOFF):
+        self.buckets = {"read": TokenBucket(read_per_minute), "write": TokenBucket(write_per_minute)}
+        self.background_reserve = background_reserve
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+    def _reserve(self, bucket: TokenBucket, priority: int) -> float:
+        if priority >= PRIORITY_BACKGROUND:
+            return bucket.capacity * self.background_reserve
+        return 0.0
+
+    def acquire(self, kind: str, priority: Optional[int] = None) -> None:
+        bucket = self.buckets[kind]
+        reserve = self._reserve(bucket, current_priority() if priority is None else priority)
+        while True:
+            wait = bucket.try_take(reserve)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, kind: str, priority: Optional[int] = None) -> None:
+        bucket = self.buckets[kind]
+        reserve = self._reserve(bucket, current_priority() if priority is None else priority)
+        while True:
+            wait = bucket.try_take(reserve)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Задержка перед повтором: Retry-After, если сервер его прислал, иначе экспонента с jitter.
+        """
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    delta = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(self.max_backoff, max(0.0, delta))
+                except Exception:
+                    pass
+        return min(self.max_backoff, (2 ** attempt) + random.random())
+
+
+sheets_scheduler = SheetsQuotaScheduler()
+
+
+def request_kind(method: str) -> str:
+    return "read" if method.upper() == "GET" else "write"
+
+
+def is_retryable(kind: str, status: int) -> bool:
+    return status in (RETRY_STATUSES if kind == "read" else WRITE_RETRY_STATUSES)
+
+
+class QuotaHTTPClient(HTTPClient):
+    """
+    HTTP-клиент gspread, пропускающий все запросы к Sheets API через sheets_scheduler и sheets_upstream.
+    Запросы к Drive (проверка modifiedTime) квоту Sheets не расходуют и идут напрямую.
+    Таймаут у каждого запроса свой (адаптивный), поэтому запрос отправляется через self.session сам,
+    а не через HTTPClient.request с общим self.timeout.
+    """
+
+    scheduler = sheets_scheduler
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        if "sheets.googleapis.com" not in endpoint:
+            return super().request(method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+        kind = request_kind(method)
+        attempt = 0
+        while True:
+            self.scheduler.acquire(kind)
+            with sheets_upstream.call(adaptive=kind == "read") as call:
+                response = self.session.request(method=method, url=endpoint, params=params, data=data, json=json,
+                                                files=files, headers=headers, timeout=call.timeout)
+                call.check_status(response.status_code)
+            if response.ok:
+                return response
+            status = response.status_code
+            if not is_retryable(kind, status) or attempt >= self.scheduler.max_retries:
+                raise APIError(response)
+            delay = self.scheduler.backoff(attempt, response.headers.get("Retry-After"))
+            logger.warning("Sheets %s %s returned %s, retry %d in %.1fs", method.upper(), kind, status, attempt + 1, delay)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("sheet_cache")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+Values = List[List[str]]
+
+
+class SheetValuesCache:
+    """
+    Кэш значений листов с проверкой изменений.
+
+    Перед повторной выгрузкой листа кэш спрашивает дешёвый сигнал изменения таблицы
+    (probe_modified -> modifiedTime из Drive API) и перекачивает значения только если
+    он изменился. Сам probe делается не чаще probe_interval секунд на таблицу.
+    Если probe недоступен (нет прав на Drive и т.п.), работает как обычный TTL-кэш
+    с fallback_ttl.
+
+    fetch_many(spreadsheet_id, titles) -> {title: values} — загрузка листов (batchGet).
+    """
+
+    def __init__(self,
+                 fetch_many: Callable[[str, List[str]], Dict[str, Values]],
+                 probe_modified: Optional[Callable[[str], Optional[str]]] = None,
+                 probe_interval: float = 30.0,
+                 fallback_ttl: float = 60.0,
+                 max_age: float = 3600.0):
+        self._fetch_many = fetch_many
+        self._probe_modified = probe_modified
+        self.probe_interval = probe_interval
+        self.fallback_ttl = fallback_ttl
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # (spreadsheet_id, title) -> {"values", "modified", "fetched_at"}
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # spreadsheet_id -> {"modified", "checked_at"}
+        self._probes: Dict[str, Dict[str, Any]] = {}
+
+    def _current_modified(self, spreadsheet_id: str) -> Tuple[Optional[str], bool]:
+        """
+        Возвращает (modifiedTime, probe_ok). Кэширует результат probe на probe_interval.
+        """
+        if self._probe_modified is None:
+            return None, False
+        now = time.monotonic()
+        with self._lock:
+            probe = self._probes.get(spreadsheet_id)
+            if probe and now - probe["checked_at"] < self.probe_interval:
+                return probe["modified"], probe["modified"] is not None
+        try:
+            modified = self._probe_modified(spreadsheet_id)
+        except Exception:
+            logger.warning("Change probe failed for spreadsheet %s, falling back to TTL", spreadsheet_id)
+            modified = None
+        with self._lock:
+            self._probes[spreadsheet_id] = {"modified": modified, "checked_at": now}
+        return modified, modified is not None
+
+    def _is_fresh(self, entry: Optional[Dict[str, Any]], modified: Optional[str], probe_ok: bool) -> bool:
+        if not entry:
+            return False
+        age = time.monotonic() - entry["fetched_at"]
+        if age > self.max_age:
+            return False
+        if probe_ok:
+            return entry["modified"] == modified
+        return age < self.fallback_ttl
+
+    def get_many(self, spreadsheet_id: str, titles: Iterable[str]) -> Dict[str, Values]:
+        titles = list(titles)
+        modified, probe_ok = self._current_modified(spreadsheet_id)
+        out: Dict[str, Values] = {}
+        stale: List[str] = []
+        with self._lock:
+            for title in titles:
+                entry = self._entries.get((spreadsheet_id, title))
+                if self._is_fresh(entry, modified, probe_ok):
+                    out[title] = entry["values"]
+                else:
+                    stale.append(title)
+        if stale:
+            fetched = self._fetch_many(spreadsheet_id, stale)
+            now = time.monotonic()
+            with self._lock:
+                for title, values in fetched.items():
+                    self._entries[(spreadsheet_id, title)] = {"values": values, "modified": modified, "fetched_at": now}
+            out.update(fetched)
+        return out
+
+    def get(self, spreadsheet_id: str, title: str) -> Optional[Values]:
+        return self.get_many(spreadsheet_id, [title]).get(title)
+
+    def invalidate(self, spreadsheet_id: str, title: Optional[str] = None) -> None:
+        with self._lock:
+            if title is None:
+                for key in [k for k in self._entries if k[0] == spreadsheet_id]:
+                    self._entries.pop(key, None)
+            else:
+                self._entries.pop((spreadsheet_id, title), None)
+
+    def apply_row(self, spreadsheet_id: str, title: str, row_number: int, row: List[Any]) -> None:
+        """
+        Записывает строку (1-based номер) в закэшированный снимок, не перечитывая лист.
+        Снимок заменяется копией, чтобы не менять списки, которые уже отданы читателям.
+        """
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, title))
+            if not entry or not row_number or row_number < 1:
+                return
+            values = list(entry["values"])
+            width = len(values[0]) if values else len(row)
+            while len(values) < row_number:
+                values.append([""] * width)
+            new_row = ["" if v is None else str(v) for v in row]
+            new_row += [""] * (width - len(new_row))
+            values[row_number - 1] = new_row
+            entry["values"] = values
+
+    def apply_cells(self, spreadsheet_id: str, title: str, row_number: int, cells: Dict[int, Any]) -> None:
+        """
+        Обновляет отдельные ячейки строки (cells: {1-based колонка: значение}) в снимке.
+        """
+        with self._lock:
+            entry = self._entries.get((spreadsheet_id, title))
+            if not entry or not row_number or row_number > len(entry["values"]):
+                return
+            values = list(entry["values"])
+            new_row = list(values[row_number - 1])
+            for col, value in cells.items():
+                while len(new_row) < col:
+                    new_row.append("")
+                new_row[col - 1] = "" if value is None else str(value)
+            values[row_number - 1] = new_row
+            entry["values"] = values
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import quote
+
+import aiohttp
+from decouple import config
+from google.auth.transport.requests import Request as GoogleAuthRequest
+
+from sheets.quota import SHEETS_HTTP_TIMEOUT, SheetsQuotaScheduler, is_retryable, request_kind, sheets_scheduler, \
+    sheets_upstream
+
+logger = logging.getLogger("sheets_api")
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+SHEETS_API_BASE_URL = config("SHEETS_API_BASE_URL", default="https://sheets.googleapis.com/v4").rstrip("/")
+SHEETS_POOL_SIZE = int(config("SHEETS_POOL_SIZE", default="20"))
+
+
+class SheetsAPIError(Exception):
+    def __init__(self, status: int, text: str):
+        super().__init__(f"Sheets API returned {status}: {text[:500]}")
+        self.status = status
+        self.text = text
+
+
+def sheet_range(title: str, cells: Optional[str] = None) -> str:
+    """
+    A1-диапазон с экранированным названием листа: "'Лист 1'!A1:K".
+    """
+    quoted = "'" + (title or "").replace("'", "''") + "'"
+    return f"{quoted}!{cells}" if cells else quoted
+
+
+class AsyncSheetsClient:
+    """
+    Асинхронный клиент Google Sheets API v4 поверх одной общей aiohttp-сессии.
+
+    credentials_factory — функция, возвращающая google Credentials (обновляются в потоке);
+    token_provider — альтернатива для тестов/стабов: корутина, возвращающая готовый токен.
+    base_url можно направить на локальный стаб-сервер.
+    Все запросы проходят через scheduler (квоты чтения/записи, повторы на 429, для чтения и на 5xx).
+    """
+
+    def __init__(self,
+                 credentials_factory: Optional[Callable[[], Any]] = None,
+                 token_provider: Optional[Callable[[], Awaitable[str]]] = None,
+                 base_url: str = SHEETS_API_BASE_URL,
+                 timeout: float = SHEETS_HTTP_TIMEOUT,
+                 pool_size: int = SHEETS_POOL_SIZE,
+                 scheduler: SheetsQuotaScheduler = sheets_scheduler):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.scheduler = scheduler
+        self._credentials_factory = credentials_factory
+        self._token_provider = token_provider
+        self._credentials = None
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _token(self) -> str:
+        if self._token_provider is not None:
+            return await self._token_provider()
+        if self._credentials_factory is None:
+            raise RuntimeError("AsyncSheetsClient: no credentials configured")
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._credentials is None:
+                self._credentials = self._credentials_factory()
+            if not self._credentials.valid:
+                await asyncio.to_thread(self._credentials.refresh, GoogleAuthRequest())
+            return self._credentials.token
+
+    async def _request(self, method: str, path: str,
+                       params: Optional[Any] = None,
+                       json: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        session = await self._get_session()
+        url = f"{self.base_url}{path}"
+        kind = request_kind(method)
+        attempt = 0
+        while True:
+            await self.scheduler.acquire_async(kind)
+            headers = {"Authorization": f"Bearer {await self._token()}"}
+            with sheets_upstream.call(ceiling=self.timeout, adaptive=kind == "read") as call:
+                async with session.request(method, url, params=params, json=json, headers=headers,
+                                           timeout=aiohttp.ClientTimeout(total=call.timeout)) as resp:
+                    text = await resp.text()
+                    status, retry_after = resp.status, resp.headers.get("Retry-After")
+                    try:
+                        data = await resp.json(content_type=None) if status < 400 and text else {}
+                    except Exception:
+                        logger.warning("Non-JSON Sheets response for %s %s: %.300s", method, path, text)
+                        data = {}
+                call.check_status(status)
+            if is_retryable(kind, status) and attempt < self.scheduler.max_retries:
+                delay = self.scheduler.backoff(attempt, retry_after)
+                logger.warning("Sheets %s %s returned %s, retry %d in %.1fs", method, path, status, attempt + 1, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if status >= 400:
+                raise SheetsAPIError(status, text)
+            return data
+
+    async def values_get(self, spreadsheet_id: str, range_: str,
+                         params: Optional[Dict[str, Any]] = None) -> List[List[str]]:
+        path = f"/spreadsheets/{spreadsheet_id}/values/{quote(range_, safe='')}"
+        res = await self._request("GET", path, params=params)
+        return res.get("values") or []
+
+    async def values_batch_get(self, spreadsheet_id: str, ranges: List[str],
+                               params: Optional[Dict[str, Any]] = None) -> List[List[List[str]]]:
+        """
+        Возвращает значения диапазонов в том же порядке, что и ranges.
+        """
+        query = [("ranges", r) for r in ranges] + list((params or {}).items())
+        res = await self._request("GET", f"/spreadsheets/{spreadsheet_id}/values:batchGet", params=query)
+        return [vr.get("values") or [] for vr in (res.get("valueRanges") or [])]
+
+    async def values_append(self, spreadsheet_id: str, range_: str, values: List[List[Any]],
+                            value_input_option: str = "USER_ENTERED",
+                            insert_data_option: str = "INSERT_ROWS") -> Dict[str, Any]:
+        path = f"/spreadsheets/{spreadsheet_id}/values/{quote(range_, safe='')}:append"
+        params = {"valueInputOption": value_input_option, "insertDataOption": insert_data_option}
+        return await self._request("POST", path, params=params, json={"values": values})
+
+    async def values_batch_update(self, spreadsheet_id: str, data: List[Dict[str, Any]],
+                                  value_input_option: str = "USER_ENTERED") -> Dict[str, Any]:
+        """
+        data — список {"range": "...", "values": [[...], ...]}.
+        """
+        body = {"valueInputOption": value_input_option, "data": data}
+        return await self._request("POST", f"/spreadsheets/{spreadsheet_id}/values:batchUpdate", json=body)
+
+    async def values_batch_clear(self, spreadsheet_id: str, ranges: List[str]) -> Dict[str, Any]:
+        return await self._request("POST", f"/spreadsheets/{spreadsheet_id}/values:batchClear",
+                                   json={"ranges": ranges})
+
+    async def get_sheet_properties(self, spreadsheet_id: str, title: str) -> Optional[Dict[str, Any]]:
+        """
+        properties листа (sheetId, gridProperties и т.д.) или None, если листа нет.
+        """
+        res = await self._request("GET", f"/spreadsheets/{spreadsheet_id}", params={"fields": "sheets.properties"})
+        for sheet in res.get("sheets") or []:
+            props = sheet.get("properties") or {}
+            if props.get("title") == title:
+                return props
+        return None
+
+    async def batch_update(self, spreadsheet_id: str, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        spreadsheets:batchUpdate — структурные изменения (addSheet, deleteDimension и т.п.).
+        """
+        return await self._request("POST", f"/spreadsheets/{spreadsheet_id}:batchUpdate",
+                                   json={"requests": requests})
+
+    async def add_sheet(self, spreadsheet_id: str, title: str, rows: int = 1000, cols: int = 20) -> Dict[str, Any]:
+        return await self.batch_update(spreadsheet_id, [{
+            "addSheet": {"properties": {"title": title, "gridProperties": {"rowCount": rows, "columnCount": cols}}}
+        }])
+
+    async def append_dimension(self, spreadsheet_id: str, sheet_id: int, length: int,
+                               dimension: str = "ROWS") -> Dict[str, Any]:
+        return await self.batch_update(spreadsheet_id, [{
+            "appendDimension": {"sheetId": sheet_id, "dimension": dimension, "length": length}
+        }])
@@ -6,9 +6,13 @@ from typing import Any, Dict, List
 import requests
 from decouple import config
 
+from resilience import Upstream, CircuitOpenError
+
 WIGLE_API_NAME = config("WIGLE_API_NAME", default="")
 WIGLE_API_TOKEN = config("WIGLE_API_TOKEN", default="")
 WIGLE_API_URL = "https://api.wigle.net/api/v2/network/search"
+# при недоступном WiGLE сразу отдаём локальный список точек, не дожидаясь таймаутов и повторов
+wigle_upstream = Upstream("wigle", max_timeout=10)
 
 
 def _default_wifi_points() -> List[Dict[str, Any]]:
@@ -140,7 +144,7 @@ def _query_wigle_near(lat: float, lon: float, radius_m: float = 50.0, max_result
 
     for attempt in range(1, max_retries + 1):
         try:
-            resp = requests.get(WIGLE_API_URL, params=params, auth=auth, timeout=10)
+            resp = wigle_upstream.request(requests.get, WIGLE_API_URL, params=params, auth=auth, timeout=10)
             if resp.status_code == 200:
                 try:
                     data = resp.json()
@@ -164,6 +168,9 @@ def _query_wigle_near(lat: float, lon: float, radius_m: float = 50.0, max_result
                 logger.warning("WiGLE API returned {}: {:.300}", resp.status_code, resp.text)
                 return []
 
+        except CircuitOpenError as e:
+            logger.warning("{}", e)
+            return []
         except requests.RequestException:
             logger.exception("Error querying WiGLE API")
             time.sleep(2 * attempt)